@@ -1,21 +1,52 @@
 import pandas as pd
 import os
+import sys
+import json
+import time
+import argparse
 from datetime import datetime
 
+import almacen
+import almacen_sqlite
+import consultas
+import esquema
+import filtros
+import integridad
+import rendimiento
+import secuencias
+from indices import IndiceClave, IndiceTrigramas, indice_trigramas
+
 # Carpeta donde están los CSV
 CARPETA = r"C:\\BELTRAN\\Ciencia\\MINERIA\\TP1"
 
+# Cargar las tablas en representación compacta (categóricos, enteros angostos, fechas)
+MODO_COMPACTO = False
+
+# Antes de guardar, verificar que los cambios no introduzcan claves duplicadas ni foráneas huérfanas
+VERIFICAR_INTEGRIDAD = False
+
 def listar_csv():
-    #Listar todos los archivos CSV disponibles
-    archivos = [f for f in os.listdir(CARPETA) if f.endswith(".csv")]
+    #Listar todas las tablas disponibles (CSV o migradas a la base SQLite)
+    archivos = almacen.listar_tablas(CARPETA)
     return archivos
 
 def cargar_datos(archivo):
     #Cargar datos desde CSV o crear DataFrame vacío si no existe
     ruta = os.path.join(CARPETA, archivo)
     try:
-        df = pd.read_csv(ruta)
+        #La versión se toma antes de leer: si otro escribe durante la lectura, se nota al guardar
+        with rendimiento.medir("cargar_datos", tabla=archivo) as medicion:
+            version = almacen.version_tabla(ruta)
+            df = almacen.leer_tabla(ruta)
+            if MODO_COMPACTO:
+                df = esquema.compactar_tipos(df, esquema.esquema_tabla(ruta))
+            medicion.filas = len(df)
         print(f" Archivo '{archivo}' cargado con éxito ({len(df)} registros)")
+        if MODO_COMPACTO:
+            antes = df.attrs["bytes_sin_compactar"] / 1024**2
+            despues = df.memory_usage(deep=True).sum() / 1024**2
+            print(f" Memoria: {antes:.2f} MB -> {despues:.2f} MB (modo compacto)")
+        df.attrs["version_tabla"] = version
         return df, ruta
     except FileNotFoundError:
         print(f" El archivo '{archivo}' no existe, se creará uno nuevo al guardar.")
@@ -24,18 +55,66 @@ def cargar_datos(archivo):
         print(f" Error al cargar el archivo: {e}")
         return pd.DataFrame(), ruta
 
-def guardar_datos(df, ruta):
-    #Guardar DataFrame en archivo CSV
+def guardar_datos(df, ruta, cambios=None):
+    #Guardar cambios: si hay un registro de cambios por clave se anexan las
+    #inserciones y el resto va al diario; si no, se reescribe el CSV completo.
+    #Si otra sesión guardó desde que se cargó la tabla, los cambios se combinan
+    #con los suyos, salvo que toquen los mismos registros
+    if VERIFICAR_INTEGRIDAD and not confirmar_integridad(df, ruta, cambios):
+        print("  Guardado cancelado.")
+        return False
+    if cambios is None:
+        cambios = almacen.RegistroCambios(df.attrs.get("version_tabla"))
+        cambios.forzar_reescritura()
     try:
-        df.to_csv(ruta, index=False)
+        with rendimiento.medir("guardar_datos", filas=len(df), tabla=os.path.basename(ruta),
+                               reescritura=cambios.reescritura_completa):
+            combinado = almacen.confirmar_cambios(ruta, cambios, df)
+        cambios.limpiar()
         print(f" Cambios guardados en '{os.path.basename(ruta)}'")
+        if combinado:
+            print("  Otra sesión guardó cambios mientras tanto; se combinaron con los suyos.")
+            print("  Vuelva a abrir la tabla para verlos.")
         return True
+    except almacen.ConflictoEscritura as e:
+        print("  No se guardó: otra sesión cambió los mismos registros.")
+        for conflicto in e.conflictos:
+            print(f"   - {conflicto}")
+        print("  Vuelva a abrir la tabla y repita los cambios.")
+        return False
     except Exception as e:
         print(f" Error al guardar: {e}")
         return False
 
-def detectar_columna_id(df):
+def confirmar_integridad(df, ruta, cambios=None):
+    #Verificar lo que tocan los cambios contra las demás tablas; si introducen
+    #problemas, pedir confirmación
+    informe = integridad.verificar_cambios(ruta, df, cambios)
+    if not integridad.hay_problemas(informe):
+        return True
+    print("   Problemas de integridad:")
+    for linea in integridad.formatear_informe(informe):
+        print(f"   - {linea}")
+    return input("   ¿Guardar de todos modos? (s/n): ").lower() == 's'
+
+def mostrar_integridad():
+    #Verificar la integridad referencial de toda la carpeta
+    informe = integridad.verificar(CARPETA)
+    print(f"\n {informe['tablas']} tablas verificadas en {informe['segundos']:.2f} s")
+    lineas = integridad.formatear_informe(informe)
+    for linea in lineas:
+        print(f"   - {linea}")
+    if not lineas:
+        print("   Sin problemas de integridad")
+
+def detectar_columna_id(df, ruta=None):
    #Detectar automáticamente la columna que funciona como ID
+    # Si se conoce la tabla, la clave sale del esquema registrado
+    if ruta is not None:
+        clave = esquema.columna_clave(ruta)
+        if clave in df.columns:
+            return clave
+    
     # Patrones comunes para columnas de ID
     patrones_id = [
         'id', 'ID', 'Id', 'codigo', 'cod', 'codigo', 'numero', 'nro', 
@@ -52,22 +131,30 @@ def detectar_columna_id(df):
                 return col
         
         # Verificar si la columna tiene valores únicos y secuenciales (como un ID)
-        if (df[col].dtype in ['int64', 'float64'] and 
+        if (pd.api.types.is_numeric_dtype(df[col]) and 
             df[col].is_monotonic_increasing and 
             len(df[col].unique()) == len(df)):
             return col
     
     # Si no encuentra, usar la primera columna numérica
-    columnas_numericas = df.select_dtypes(include=['int64', 'float64']).columns
+    columnas_numericas = df.select_dtypes(include='number').columns
     if len(columnas_numericas) > 0:
         return columnas_numericas[0]
     
     # Si no hay columnas numéricas, usar la primera columna
     return df.columns[0] if len(df.columns) > 0 else None
 
-def obtener_siguiente_id(df, columna_id):
-    #Obtener el siguiente ID automáticamente
-    if df.empty or columna_id is None:
+def obtener_siguiente_id(df, columna_id, ruta=None):
+    #Obtener el siguiente ID automáticamente: de la secuencia persistente de la
+    #tabla si se conoce su ruta, si no a partir del máximo de la columna
+    if columna_id is None:
+        return 1
+    if ruta is not None:
+        try:
+            return secuencias.consultar(ruta, columna_id, df)
+        except Exception as e:
+            print(f" No se pudo leer la secuencia de IDs: {e}")
+    if df.empty:
         return 1
     
     if columna_id in df.columns:
@@ -103,7 +190,7 @@ def mostrar_datos(df, limite=None):
     # Mostrar información adicional
     print(f"\n Total de registros: {len(df)}")
 
-def insertar_registro(df):
+def insertar_registro(df, cambios=None, ruta=None, indice_clave=None):
     #Insertar un nuevo registro con validación y ID automático
     if df.empty:
         print(" No se puede insertar porque no hay columnas definidas en el CSV.")
@@ -114,8 +201,8 @@ def insertar_registro(df):
     print(" Escriba 'atras' en cualquier momento para volver al menú anterior")
     
     # Detectar columna de ID automáticamente
-    columna_id = detectar_columna_id(df)
-    siguiente_id = obtener_siguiente_id(df, columna_id)
+    columna_id = detectar_columna_id(df, ruta)
+    siguiente_id = obtener_siguiente_id(df, columna_id, ruta)
     
     if columna_id:
        # print(f"\n  COLUMNA DE ID DETECTADA: '{columna_id}'")
@@ -143,8 +230,13 @@ def insertar_registro(df):
                 else:
                     valor = valor_input
                     
-                    # Validar que el ID no exista
-                    if col in df.columns:
+                    # Validar que el ID no exista (con el índice de claves si lo hay)
+                    if indice_clave is not None and indice_clave.columna == col:
+                        if valor in indice_clave:
+                            print(f"     ERROR: El {col} '{valor}' ya existe")
+                            print(f"     El siguiente ID disponible es: {siguiente_id}")
+                            continue
+                    elif col in df.columns:
                         try:
                             # Intentar convertir a numérico para comparar
                             valor_num = pd.to_numeric(valor, errors='coerce')
@@ -187,7 +279,7 @@ def insertar_registro(df):
                 continue
             
             # Validar tipos de datos basados en datos existentes
-            if not df.empty and df[col].dtype in ['int64', 'float64']:
+            if not df.empty and pd.api.types.is_numeric_dtype(df[col]):
                 try:
                     if '.' in str(valor):
                         valor = float(valor)
@@ -200,13 +292,39 @@ def insertar_registro(df):
             nuevo[col] = valor
             break
     
+    # Reservar el ID en la secuencia (otra sesión pudo haber tomado el sugerido)
+    if ruta is not None and columna_id:
+        try:
+            if nuevo[columna_id] == siguiente_id:
+                nuevo[columna_id] = secuencias.reservar(ruta, columna_id, df=df)
+                if nuevo[columna_id] != siguiente_id:
+                    print(f"  El ID {siguiente_id} ya fue tomado; se usará {nuevo[columna_id]}")
+            else:
+                secuencias.registrar_uso(ruta, columna_id, nuevo[columna_id], df=df)
+        except Exception as e:
+            print(f" No se pudo actualizar la secuencia de IDs: {e}")
+    
     # Agregar el nuevo registro
-    nuevo_df = pd.DataFrame([nuevo])
-    df = pd.concat([df, nuevo_df], ignore_index=True)
+    df = almacen.concatenar_filas(df, pd.DataFrame([nuevo]))
+    if cambios is not None:
+        cambios.insertar(nuevo)
     print("  Registro insertado exitosamente")
     return df, False
 
-def modificar_registro(df):
+def registrar_por_clave(df, cambios, indice_clave=None):
+    #Columna clave para identificar filas en el diario; si no es única, los
+    #cambios no se pueden expresar por clave y habrá que reescribir el archivo
+    if indice_clave is not None:
+        columna_id, unica = indice_clave.columna, indice_clave.unico
+    else:
+        columna_id = detectar_columna_id(df)
+        unica = columna_id is not None and df[columna_id].is_unique
+    if not unica:
+        cambios.forzar_reescritura()
+        return None
+    return columna_id
+
+def modificar_registro(df, cambios=None, indice_clave=None):
     #Modificar registro existente con mejoras
     if df.empty:
         print(" No hay registros para modificar.")
@@ -216,19 +334,33 @@ def modificar_registro(df):
     print(" Escriba 'atras' en cualquier momento para volver al menú anterior")
     
     try:
-        indice_input = input(f"\n Ingrese el índice (fila) a modificar (0-{len(df)-1}): ").strip()
+        por_clave = indice_clave is not None and indice_clave.unico
+        if por_clave:
+            indice_input = input(f"\n Ingrese el {indice_clave.columna} del registro a modificar: ").strip()
+        else:
+            indice_input = input(f"\n Ingrese el índice (fila) a modificar (0-{len(df)-1}): ").strip()
         
         # Opción para volver al menú anterior
         if indice_input.lower() == 'atras':
             print(" Volviendo al menú anterior...")
             return df, True
         
-        indice = int(indice_input)
+        if por_clave:
+            indice = indice_clave.posicion(indice_input, df)
+            if indice is None:
+                print(f"  No existe un registro con {indice_clave.columna} = {indice_input}.")
+                return df, False
+        else:
+            indice = int(indice_input)
         
         if 0 <= indice < len(df):
             print(f"\n Modificando registro {indice}:")
             print(df.iloc[indice])
             
+            columna_id = registrar_por_clave(df, cambios, indice_clave) if cambios is not None else None
+            clave = df.at[indice, columna_id] if columna_id else None
+            modificados, anteriores = {}, {}
+            
             for col in df.columns:
                 actual = df.at[indice, col]
                 nuevo = input(f" {col} [actual: {actual}]: ").strip()
@@ -240,7 +372,7 @@ def modificar_registro(df):
                 
                 if nuevo != "":
                     # Validar tipo de dato
-                    if df[col].dtype in ['int64', 'float64']:
+                    if pd.api.types.is_numeric_dtype(df[col]):
                         try:
                             if '.' in nuevo:
                                 nuevo = float(nuevo)
@@ -250,8 +382,12 @@ def modificar_registro(df):
                             print(f" Valor no válido para '{col}'. Se mantiene el valor actual.")
                             continue
                     
-                    df.at[indice, col] = nuevo
+                    almacen.asignar_valor(df, indice, col, nuevo)
+                    modificados[col] = nuevo
+                    anteriores[col] = actual
             
+            if columna_id:
+                cambios.modificar(columna_id, clave, modificados, anteriores)
             print("  Registro modificado exitosamente")
         else:
             print("  Índice fuera de rango.")
@@ -260,7 +396,7 @@ def modificar_registro(df):
     
     return df, False
 
-def eliminar_registro(df):
+def eliminar_registro(df, cambios=None, indice_clave=None):
     #Eliminar registro con confirmación
     if df.empty:
         print(" No hay registros para eliminar.")
@@ -270,14 +406,24 @@ def eliminar_registro(df):
     print(" Escriba 'atras' en cualquier momento para volver al menú anterior")
     
     try:
-        indice_input = input(f"\n Ingrese el índice (fila) a eliminar (0-{len(df)-1}): ").strip()
+        por_clave = indice_clave is not None and indice_clave.unico
+        if por_clave:
+            indice_input = input(f"\n Ingrese el {indice_clave.columna} del registro a eliminar: ").strip()
+        else:
+            indice_input = input(f"\n Ingrese el índice (fila) a eliminar (0-{len(df)-1}): ").strip()
         
         # Opción para volver al menú anterior
         if indice_input.lower() == 'atras':
             print(" Volviendo al menú anterior...")
             return df, True
         
-        indice = int(indice_input)
+        if por_clave:
+            indice = indice_clave.posicion(indice_input, df)
+            if indice is None:
+                print(f"  No existe un registro con {indice_clave.columna} = {indice_input}.")
+                return df, False
+        else:
+            indice = int(indice_input)
         
         if 0 <= indice < len(df):
             print(f"\n REGISTRO A ELIMINAR:")
@@ -289,6 +435,9 @@ def eliminar_registro(df):
                 print(" Volviendo al menú anterior...")
                 return df, True
             elif confirmar == 's':
+                columna_id = registrar_por_clave(df, cambios, indice_clave) if cambios is not None else None
+                if columna_id:
+                    cambios.eliminar(columna_id, df.at[indice, columna_id], df.iloc[indice].to_dict())
                 df = df.drop(indice).reset_index(drop=True)
                 print("  Registro eliminado exitosamente")
             else:
@@ -300,55 +449,121 @@ def eliminar_registro(df):
     
     return df, False
 
-def buscar_registros(df):
-    #Buscar registros por criterios
+def obtener_indice_texto(df, columna, indices_texto, ruta=None):
+    #Índice de trigramas de la columna: se construye la primera vez que se busca
+    #en ella (o se lee de la caché en disco si la tabla no tiene cambios sin guardar)
+    if columna not in indices_texto:
+        columna_id = detectar_columna_id(df, ruta)
+        if ruta is not None:
+            indices_texto[columna] = indice_trigramas(ruta, df, columna, columna_id)
+        else:
+            indices_texto[columna] = IndiceTrigramas.construir(df, columna, columna_id)
+    return indices_texto[columna]
+
+def filtrar_registros(df, columna, valor_buscar, indices_texto=None, ruta=None):
+    #Filas de df cuyo valor en columna coincide con valor_buscar
+    valor_buscar = str(valor_buscar)
+    try:
+        if pd.api.types.is_numeric_dtype(df[columna]):
+            # Búsqueda numérica
+            if '.' in valor_buscar:
+                valor_buscar = float(valor_buscar)
+            else:
+                valor_buscar = int(valor_buscar)
+            return df[df[columna] == valor_buscar]
+        elif indices_texto is not None:
+            # Búsqueda textual (case insensitive) con el índice de trigramas
+            indice = obtener_indice_texto(df, columna, indices_texto, ruta)
+            return df.iloc[indice.buscar(valor_buscar)]
+        else:
+            # Búsqueda textual (case insensitive)
+            return df[df[columna].astype(str).str.lower().str.contains(valor_buscar.lower())]
+    except ValueError:
+        # Si falla la conversión, buscar como texto
+        return df[df[columna].astype(str).str.lower().str.contains(valor_buscar.lower())]
+
+# Filas por página en los resultados de una búsqueda
+LIMITE_FILAS_PAGINA = 20
+
+def buscar_registros(df, columnas_filtro):
+    #Buscar registros con varias condiciones combinadas (ver filtros.py). columnas_filtro
+    #son las columnas normalizadas de df, que se reutilizan entre búsquedas
     if df.empty:
         print(" No hay registros para buscar.")
         return
     
     print(f"\n  BUSCAR REGISTROS")
     print(f" Columnas disponibles: {list(df.columns)}")
-    print(" Escriba 'atras' en cualquier momento para volver al menú anterior")
+    print(f" Operadores: {', '.join(filtros.OPERADORES)}")
+    print(" Escriba una condición por línea como 'columna operador valor', por ejemplo:")
+    print("   precio entre 1000 5000      ('*' deja abierto un extremo)")
+    print("   id_rubro en 1,2,3")
+    print("   descripcion contiene led")
+    print(" Línea vacía para terminar, 'atras' para volver al menú anterior")
     
-    columna = input(" Ingrese la columna para buscar: ").strip()
+    condiciones = []
+    while True:
+        texto = input(f" Condición {len(condiciones) + 1}: ").strip()
+        
+        # Opción para volver al menú anterior
+        if texto.lower() == 'atras':
+            print(" Volviendo al menú anterior...")
+            return
+        
+        if not texto:
+            if condiciones:
+                break
+            print("  Ingrese al menos una condición.")
+            continue
+        try:
+            condicion = filtros.condicion_desde_texto(texto)
+            # Se valida cada condición al ingresarla para poder corregirla
+            filtros.compilar(condicion, df)
+        except ValueError as e:
+            print(f"  {e}")
+            continue
+        condiciones.append(condicion)
     
-    # Opción para volver al menú anterior
-    if columna.lower() == 'atras':
-        print(" Volviendo al menú anterior...")
-        return
+    conector = "y"
+    if len(condiciones) > 1:
+        respuesta = input(" ¿Deben cumplirse todas (y) o alguna (o)? [y]: ").strip().lower()
+        conector = "o" if respuesta == "o" else "y"
     
-    if columna not in df.columns:
-        print("  Columna no válida.")
-        return
+    texto_columnas = input(" Columnas a mostrar (separadas por coma, Enter = todas): ").strip()
+    columnas = [col.strip() for col in texto_columnas.split(",") if col.strip()]
+    try:
+        filtros.validar_columnas(df, columnas)
+    except ValueError as e:
+        print(f"  {e}; se muestran todas.")
+        columnas = []
     
-    valor_buscar = input(f" Ingrese el valor a buscar en '{columna}': ").strip()
+    with rendimiento.medir("buscar_registros", filas=len(df), condiciones=len(condiciones)) as medicion:
+        posiciones = columnas_filtro.posiciones(filtros.compilar({conector: condiciones}, df))
+        medicion.detalles["encontrados"] = len(posiciones)
     
-    # Opción para volver al menú anterior
-    if valor_buscar.lower() == 'atras':
-        print(" Volviendo al menú anterior...")
+    if len(posiciones) == 0:
+        print("  No se encontraron registros que coincidan con la búsqueda.")
         return
     
-    # Realizar búsqueda
-    try:
-        if df[columna].dtype in ['int64', 'float64']:
-            # Búsqueda numérica
-            if '.' in valor_buscar:
-                valor_buscar = float(valor_buscar)
-            else:
-                valor_buscar = int(valor_buscar)
-            resultados = df[df[columna] == valor_buscar]
+    print(f"\n  Se encontraron {len(posiciones)} registros:")
+    paginas = filtros.cantidad_paginas(len(posiciones), LIMITE_FILAS_PAGINA)
+    numero = 1
+    while True:
+        print(filtros.pagina(df, posiciones, numero, LIMITE_FILAS_PAGINA, columnas))
+        if paginas == 1:
+            return
+        print(f"  Página {numero} de {paginas}")
+        respuesta = input(" Enter = página siguiente, número = ir a esa página, 'atras' = terminar: ").strip().lower()
+        if respuesta == 'atras':
+            return
+        if respuesta.isdigit() and 1 <= int(respuesta) <= paginas:
+            numero = int(respuesta)
+        elif respuesta:
+            print("  Página no válida.")
+        elif numero < paginas:
+            numero += 1
         else:
-            # Búsqueda textual (case insensitive)
-            resultados = df[df[columna].astype(str).str.lower().str.contains(valor_buscar.lower())]
-    except ValueError:
-        # Si falla la conversión, buscar como texto
-        resultados = df[df[columna].astype(str).str.lower().str.contains(valor_buscar.lower())]
-    
-    if len(resultados) > 0:
-        print(f"\n  Se encontraron {len(resultados)} registros:")
-        print(resultados)
-    else:
-        print("  No se encontraron registros que coincidan con la búsqueda.")
+            return
 
 def seleccionar_archivo():
     #Seleccionar archivo CSV - MENÚ PRINCIPAL
@@ -366,12 +581,18 @@ def seleccionar_archivo():
         print("\n Archivos CSV disponibles:")
         for i, f in enumerate(archivos, 1):
             print(f"  {i}. {f}")
-        print(f"  {len(archivos) + 1}.  Salir del programa")
+        print(f"  {len(archivos) + 1}.  Consulta SQL sobre todas las tablas")
+        print(f"  {len(archivos) + 2}.  Rendimiento (tiempos, filas y memoria por operación)")
+        print(f"  {len(archivos) + 3}.  Salir del programa")
 
         try:
-            opcion = input(f"\n Seleccione una opción (1-{len(archivos) + 1}): ").strip()
+            opcion = input(f"\n Seleccione una opción (1-{len(archivos) + 3}): ").strip()
             
             if opcion == str(len(archivos) + 1):
+                return "consulta"
+            elif opcion == str(len(archivos) + 2):
+                return "rendimiento"
+            elif opcion == str(len(archivos) + 3):
                 print("  ¡Adios!")
                 return "salir"
             elif opcion.isdigit() and 1 <= int(opcion) <= len(archivos):
@@ -382,9 +603,88 @@ def seleccionar_archivo():
         except ValueError:
             print("  Debe ingresar un número válido.")
 
+# Archivo por defecto al volcar las mediciones de rendimiento desde el menú
+ARCHIVO_RENDIMIENTO = "rendimiento.jsonl"
+
+def menu_rendimiento():
+    #Mediciones de cargar, guardar, buscar y exportar tomadas en esta ejecución
+    while True:
+        print(f"\n{'_'*50}")
+        print(" RENDIMIENTO")
+        print(f"{'_'*50}")
+        estado = "activa" if rendimiento.activo() else "desactivada"
+        if rendimiento.registro():
+            estado += f" (registro en {rendimiento.registro()})"
+        print(f" Medición: {estado}")
+        tabla = rendimiento.resumen()
+        if tabla.empty:
+            print(" Todavía no hay operaciones medidas.")
+        else:
+            print(tabla.to_string(index=False))
+        print(f"\n1. {'Desactivar' if rendimiento.activo() else 'Activar'} la medición")
+        print("2. Volcar las mediciones a un archivo JSON lines")
+        print("3. Descartar las mediciones")
+        print("0. Volver al menú principal")
+        opcion = input(" Seleccione una opción: ").strip()
+        if opcion == "1":
+            if rendimiento.activo():
+                rendimiento.desactivar()
+            else:
+                rendimiento.activar(rendimiento.registro())
+        elif opcion == "2":
+            destino = input(f" Archivo (Enter = {ARCHIVO_RENDIMIENTO}): ").strip() or ARCHIVO_RENDIMIENTO
+            try:
+                print(f"  {rendimiento.volcar(destino)} mediciones escritas en '{destino}'")
+            except OSError as e:
+                print(f"  No se pudo escribir el archivo: {e}")
+        elif opcion == "3":
+            rendimiento.limpiar()
+            print("  Mediciones descartadas.")
+        elif opcion == "0" or opcion.lower() == 'atras':
+            return
+        else:
+            print("  Opción no válida. Por favor, seleccione 0-3.")
+
+# Filas del resultado de una consulta SQL que se muestran
+LIMITE_FILAS_CONSULTA = 50
+
+def consulta_sql():
+    #Consultas SQL sobre todas las tablas de la carpeta (uniones entre CSV, agrupaciones...)
+    print("\n Las tablas se nombran como sus archivos sin extensión (p. ej. factura_det).")
+    print(" Termine la consulta con ';' o con una línea vacía.")
+    print(" Escriba 'atras' para volver al menú principal")
+    while True:
+        lineas = []
+        while True:
+            linea = input(" SQL> " if not lineas else "  ... ")
+            if not lineas and linea.strip().lower() == "atras":
+                return
+            if not linea.strip():
+                break
+            lineas.append(linea)
+            if linea.rstrip().endswith(";"):
+                break
+        if not lineas:
+            continue
+        
+        try:
+            resultado, informe = consultas.ejecutar(CARPETA, "\n".join(lineas))
+        except Exception as e:
+            print(f"  Error en la consulta: {e}")
+            continue
+        print(resultado.head(LIMITE_FILAS_CONSULTA).to_string(index=False))
+        if len(resultado) > LIMITE_FILAS_CONSULTA:
+            print(f"  ... y {len(resultado) - LIMITE_FILAS_CONSULTA} filas más")
+        origen = "resultado en caché" if informe["desde_cache"] else informe["motor"]
+        print(f"\n {len(resultado)} filas en {informe['segundos'] * 1000:.1f} ms ({origen})")
+
 def menu_archivo(archivo, df, ruta):
     #Menú para operaciones específicas del archivo
     cambios_pendientes = False
+    cambios = almacen.RegistroCambios(df.attrs.get("version_tabla"))
+    indice_clave = None
+    indices_texto = {}  # columna -> IndiceTrigramas
+    columnas_filtro = None  # filtros.ColumnasNormalizadas de df para las búsquedas
     
     while True:
         print(f"\n{'_'*50}")
@@ -392,6 +692,11 @@ def menu_archivo(archivo, df, ruta):
         print(f"  REGISTROS: {len(df)}")
         if cambios_pendientes:
             print("   Hay cambios pendientes por guardar")
+        if almacen.base_sqlite(ruta) is not None:
+            print(f"   Almacenamiento: base SQLite ({almacen_sqlite.ARCHIVO_BASE})")
+        pendientes_diario = len(almacen.leer_diario(ruta))
+        if pendientes_diario:
+            print(f"   Diario: {pendientes_diario} cambios sin compactar")
         print(f"{'_'*50}")
         print("1.  Mostrar datos")
         print("2.  Insertar registro")
@@ -401,33 +706,46 @@ def menu_archivo(archivo, df, ruta):
         print("6.  Guardar cambios")
         print("7.  Guardar y volver al menú principal")
         print("8.  Volver al menú principal sin guardar")
+        print("9.  Compactar archivo (volcar el diario al CSV)")
+        print("10. Resincronizar secuencia de IDs con los datos")
+        print("11. Verificar integridad referencial de la carpeta")
         print("0.  Salir del programa")
         print("_"*50)
 
         opcion = input(" Seleccione una opción: ").strip()
 
+        # Índice hash de la columna clave, construido una vez y mantenido con cada cambio
+        if opcion in ["2", "3", "4"] and indice_clave is None and not df.empty:
+            columna_id = detectar_columna_id(df, ruta)
+            if columna_id is not None:
+                indice_clave = IndiceClave.construir(df, columna_id)
+        operaciones_previas = len(cambios)
+
         if opcion == "1":
             mostrar_datos(df)
         elif opcion == "2":
-            df, cancelado = insertar_registro(df)
+            df, cancelado = insertar_registro(df, cambios, ruta, indice_clave)
             if not cancelado:
                 cambios_pendientes = True
         elif opcion == "3":
-            df, cancelado = modificar_registro(df)
+            df, cancelado = modificar_registro(df, cambios, indice_clave)
             if not cancelado:
                 cambios_pendientes = True
         elif opcion == "4":
-            df, cancelado = eliminar_registro(df)
+            df, cancelado = eliminar_registro(df, cambios, indice_clave)
             if not cancelado:
                 cambios_pendientes = True
         elif opcion == "5":
-            buscar_registros(df)
+            if columnas_filtro is None:
+                columnas_filtro = filtros.ColumnasNormalizadas(df, indice_texto=lambda columna: obtener_indice_texto(
+                    df, columna, indices_texto, None if cambios_pendientes else ruta))
+            buscar_registros(df, columnas_filtro)
         elif opcion == "6":
-            if guardar_datos(df, ruta):
+            if guardar_datos(df, ruta, cambios):
                 cambios_pendientes = False
         elif opcion == "7":
             if cambios_pendientes:
-                if guardar_datos(df, ruta):
+                if guardar_datos(df, ruta, cambios):
                     print("  Cambios guardados. Volviendo al menú principal...")
                 else:
                     print("  No se pudieron guardar los cambios.")
@@ -441,6 +759,29 @@ def menu_archivo(archivo, df, ruta):
                 print("  Los cambios no guardados se perderán.")
             print("  Volviendo al menú principal...")
             return True  # Volver al menú principal
+        elif opcion == "9":
+            if cambios_pendientes:
+                print("   Guarde los cambios pendientes antes de compactar.")
+            else:
+                with almacen.bloqueo(ruta):
+                    vigente = almacen.version_tabla(ruta) == cambios.version_base
+                    aplicadas = almacen.compactar(ruta)
+                    # Compactar no cambia el contenido: si nadie más escribió, los próximos
+                    # cambios parten de la versión compactada (si no, se combinarán al guardar)
+                    if vigente:
+                        cambios.version_base = almacen.version_tabla(ruta)
+                print(f"  Archivo compactado ({aplicadas} cambios volcados al CSV)")
+        elif opcion == "10":
+            columna_id = detectar_columna_id(df, ruta)
+            if columna_id is None:
+                print("  La tabla no tiene columna de ID.")
+            else:
+                siguiente = secuencias.resincronizar(ruta, columna_id, df)
+                print(f"  Secuencia de '{columna_id}' resincronizada. Siguiente ID: {siguiente}")
+        elif opcion == "11":
+            if cambios_pendientes:
+                print("   Se verifica lo guardado en disco; los cambios pendientes no se incluyen.")
+            mostrar_integridad()
         elif opcion == "0":
             if cambios_pendientes:
                 confirmar = input("   Hay cambios sin guardar. ¿Está seguro de salir? (s/n): ").lower()
@@ -449,14 +790,219 @@ def menu_archivo(archivo, df, ruta):
             print("  ¡Adios!")
             return False  # Salir del programa
         else:
-            print("  Opción no válida. Por favor, seleccione 0-8.")
+            print("  Opción no válida. Por favor, seleccione 0-11.")
+
+        if opcion in ["2", "3", "4"]:
+            # Las columnas normalizadas no se mantienen con los cambios: se vuelven a convertir
+            columnas_filtro = None
+            if cambios.reescritura_completa:
+                indice_clave = None
+                indices_texto.clear()
+            else:
+                nuevas = cambios.operaciones[operaciones_previas:]
+                for indice in [indice_clave, *indices_texto.values()]:
+                    if indice is not None:
+                        indice.aplicar_operaciones(nuevas, df)
 
         # Pausa para continuar
         if opcion not in ["7", "8", "0"]:
             input("\n ⏎ Presione Enter para continuar...")
 
+# ---------------------------------------------------------------------------
+# Modo por lotes (sin menús): python 1TP.py --script operaciones.jsonl
+#
+# Cada línea del script es un objeto JSON con "op" y "tabla"; las líneas vacías
+# o que empiezan con # se ignoran. Operaciones:
+#   {"op": "insertar", "tabla": "cliente.csv", "fila": {"nombre": "Ana", ...}}
+#   {"op": "modificar", "tabla": "cliente.csv", "clave": 5, "valores": {"nombre": "Ana"}}
+#   {"op": "eliminar", "tabla": "cliente.csv", "clave": 5}
+#   {"op": "buscar", "tabla": "cliente.csv", "columna": "nombre", "valor": "ana"}
+#   {"op": "filtrar", "tabla": "producto.csv", "filtro": {"y": [
+#       {"columna": "precio", "op": "entre", "valor": [1000, 5000]},
+#       {"columna": "id_rubro", "op": "en", "valor": [1, 2]}]}, "columnas": ["descripcion"]}
+#   {"op": "guardar", "tabla": "cliente.csv"}   (sin "tabla": todas las modificadas)
+# Las tablas se cargan una vez y los cambios se guardan al final, una escritura
+# por tabla (o antes, con "guardar").
+# ---------------------------------------------------------------------------
+
+# Filas de resultado que se muestran por búsqueda en modo por lotes
+LIMITE_RESULTADOS_LOTE = 20
+
+def _tabla_lote(tablas, nombre):
+    #Estado en memoria de una tabla del script; se carga la primera vez que se usa
+    if nombre not in tablas:
+        if nombre not in listar_csv():
+            raise ValueError(f"La tabla '{nombre}' no existe")
+        df, ruta = cargar_datos(nombre)
+        columna_id = detectar_columna_id(df, ruta) if not df.empty else None
+        tablas[nombre] = {
+            "df": df,
+            "ruta": ruta,
+            "cambios": almacen.RegistroCambios(df.attrs.get("version_tabla")),
+            "indice": IndiceClave.construir(df, columna_id) if columna_id is not None else None,
+            "textos": {},
+        }
+    return tablas[nombre]
+
+def _posicion_lote(tabla, clave):
+    #Posición de la fila con esa clave (la tabla debe tener clave única)
+    indice = tabla["indice"]
+    if indice is None or not indice.unico:
+        raise ValueError("La tabla no tiene una columna clave única")
+    posicion = indice.posicion(clave, tabla["df"])
+    if posicion is None:
+        raise ValueError(f"No existe un registro con {indice.columna} = {clave}")
+    return posicion
+
+def aplicar_operacion_lote(operacion, tablas):
+    #Aplicar una operación del script en memoria. Devuelve un texto con el resultado
+    op = operacion.get("op")
+    if op == "guardar":
+        nombres = [operacion["tabla"]] if operacion.get("tabla") else list(tablas)
+        resultados = {nombre: guardar_tabla_lote(tablas[nombre]) for nombre in nombres if nombre in tablas}
+        no_guardadas = [nombre for nombre, guardada in resultados.items() if guardada is False]
+        if no_guardadas:
+            raise ValueError(f"No se guardó: {', '.join(no_guardadas)}")
+        return f"{sum(1 for guardada in resultados.values() if guardada)} tablas guardadas"
+    tabla = _tabla_lote(tablas, operacion["tabla"])
+    df, cambios, indice = tabla["df"], tabla["cambios"], tabla["indice"]
+    previas = len(cambios)
+    if op == "insertar":
+        fila = dict(operacion["fila"])
+        desconocidas = [col for col in fila if col not in df.columns]
+        if desconocidas:
+            raise ValueError(f"Columnas inexistentes: {', '.join(desconocidas)}")
+        if indice is not None:
+            if fila.get(indice.columna) is None:
+                fila[indice.columna] = secuencias.reservar(tabla["ruta"], indice.columna, df=df)
+            elif fila[indice.columna] in indice:
+                raise ValueError(f"El ID {fila[indice.columna]} ya existe")
+            else:
+                secuencias.registrar_uso(tabla["ruta"], indice.columna, fila[indice.columna], df=df)
+        cambios.insertar(fila)
+        df = almacen.concatenar_filas(df, pd.DataFrame([fila]))
+        resultado = f"insertado{f' {indice.columna}={fila[indice.columna]}' if indice is not None else ''}"
+    elif op == "modificar":
+        posicion = _posicion_lote(tabla, operacion["clave"])
+        valores = operacion["valores"]
+        desconocidas = [col for col in valores if col not in df.columns]
+        if desconocidas:
+            raise ValueError(f"Columnas inexistentes: {', '.join(desconocidas)}")
+        clave = df.at[posicion, indice.columna]
+        anteriores = {col: df.at[posicion, col] for col in valores}
+        for col, valor in valores.items():
+            almacen.asignar_valor(df, posicion, col, valor)
+        cambios.modificar(indice.columna, clave, valores, anteriores)
+        resultado = f"modificado {indice.columna}={clave}"
+    elif op == "eliminar":
+        posicion = _posicion_lote(tabla, operacion["clave"])
+        clave = df.at[posicion, indice.columna]
+        cambios.eliminar(indice.columna, clave, df.iloc[posicion].to_dict())
+        df = df.drop(posicion).reset_index(drop=True)
+        resultado = f"eliminado {indice.columna}={clave}"
+    elif op == "buscar":
+        if operacion["columna"] not in df.columns:
+            raise ValueError(f"Columna inexistente: {operacion['columna']}")
+        pendientes = len(cambios) > 0
+        resultados = filtrar_registros(df, operacion["columna"], operacion["valor"],
+                                       tabla["textos"], None if pendientes else tabla["ruta"])
+        if len(resultados) > 0:
+            print(resultados.head(LIMITE_RESULTADOS_LOTE).to_string())
+        return f"{len(resultados)} registros encontrados"
+    elif op == "filtrar":
+        # Expresión de filtros.py; solo se muestran las columnas pedidas
+        columnas = operacion.get("columnas")
+        filtros.validar_columnas(df, columnas)
+        posiciones = filtros.filtrar(df, operacion["filtro"])
+        if len(posiciones) > 0:
+            print(filtros.pagina(df, posiciones, tamano=LIMITE_RESULTADOS_LOTE, columnas=columnas).to_string())
+        return f"{len(posiciones)} registros encontrados"
+    else:
+        raise ValueError(f"Operación desconocida: {op}")
+
+    tabla["df"] = df
+    for indice_tabla in [indice, *tabla["textos"].values()]:
+        if indice_tabla is not None:
+            indice_tabla.aplicar_operaciones(cambios.operaciones[previas:], df)
+    return resultado
+
+def guardar_tabla_lote(tabla):
+    #Guardar los cambios acumulados de una tabla del script. Devuelve True si se
+    #guardaron, False si no se pudo (conflicto o error) y None si no había cambios
+    if len(tabla["cambios"]) == 0 and not tabla["cambios"].reescritura_completa:
+        return None
+    return guardar_datos(tabla["df"], tabla["ruta"], tabla["cambios"])
+
+def ejecutar_script(lineas, seguir=False):
+    #Ejecutar un script de operaciones. Devuelve la cantidad de operaciones fallidas.
+    #Ante un error se detiene sin guardar nada, salvo con seguir=True
+    tablas = {}
+    fallidas = 0
+    inicio_total = time.perf_counter()
+    for numero, linea in enumerate(lineas, 1):
+        linea = linea.strip()
+        if not linea or linea.startswith("#"):
+            continue
+        inicio = time.perf_counter()
+        try:
+            operacion = json.loads(linea)
+            resultado = aplicar_operacion_lote(operacion, tablas)
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            # OSError incluye el TimeoutError del bloqueo de una tabla o de las secuencias
+            fallidas += 1
+            print(f" [línea {numero}] ERROR: {e}")
+            if not seguir:
+                print("  Script detenido; no se guardó ningún cambio pendiente.")
+                return fallidas
+            continue
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        print(f" [línea {numero}] {operacion.get('op')} {operacion.get('tabla', '')}: "
+              f"{resultado} ({milisegundos:.1f} ms)")
+
+    # Una sola escritura por tabla modificada; una tabla que no se pudo guardar cuenta como fallida
+    for nombre, tabla in tablas.items():
+        inicio = time.perf_counter()
+        guardada = guardar_tabla_lote(tabla)
+        if guardada:
+            print(f" [guardar] {nombre} ({(time.perf_counter() - inicio) * 1000:.1f} ms)")
+        elif guardada is False:
+            fallidas += 1
+            print(f" [guardar] {nombre}: ERROR, los cambios no se guardaron")
+    print(f"  Script terminado en {time.perf_counter() - inicio_total:.2f} s "
+          f"({fallidas} operaciones fallidas)")
+    return fallidas
+
 def main():
     #Programa principal mejorado
+    global CARPETA
+    parser = argparse.ArgumentParser(description="Gestor de archivos CSV")
+    parser.add_argument("--script", help="Ejecutar las operaciones de este archivo ('-' para stdin) sin menús")
+    parser.add_argument("--carpeta", help="Carpeta de los CSV (por defecto CARPETA)")
+    parser.add_argument("--seguir", action="store_true", help="En modo script, continuar ante errores")
+    parser.add_argument("--migrar-sqlite", action="store_true",
+                        help="Copiar los CSV de la carpeta a una base SQLite y salir")
+    parser.add_argument("--rendimiento", nargs="?", const="", metavar="REGISTRO",
+                        help="Medir tiempos, filas y memoria desde el inicio; con un archivo, "
+                             "agregar cada medición en formato JSON lines")
+    args = parser.parse_args()
+    if args.carpeta:
+        CARPETA = args.carpeta
+    if args.rendimiento is not None:
+        rendimiento.activar(args.rendimiento or None)
+    if args.migrar_sqlite:
+        for archivo, filas in almacen_sqlite.migrar(CARPETA).items():
+            print(f" {archivo}: {'ya estaba en la base' if filas is None else f'{filas} filas migradas'}")
+        return
+    if args.script:
+        if args.script == "-":
+            fallidas = ejecutar_script(sys.stdin, args.seguir)
+        else:
+            with open(args.script, encoding="utf-8") as f:
+                fallidas = ejecutar_script(f, args.seguir)
+        if rendimiento.activo() and rendimiento.mediciones():
+            print(rendimiento.resumen().to_string(index=False))
+        sys.exit(1 if fallidas else 0)
+    
     print(" INICIANDO GESTOR AVANZADO DE ARCHIVOS CSV")
     
     while True:
@@ -467,6 +1013,12 @@ def main():
             break
         elif resultado is None:
             continue
+        elif resultado == "consulta":
+            consulta_sql()
+            continue
+        elif resultado == "rendimiento":
+            menu_rendimiento()
+            continue
         else:
             archivo = resultado
             
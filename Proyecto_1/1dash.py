@@ -7,7 +7,22 @@ import json
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import io
+
+import almacen
+import esquema
+import estadisticas
+import exportacion
+import filtros
+import importacion
+import integridad
+import reduccion
+import rendimiento
+import secuencias
+import cubo
+import consultas
+import vistas
+from indices import IndiceClave, IndicePrefijos, indice_trigramas
+from cache_tablas import CacheTablas
 
 # Configuración de la página
 st.set_page_config(
@@ -20,33 +35,240 @@ st.set_page_config(
 # Carpeta donde están los CSV
 CARPETA_DATOS = "Proyecto_1"  # o el nombre de tu carpeta
 
+# Presupuesto de memoria de la caché de tablas compartida entre sesiones
+LIMITE_MEMORIA_CACHE_MB = 512
+
+# Cargar las tablas en representación compacta (categóricos, enteros angostos, fechas)
+MODO_COMPACTO = True
+
+# Antes de guardar, verificar que los cambios no introduzcan claves duplicadas ni foráneas huérfanas
+VERIFICAR_INTEGRIDAD = True
+
+# Registros que ofrece como máximo el selector de Modificar/Eliminar
+LIMITE_SELECTOR = 50
+
+# Archivo JSON lines donde se agrega cada medición de rendimiento (None: solo en memoria)
+REGISTRO_RENDIMIENTO = None
+
+# Condiciones que se pueden combinar en la pestaña de búsqueda
+MAXIMO_CONDICIONES = 8
+
+# Opciones de filas por página en los resultados de la búsqueda
+TAMANOS_PAGINA = [25, 50, 100, 500]
+
+# Consulta que se ofrece al abrir la pestaña de SQL
+CONSULTA_EJEMPLO = """SELECT r.descripcion AS rubro, SUM(d.cantidad * p.precio) AS importe
+FROM factura_det d
+JOIN producto p ON p.id_producto = d.id_producto
+JOIN rubro r ON r.id_rubro = p.id_rubro
+WHERE d.cantidad >= 1
+GROUP BY r.descripcion
+ORDER BY importe DESC"""
+
 # Verificar si la carpeta existe
 if not os.path.exists(CARPETA_DATOS):
     st.error(f"❌ No se encontró la carpeta: {CARPETA_DATOS}")
     st.info("Asegúrate de que los archivos CSV estén en una carpeta llamada 'data' en tu repositorio")
 else:
     # Cargar archivos CSV
-    archivos_csv = [f for f in os.listdir(CARPETA_DATOS) if f.endswith('.csv')]
+    archivos_csv = almacen.listar_tablas(CARPETA_DATOS)
     
     if not archivos_csv:
         st.error("❌ No se encontraron archivos CSV en la carpeta especificada.")
     else:
         st.success(f"✅ Se encontraron {len(archivos_csv)} archivos CSV")
 
-def guardar_datos(df, ruta):
-    """Guardar DataFrame en archivo CSV"""
+def listar_csv():
+    """Listar todos los archivos CSV disponibles"""
+    if not os.path.exists(CARPETA_DATOS):
+        return []
+    return almacen.listar_tablas(CARPETA_DATOS)
+
+def leer_tabla(ruta):
+    """Leer la tabla de disco, compactándola si MODO_COMPACTO está activo.
+
+    Los archivos Parquet o Arrow exportados se leen tal cual (no tienen diario
+    ni esquema registrado).
+    """
+    if exportacion.es_columnar(ruta):
+        df = exportacion.leer_exportacion(ruta)
+        return esquema.compactar_tipos(df) if MODO_COMPACTO else df
+    df = almacen.leer_tabla(ruta)
+    if MODO_COMPACTO:
+        df = esquema.compactar_tipos(df, esquema.esquema_tabla(ruta))
+    return df
+
+@st.cache_resource
+def obtener_cache_tablas():
+    """Caché de tablas única para todas las sesiones del proceso"""
+    return CacheTablas(LIMITE_MEMORIA_CACHE_MB * 1024**2, cargador=leer_tabla)
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _cubo_ventas(huellas):
+    return cubo.actualizar_cubo(CARPETA_DATOS)[0]
+
+def obtener_cubo_ventas():
+    """Cubo de ventas al día; se recalcula solo cuando cambian las tablas de origen"""
+    return _cubo_ventas(json.dumps(vistas.huellas_origen(CARPETA_DATOS), sort_keys=True))
+
+def cargar_datos(archivo):
+    """Cargar datos desde la caché compartida o crear DataFrame vacío si no existe.
+
+    archivo puede ser una tabla CSV o una exportación Parquet/Arrow (de solo
+    lectura). El DataFrame devuelto es compartido entre sesiones: no
+    modificarlo en el lugar.
+    """
+    ruta = os.path.join(CARPETA_DATOS, archivo)
+    try:
+        with rendimiento.medir("cargar_datos", tabla=archivo) as medicion:
+            df = obtener_cache_tablas().obtener(ruta)
+            medicion.filas = len(df)
+        return df, ruta
+    except FileNotFoundError:
+        return pd.DataFrame(), ruta
+    except Exception as e:
+        st.error(f"Error al cargar el archivo: {e}")
+        return pd.DataFrame(), ruta
+
+def guardar_datos(df, ruta, cambios=None):
+    """Guardar cambios en el CSV.
+
+    Con un RegistroCambios se anexan las inserciones y el resto va al diario de
+    la tabla; sin él (o si los cambios no se pueden identificar por clave) se
+    reescribe el archivo completo. Los cambios se confirman sobre su versión
+    base (ver almacen.confirmar_cambios): si otra sesión guardó mientras
+    tanto se combinan fila por fila, y si tocan lo mismo no se guarda nada.
+    Con VERIFICAR_INTEGRIDAD no se guarda si los cambios introducen claves
+    duplicadas o foráneas huérfanas (solo se revisan las claves que tocan;
+    ver integridad.verificar_cambios).
+    """
+    if exportacion.es_columnar(ruta):
+        st.error("Los archivos Parquet/Arrow exportados son de solo lectura")
+        return False
+    if VERIFICAR_INTEGRIDAD:
+        informe = integridad.verificar_cambios(ruta, df, cambios)
+        if integridad.hay_problemas(informe):
+            st.error("No se guardó: los cambios dejarían problemas de integridad referencial\n\n" +
+                     "\n".join(f"- {linea}" for linea in integridad.formatear_informe(informe)))
+            return False
+    if cambios is None:
+        cambios = almacen.RegistroCambios(df.attrs.get("version_tabla"))
+        cambios.forzar_reescritura()
     try:
-        df.to_csv(ruta, index=False)
+        cache = obtener_cache_tablas()
+        version_anterior = cambios.version_base
+        with rendimiento.medir("guardar_datos", filas=len(df), tabla=os.path.basename(ruta),
+                               reescritura=cambios.reescritura_completa):
+            combinado = almacen.confirmar_cambios(ruta, cambios, df, cargar_actual=lambda: cache.obtener(ruta))
+        if combinado or cambios.reescritura_completa:
+            # df no tiene lo que guardaron otros: la próxima lectura trae la tabla combinada
+            cache.invalidar(ruta)
+            if combinado:
+                st.toast("Tus cambios se combinaron con los que otra sesión guardó mientras tanto")
+        else:
+            # La caché pasa a la nueva versión actualizando sus índices en lugar de recargar;
+            # confirmar_cambios dejó en version_base la versión escrita, tomada bajo el bloqueo
+            cache.reemplazar(ruta, version_anterior, cambios.version_base, df, cambios)
         return True
+    except almacen.ConflictoEscritura as e:
+        st.error("No se guardó: otra sesión cambió los mismos registros. Vuelve a cargarlos y repite el cambio.\n\n" +
+                 "\n".join(f"- {conflicto}" for conflicto in e.conflictos))
+        return False
     except Exception as e:
         st.error(f"Error al guardar: {e}")
         return False
 
-def detectar_columna_id(df):
-    """Detectar automáticamente la columna que funciona como ID"""
+def obtener_indice_clave(ruta, columna_id):
+    """Índice hash de la columna clave de la tabla, compartido en la caché"""
+    return obtener_cache_tablas().derivado(
+        ruta, ("clave", columna_id), lambda df: IndiceClave.construir(df, columna_id))
+
+def obtener_indice_texto(ruta, columna):
+    """Índice de trigramas de una columna de texto (se construye en la primera búsqueda)"""
+    return obtener_cache_tablas().derivado(
+        ruta, ("trigramas", columna),
+        lambda df: indice_trigramas(ruta, df, columna, detectar_columna_id(df, ruta)))
+
+def obtener_indice_prefijos(ruta, columna):
+    """Índice ordenado de una columna para buscar por prefijo (se construye en la primera búsqueda)"""
+    return obtener_cache_tablas().derivado(
+        ruta, ("prefijos", columna), lambda df: IndicePrefijos.construir(df, columna))
+
+def obtener_columnas_filtro(ruta):
+    """Columnas normalizadas de la tabla para los filtros de búsqueda, compartidas en la caché"""
+    return obtener_cache_tablas().derivado(
+        ruta, ("columnas_filtro",),
+        lambda df: filtros.ColumnasNormalizadas(
+            df, indice_texto=lambda columna: obtener_indice_texto(ruta, columna)))
+
+def selector_registros(df, ruta, clave):
+    """Buscador de registros por el comienzo del valor de una columna (la clave por defecto).
+
+    Devuelve las posiciones de hasta LIMITE_SELECTOR filas que coinciden; solo
+    esas filas se muestran en las opciones de los widgets. clave distingue los
+    widgets de cada pestaña.
+    """
+    columnas = df.columns.tolist()
+    columna_id = detectar_columna_id(df, ruta)
+    col_columna, col_prefijo = st.columns([1, 2])
+    with col_columna:
+        columna = st.selectbox("Buscar por:", columnas, key=f"{clave}_columna",
+                               index=columnas.index(columna_id) if columna_id in columnas else 0)
+    with col_prefijo:
+        prefijo = st.text_input("Valor (o comienzo del valor):", key=f"{clave}_prefijo")
+    
+    if prefijo:
+        posiciones = obtener_indice_prefijos(ruta, columna).buscar(prefijo, LIMITE_SELECTOR + 1)
+    else:
+        posiciones = np.arange(min(len(df), LIMITE_SELECTOR + 1))
+    if len(posiciones) > LIMITE_SELECTOR:
+        st.caption(f"Se muestran los primeros {LIMITE_SELECTOR} registros; escribe más caracteres para acotar la búsqueda.")
+        posiciones = posiciones[:LIMITE_SELECTOR]
+    elif prefijo and len(posiciones) == 0:
+        st.info("Ningún registro coincide con la búsqueda.")
+    return [int(pos) for pos in posiciones]
+
+def describir_registro(df, pos):
+    """Texto de una fila para las opciones de un selector"""
+    return f"Registro {pos}: " + ", ".join(f"{k}={v}" for k, v in df.iloc[pos].items())
+
+def obtener_estadisticas(ruta):
+    """Estadísticas de una pasada de la tabla (ver estadisticas.py), guardadas en
+    disco por versión y memorizadas en la caché de tablas"""
+    if exportacion.es_columnar(ruta):
+        return obtener_cache_tablas().derivado(ruta, ("estadisticas",), estadisticas.de_dataframe)
+    return obtener_cache_tablas().derivado(
+        ruta, ("estadisticas",), lambda df: estadisticas.actualizar_estadisticas(ruta)[0])
+
+def descarga_diferida(ruta, df, formato, **opciones):
+    """Función para el data de st.download_button: la exportación se genera
+    (o se toma de las ya generadas) recién cuando se hace clic"""
+    def generar():
+        with open(exportacion.exportar(ruta, df, formato, **opciones), "rb") as f:
+            return f.read()
+    return generar
+
+def registrar_por_clave(df, cambios, ruta=None):
+    """Columna clave para anotar cambios en el diario (None si no identifica filas)"""
+    columna_id = detectar_columna_id(df, ruta)
+    if columna_id is None or not df[columna_id].is_unique:
+        cambios.forzar_reescritura()
+        return None
+    return columna_id
+
+def detectar_columna_id(df, ruta=None):
+    """Detectar automáticamente la columna que funciona como ID.
+
+    Si se conoce la ruta de la tabla, la clave sale del esquema registrado.
+    """
     if df.empty:
         return None
     
+    if ruta is not None and not exportacion.es_columnar(ruta):
+        clave = esquema.columna_clave(ruta)
+        if clave in df.columns:
+            return clave
+    
     # Patrones comunes para columnas de ID
     patrones_id = [
         'id', 'ID', 'Id', 'codigo', 'cod', 'codigo', 'numero', 'nro', 
@@ -63,7 +285,7 @@ def detectar_columna_id(df):
                 return col
         
         # Verificar si la columna tiene valores únicos y secuenciales (como un ID)
-        if (df[col].dtype in ['int64', 'float64'] and 
+        if (pd.api.types.is_numeric_dtype(df[col]) and 
             len(df[col].unique()) == len(df)):
             # Verificar si es secuencial (aproximadamente)
             valores_ordenados = sorted(df[col].unique())
@@ -73,15 +295,26 @@ def detectar_columna_id(df):
                     return col
     
     # Si no encuentra, usar la primera columna numérica
-    columnas_numericas = df.select_dtypes(include=['int64', 'float64']).columns
+    columnas_numericas = df.select_dtypes(include='number').columns
     if len(columnas_numericas) > 0:
         return columnas_numericas[0]
     
     return None
 
-def obtener_siguiente_id(df, columna_id):
-    """Obtener el siguiente ID automáticamente"""
-    if df.empty or columna_id is None:
+def obtener_siguiente_id(df, columna_id, ruta=None):
+    """Obtener el siguiente ID automáticamente.
+
+    Si se conoce la ruta de la tabla se usa su secuencia persistente; si no,
+    el máximo de la columna.
+    """
+    if columna_id is None:
+        return 1
+    if ruta is not None:
+        try:
+            return secuencias.consultar(ruta, columna_id, df)
+        except Exception as e:
+            st.warning(f"No se pudo leer la secuencia de IDs: {e}")
+    if df.empty:
         return 1
     
     if columna_id in df.columns:
@@ -101,95 +334,126 @@ def obtener_siguiente_id(df, columna_id):
     
     return siguiente
 
-def generar_graficos(df):
-    """Generar gráficos estadísticos basados en los datos"""
-    graficos = []
-    
-    # Identificar columnas numéricas y categóricas
+def especificaciones_graficos(df):
+    """Gráficos que corresponden a la tabla: lista de (spec, título).
+
+    Solo mira nombres y tipos de columnas; los datos se recorren recién al
+    construir cada gráfico con construir_grafico.
+    """
     columnas_numericas = df.select_dtypes(include=[np.number]).columns.tolist()
-    columnas_categoricas = df.select_dtypes(include=['object']).columns.tolist()
-    
-    # Gráfico 1: Distribución de variables numéricas
-    if len(columnas_numericas) > 0:
-        for col in columnas_numericas[:3]:  # Máximo 3 columnas numéricas
-            try:
-                fig = px.histogram(df, x=col, title=f'Distribución de {col}', 
-                                 template='plotly_white')
-                fig.update_layout(height=400)
-                graficos.append((f"hist_{col}", fig))
-            except Exception as e:
-                st.warning(f"No se pudo generar histograma para {col}: {e}")
-    
-    # Gráfico 2: Boxplot para variables numéricas
+    columnas_categoricas = df.select_dtypes(include=['object', 'category']).columns.tolist()
+    columnas_fecha = [col for col in df.columns if 'fecha' in col.lower() or 'date' in col.lower() or 'time' in col.lower()]
+    especificaciones = []
+    for col in columnas_numericas[:3]:  # Máximo 3 columnas numéricas
+        especificaciones.append((("hist", col), f'Distribución de {col}'))
     if len(columnas_numericas) > 0:
-        try:
-            fig = px.box(df, y=columnas_numericas[:3], 
-                        title='Diagrama de Caja - Variables Numéricas',
-                        template='plotly_white')
-            fig.update_layout(height=400)
-            graficos.append(("boxplot", fig))
-        except Exception as e:
-            st.warning(f"No se pudo generar boxplot: {e}")
-    
-    # Gráfico 3: Conteo de categorías
-    if len(columnas_categoricas) > 0:
-        for col in columnas_categoricas[:2]:  # Máximo 2 columnas categóricas
-            try:
-                counts = df[col].value_counts().head(10)  # Top 10 categorías
-                fig = px.bar(x=counts.index, y=counts.values, 
-                           title=f'Top 10 - {col}',
-                           labels={'x': col, 'y': 'Count'},
-                           template='plotly_white')
-                fig.update_layout(height=400)
-                graficos.append((f"bar_{col}", fig))
-            except Exception as e:
-                st.warning(f"No se pudo generar gráfico de barras para {col}: {e}")
-    
-    # Gráfico 4: Correlación entre variables numéricas
+        especificaciones.append((("box", *columnas_numericas[:3]), 'Diagrama de Caja - Variables Numéricas'))
+    for col in columnas_categoricas[:2]:  # Máximo 2 columnas categóricas
+        especificaciones.append((("bar", col), f'Top 10 - {col}'))
     if len(columnas_numericas) >= 2:
-        try:
-            corr_matrix = df[columnas_numericas].corr()
-            fig = px.imshow(corr_matrix, 
-                          title='Matriz de Correlación',
-                          color_continuous_scale='RdBu_r',
-                          aspect="auto",
-                          template='plotly_white')
-            fig.update_layout(height=500)
-            graficos.append(("correlation", fig))
-        except Exception as e:
-            st.warning(f"No se pudo generar matriz de correlación: {e}")
-    
-    # Gráfico 5: Scatter plot si hay al menos 2 variables numéricas
-    if len(columnas_numericas) >= 2:
-        try:
-            fig = px.scatter(df, x=columnas_numericas[0], y=columnas_numericas[1],
-                           title=f'Relación entre {columnas_numericas[0]} y {columnas_numericas[1]}',
-                           template='plotly_white')
-            fig.update_layout(height=400)
-            graficos.append(("scatter", fig))
-        except Exception as e:
-            st.warning(f"No se pudo generar scatter plot: {e}")
-    
-    # Gráfico 6: Series temporales si existe columna de fecha
-    columnas_fecha = [col for col in df.columns if 'fecha' in col.lower() or 'date' in col.lower() or 'time' in col.lower()]
+        especificaciones.append((("corr", *columnas_numericas), 'Matriz de Correlación'))
+        especificaciones.append((("scatter", columnas_numericas[0], columnas_numericas[1]),
+                                 f'Relación entre {columnas_numericas[0]} y {columnas_numericas[1]}'))
     if len(columnas_fecha) > 0 and len(columnas_numericas) > 0:
-        try:
-            fecha_col = columnas_fecha[0]
-            # Intentar convertir a datetime
-            df_temp = df.copy()
-            df_temp[fecha_col] = pd.to_datetime(df_temp[fecha_col], errors='coerce')
-            df_temp = df_temp.dropna(subset=[fecha_col])
-            
-            if len(df_temp) > 0:
-                fig = px.line(df_temp, x=fecha_col, y=columnas_numericas[0],
-                            title=f'Evolución Temporal - {columnas_numericas[0]}',
-                            template='plotly_white')
-                fig.update_layout(height=400)
-                graficos.append(("time_series", fig))
-        except Exception as e:
-            st.warning(f"No se pudo generar serie temporal: {e}")
-    
-    return graficos
+        especificaciones.append((("serie", columnas_fecha[0], columnas_numericas[0]),
+                                 f'Evolución Temporal - {columnas_numericas[0]}'))
+    return especificaciones
+
+def construir_grafico(df, spec, resumen=None):
+    """Figura de un gráfico de especificaciones_graficos (None si no hay datos).
+
+    Los datos se resumen antes de armar la figura (ver reduccion.py), así el
+    tamaño de lo que se envía al navegador no depende de la cantidad de filas.
+    La matriz de correlación sale de resumen (un EstadisticasFlujo de la tabla)
+    si se pasa; si no, se calcula sobre df.
+    """
+    tipo, columnas = spec[0], list(spec[1:])
+    if tipo == "hist":
+        col = columnas[0]
+        centros, conteos, anchos = reduccion.histograma(df[col])
+        fig = px.bar(x=centros, y=conteos, title=f'Distribución de {col}',
+                     labels={'x': col, 'y': 'count'},
+                     template='plotly_white')
+        fig.update_traces(width=anchos)
+        fig.update_layout(height=400, bargap=0)
+    elif tipo == "box":
+        # Cuartiles calculados en el servidor: cada caja son unos pocos números
+        fig = go.Figure()
+        for col in columnas:
+            caja = reduccion.cuartiles(df[col])
+            if caja is None:
+                continue
+            fig.add_trace(go.Box(name=col, q1=[caja["q1"]], median=[caja["mediana"]],
+                                 q3=[caja["q3"]], lowerfence=[caja["limite_inferior"]],
+                                 upperfence=[caja["limite_superior"]], x=[col]))
+            if len(caja["atipicos"]):
+                fig.add_trace(go.Scatter(x=[col] * len(caja["atipicos"]), y=caja["atipicos"],
+                                         mode="markers", showlegend=False, name=col))
+        fig.update_layout(title='Diagrama de Caja - Variables Numéricas',
+                          template='plotly_white', height=400)
+    elif tipo == "bar":
+        col = columnas[0]
+        counts = df[col].value_counts().head(10)  # Top 10 categorías
+        fig = px.bar(x=counts.index, y=counts.values, 
+                   title=f'Top 10 - {col}',
+                   labels={'x': col, 'y': 'Count'},
+                   template='plotly_white')
+        fig.update_layout(height=400)
+    elif tipo == "corr":
+        if resumen is None:
+            resumen = estadisticas.de_dataframe(df[columnas])
+        corr_matrix = resumen.correlacion().reindex(index=columnas, columns=columnas)
+        fig = px.imshow(corr_matrix, 
+                      title='Matriz de Correlación',
+                      color_continuous_scale='RdBu_r',
+                      aspect="auto",
+                      template='plotly_white')
+        fig.update_layout(height=500)
+    elif tipo == "scatter":
+        x, y = columnas
+        titulo = f'Relación entre {x} y {y}'
+        if len(df) > reduccion.UMBRAL_DENSIDAD:
+            # Demasiados puntos: grilla de densidad en lugar de un punto por fila
+            centros_x, centros_y, conteos = reduccion.densidad(df[x], df[y])
+            fig = go.Figure(go.Heatmap(x=centros_x, y=centros_y,
+                                       z=np.where(conteos > 0, conteos, np.nan),
+                                       colorscale='Viridis', colorbar=dict(title='filas')))
+            fig.update_layout(title=titulo, xaxis_title=x, yaxis_title=y,
+                              template='plotly_white')
+        else:
+            fig = px.scatter(df, x=x, y=y, title=titulo, template='plotly_white')
+        fig.update_layout(height=400)
+    elif tipo == "serie":
+        fecha_col, col = columnas
+        # Serie ordenada por fecha y submuestreada con LTTB
+        fechas, valores = reduccion.submuestrear_serie(df[fecha_col], df[col])
+        if len(fechas) == 0:
+            return None
+        fig = px.line(x=fechas, y=valores,
+                    labels={'x': fecha_col, 'y': col},
+                    title=f'Evolución Temporal - {col}',
+                    template='plotly_white')
+        fig.update_layout(height=400)
+    else:
+        raise ValueError(f"Gráfico desconocido: {tipo}")
+    return fig
+
+def obtener_grafico(ruta, spec):
+    """Figura memorizada en la caché de tablas junto a la versión vigente de la tabla.
+
+    Se descarta cuando la tabla cambia (guardar_datos) o sale de la caché.
+    """
+    def construir(df):
+        with rendimiento.medir("generar_graficos", filas=len(df), grafico=spec[0]):
+            return construir_grafico(df, spec, obtener_estadisticas(ruta))
+    return obtener_cache_tablas().derivado(ruta, ("grafico",) + spec, construir)
+
+def cambiar_medicion():
+    """Encender o apagar la medición de rendimiento según el interruptor de la barra lateral"""
+    if st.session_state.medir_rendimiento:
+        rendimiento.activar(REGISTRO_RENDIMIENTO)
+    else:
+        rendimiento.desactivar()
 
 def main():
     # Título principal
@@ -226,20 +490,30 @@ def main():
         with col3:
             st.metric(" Columnas", len(df.columns))
         with col4:
-            memoria = df.memory_usage(deep=True).sum() / 1024**2
-            st.metric(" Memoria", f"{memoria:.2f} MB")
+            estado_cache = obtener_cache_tablas().estadisticas()
+            memoria = estado_cache["bytes"] / 1024**2
+            memoria_original = estado_cache["bytes_sin_compactar"] / 1024**2
+            ahorro = 1 - estado_cache["bytes"] / max(estado_cache["bytes_sin_compactar"], 1)
+            st.metric(" Memoria (caché)", f"{memoria:.2f} MB",
+                      delta=f"{estado_cache['tasa_aciertos']:.0%} aciertos · -{ahorro:.0%} compacto",
+                      delta_color="off",
+                      help=f"{estado_cache['tablas']} tablas en caché, "
+                           f"{memoria_original:.2f} MB sin compactar, "
+                           f"límite {LIMITE_MEMORIA_CACHE_MB} MB")
         
         st.markdown("---")
         
         # Tabs para diferentes funcionalidades - AGREGAMOS NUEVAS PESTAÑAS
-        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
             "📋 Ver Datos", 
             "➕ Insertar", 
             "✏️ Modificar", 
             "🗑️ Eliminar", 
             "🔍 Buscar",
             "📊 Gráficos",  # NUEVA PESTAÑA
-            "💾 Exportar"   # NUEVA PESTAÑA
+            "💾 Exportar",  # NUEVA PESTAÑA
+            "🧊 Cubo de Ventas",
+            "🧮 Consulta SQL"
         ])
         
         # Tab 1: Ver Datos
@@ -262,14 +536,20 @@ def main():
                 st.warning("No se pueden insertar registros porque no hay columnas definidas.")
             else:
                 # Detectar columna de ID y siguiente ID disponible
-                columna_id = detectar_columna_id(df)
-                siguiente_id = obtener_siguiente_id(df, columna_id)
+                columna_id = detectar_columna_id(df, ruta)
+                siguiente_id = obtener_siguiente_id(df, columna_id, ruta)
                 
                 st.write("**Columnas disponibles:**", list(df.columns))
                 
                 if columna_id:
                    # st.success(f"🎯 **Columna de ID detectada:** `{columna_id}`")
-                    st.info(f"🆔 **El siguiente ID disponible es:** `{siguiente_id}`")
+                    col_info, col_sync = st.columns([4, 1])
+                    with col_info:
+                        st.info(f"🆔 **El siguiente ID disponible es:** `{siguiente_id}`")
+                    with col_sync:
+                        if st.button("🔄 Resincronizar IDs", help="Recalcular la secuencia a partir de los datos"):
+                            secuencias.resincronizar(ruta, columna_id, df)
+                            st.rerun()
                 
                 # Formulario para insertar nuevo registro
                 with st.form("form_insertar"):
@@ -308,8 +588,7 @@ def main():
                                     id_ingresado = int(nuevo_registro[columna_id])
                                     # Verificar si el ID ya existe
                                     if columna_id in df.columns:
-                                        ids_existentes = pd.to_numeric(df[columna_id], errors='coerce').dropna()
-                                        if id_ingresado in ids_existentes.values:
+                                        if id_ingresado in obtener_indice_clave(ruta, columna_id):
                                             st.error(f"❌ El ID {id_ingresado} ya existe en la base de datos.")
                                             st.info(f"💡 El siguiente ID disponible es: {siguiente_id}")
                                             st.stop()
@@ -327,7 +606,7 @@ def main():
                             # Convertir tipos de datos
                             registro_convertido = {}
                             for col, valor in nuevo_registro.items():
-                                if df[col].dtype in ['int64', 'float64']:
+                                if pd.api.types.is_numeric_dtype(df[col]):
                                     try:
                                         if '.' in valor:
                                             registro_convertido[col] = float(valor)
@@ -338,17 +617,46 @@ def main():
                                 else:
                                     registro_convertido[col] = valor
                             
-                            # Agregar el nuevo registro
-                            nuevo_df = pd.DataFrame([registro_convertido])
-                            df = pd.concat([df, nuevo_df], ignore_index=True)
+                            # Reservar el ID: si otra sesión tomó el sugerido se usa el siguiente libre
+                            if columna_id:
+                                try:
+                                    if registro_convertido[columna_id] == siguiente_id:
+                                        registro_convertido[columna_id] = secuencias.reservar(ruta, columna_id, df=df)
+                                    else:
+                                        secuencias.registrar_uso(ruta, columna_id, registro_convertido[columna_id], df=df)
+                                except Exception as e:
+                                    st.warning(f"No se pudo actualizar la secuencia de IDs: {e}")
+                            
+                            # Agregar el nuevo registro al final del CSV
+                            cambios = almacen.RegistroCambios(df.attrs.get("version_tabla"))
+                            cambios.insertar(registro_convertido)
+                            df = almacen.concatenar_filas(df, pd.DataFrame([registro_convertido]))
                             
                             # Guardar automáticamente
-                            if guardar_datos(df, ruta):
+                            if guardar_datos(df, ruta, cambios):
                                 st.success(" ✅ Registro insertado y guardado exitosamente!")
                                 st.balloons()
                                 st.rerun()
                             else:
                                 st.error(" ❌ Error al guardar el registro")
+                
+                # Importación masiva: todo el lote se valida y se guarda de una vez
+                with st.expander("📥 Importar lote desde archivo"):
+                    tipos_lote = ["csv", "json", "jsonl"]
+                    if exportacion.COLUMNARES:
+                        tipos_lote += ["parquet", "arrow", "feather"]
+                    archivo_lote = st.file_uploader("Archivo CSV, JSON, Parquet o Arrow con las filas nuevas",
+                                                    type=tipos_lote, key="importar_lote")
+                    if archivo_lote is not None and st.button("📥 Importar filas", key="importar_boton"):
+                        try:
+                            resultado = importacion.importar(ruta, archivo_lote)
+                        except ValueError as e:
+                            st.error(f"❌ Importación cancelada: {e}")
+                        else:
+                            obtener_cache_tablas().invalidar(ruta)
+                            st.success(f"✅ {resultado['insertadas']} filas importadas "
+                                       f"({resultado['ids_asignados']} IDs asignados) "
+                                       f"en {resultado['segundos']:.2f} s")
         
         # Tab 3: Modificar Registro
         with tab3:
@@ -357,17 +665,19 @@ def main():
             if df.empty:
                 st.info("No hay registros para modificar.")
             else:
-                # Seleccionar registro a modificar
+                # Seleccionar registro a modificar entre los que coinciden con la búsqueda
+                candidatos = selector_registros(df, ruta, "modificar")
                 indice_modificar = st.selectbox(
-                    "Selecciona el índice del registro a modificar:",
-                    range(len(df)),
-                    format_func=lambda x: f"Registro {x}: {dict(df.iloc[x])}"
+                    "Selecciona el registro a modificar:",
+                    candidatos,
+                    format_func=lambda x: describir_registro(df, x)
                 )
                 
-                if st.button("Cargar Registro para Modificar"):
+                if indice_modificar is not None and st.button("Cargar Registro para Modificar"):
                     registro_actual = df.iloc[indice_modificar]
                     st.session_state.registro_modificar = registro_actual.copy()
                     st.session_state.indice_modificar = indice_modificar
+                    st.session_state.version_modificar = df.attrs.get("version_tabla")
                 
                 if 'registro_modificar' in st.session_state:
                     st.subheader("Modificando Registro:")
@@ -390,26 +700,43 @@ def main():
                         submitted = st.form_submit_button(" 💾 Guardar Cambios")
                         
                         if submitted:
+                            # La tabla en caché es compartida: modificar una copia
+                            df = df.copy()
+                            registro = st.session_state.registro_modificar
+                            # Los cambios parten de la versión en que se cargó el registro
+                            cambios = almacen.RegistroCambios(st.session_state.get("version_modificar"))
+                            columna_id = registrar_por_clave(df, cambios, ruta)
+                            # Si otra sesión eliminó filas la posición cambió: se busca por clave
+                            posicion = st.session_state.indice_modificar
+                            if columna_id:
+                                posicion = obtener_indice_clave(ruta, columna_id).posicion(registro[columna_id], df)
+                            modificados, anteriores = {}, {}
                             # Aplicar cambios
                             for col, valor in registro_modificado.items():
-                                if valor != str(st.session_state.registro_modificar[col]):
+                                if posicion is not None and valor != str(registro[col]):
                                     # Convertir tipo de dato si es necesario
-                                    if df[col].dtype in ['int64', 'float64']:
+                                    if pd.api.types.is_numeric_dtype(df[col]):
                                         try:
                                             if '.' in valor:
-                                                df.at[st.session_state.indice_modificar, col] = float(valor)
+                                                valor = float(valor)
                                             else:
-                                                df.at[st.session_state.indice_modificar, col] = int(valor)
+                                                valor = int(valor)
                                         except ValueError:
-                                            df.at[st.session_state.indice_modificar, col] = valor
-                                    else:
-                                        df.at[st.session_state.indice_modificar, col] = valor
+                                            pass
+                                    almacen.asignar_valor(df, posicion, col, valor)
+                                    modificados[col] = valor
+                                    anteriores[col] = registro[col]
+                            if columna_id:
+                                cambios.modificar(columna_id, registro[columna_id], modificados, anteriores)
                             
                             # Guardar cambios
-                            if guardar_datos(df, ruta):
+                            if posicion is None:
+                                st.error(" ❌ El registro ya no existe: otra sesión lo eliminó")
+                            elif guardar_datos(df, ruta, cambios):
                                 st.success(" ✅ Registro modificado exitosamente!")
                                 del st.session_state.registro_modificar
                                 del st.session_state.indice_modificar
+                                del st.session_state.version_modificar
                                 st.rerun()
                             else:
                                 st.error(" ❌ Error al guardar los cambios")
@@ -421,13 +748,12 @@ def main():
             if df.empty:
                 st.info("No hay registros para eliminar.")
             else:
-                # Usar multiselect para selección simple
-                opciones = [f"Registro {i}: {', '.join([f'{k}={v}' for k, v in df.iloc[i].items()])}" for i in range(len(df))]
-                
+                # Usar multiselect para selección simple, sobre los registros encontrados
+                candidatos = selector_registros(df, ruta, "eliminar")
                 seleccion = st.multiselect(
                     "Selecciona los registros a eliminar:",
-                    options=range(len(df)),
-                    format_func=lambda x: f"Registro {x}: {', '.join([f'{k}={v}' for k, v in df.iloc[x].items()])}"
+                    options=candidatos,
+                    format_func=lambda x: describir_registro(df, x)
                 )
                 
                 if seleccion:
@@ -442,8 +768,15 @@ def main():
                             # Crear copia del DataFrame sin los registros seleccionados
                             df_nuevo = df.drop(seleccion).reset_index(drop=True)
                             
+                            # Anotar las eliminaciones por clave en el diario
+                            cambios = almacen.RegistroCambios(df.attrs.get("version_tabla"))
+                            columna_id = registrar_por_clave(df, cambios, ruta)
+                            if columna_id:
+                                for posicion in seleccion:
+                                    cambios.eliminar(columna_id, df[columna_id].iat[posicion], df.iloc[posicion].to_dict())
+                            
                             # Guardar en el archivo
-                            exito = guardar_datos(df_nuevo, ruta)
+                            exito = guardar_datos(df_nuevo, ruta, cambios)
                             
                             if exito:
                                 st.success(f" ✅ {len(seleccion)} registro(s) eliminado(s) exitosamente!")
@@ -469,37 +802,81 @@ def main():
             if df.empty:
                 st.info("No hay registros para buscar.")
             else:
-                col_busqueda, valor_busqueda = st.columns(2)
+                columnas = df.columns.tolist()
+                col_cantidad, col_conector = st.columns(2)
+                with col_cantidad:
+                    cantidad_condiciones = st.number_input("Condiciones:", min_value=1, max_value=MAXIMO_CONDICIONES,
+                                                           value=1, key="filtro_cantidad")
+                with col_conector:
+                    conector = st.radio("Combinar condiciones:", ["y", "o"], horizontal=True, key="filtro_conector",
+                                        format_func={"y": "Todas (Y)", "o": "Alguna (O)"}.get)
                 
-                with col_busqueda:
-                    columna_buscar = st.selectbox(
-                        "Columna para buscar:",
-                        df.columns
-                    )
+                # Cada condición: columna, operador según el tipo de la columna y valor
+                condiciones = []
+                for i in range(int(cantidad_condiciones)):
+                    col_columna, col_operador, col_valor, col_hasta = st.columns([2, 2, 2, 2])
+                    visibilidad = "visible" if i == 0 else "collapsed"
+                    with col_columna:
+                        columna = st.selectbox("Columna", columnas, key=f"filtro_columna_{i}",
+                                               label_visibility=visibilidad)
+                    tipo = filtros.tipo_columna(df[columna])
+                    with col_operador:
+                        operador = st.selectbox("Operador", filtros.OPERADORES_POR_TIPO[tipo],
+                                                format_func=filtros.OPERADORES.get,
+                                                key=f"filtro_operador_{i}_{columna}", label_visibility=visibilidad)
+                    ejemplo = "AAAA-MM-DD" if tipo == "fecha" else ""
+                    if operador == "entre":
+                        with col_valor:
+                            desde = st.text_input("Desde", key=f"filtro_desde_{i}", placeholder=ejemplo,
+                                                  label_visibility=visibilidad).strip()
+                        with col_hasta:
+                            hasta = st.text_input("Hasta", key=f"filtro_hasta_{i}", placeholder=ejemplo,
+                                                  label_visibility=visibilidad).strip()
+                        valor = [desde or None, hasta or None]
+                        completa = bool(desde or hasta)
+                    else:
+                        with col_valor:
+                            valor = st.text_input("Valor", key=f"filtro_valor_{i}",
+                                                  placeholder="1, 2, 3" if operador == "en" else ejemplo,
+                                                  label_visibility=visibilidad).strip()
+                        completa = bool(valor)
+                    # Las condiciones sin valor todavía no filtran
+                    if completa:
+                        condiciones.append({"columna": columna, "op": operador, "valor": valor})
                 
-                with valor_busqueda:
-                    valor_buscar = st.text_input("Valor a buscar:")
+                col_proyeccion, col_tamano = st.columns([3, 1])
+                with col_proyeccion:
+                    mostrar = st.multiselect("Columnas a mostrar (vacío = todas):", columnas, key="filtro_columnas")
+                with col_tamano:
+                    tamano_pagina = st.selectbox("Filas por página:", TAMANOS_PAGINA, index=1, key="filtro_tamano")
                 
-                if valor_buscar:
-                    # Realizar búsqueda
+                if not condiciones:
+                    st.info("Completa al menos una condición para buscar.")
+                else:
+                    # Las columnas normalizadas y sus resultados se reutilizan mientras la tabla no cambie
+                    columnas_filtro = obtener_columnas_filtro(ruta)
                     try:
-                        if df[columna_buscar].dtype in ['int64', 'float64']:
-                            # Búsqueda numérica
-                            if '.' in valor_buscar:
-                                valor_buscar = float(valor_buscar)
-                            else:
-                                valor_buscar = int(valor_buscar)
-                            resultados = df[df[columna_buscar] == valor_buscar]
-                        else:
-                            # Búsqueda textual
-                            resultados = df[df[columna_buscar].astype(str).str.contains(valor_buscar, case=False)]
-                    except ValueError:
-                        # Si falla la conversión, buscar como texto
-                        resultados = df[df[columna_buscar].astype(str).str.contains(valor_buscar, case=False)]
+                        with rendimiento.medir("buscar_registros", filas=columnas_filtro.filas,
+                                               condiciones=len(condiciones)) as medicion:
+                            filtro = filtros.compilar({conector: condiciones}, columnas_filtro.df)
+                            posiciones = columnas_filtro.posiciones(filtro)
+                            medicion.detalles["encontrados"] = len(posiciones)
+                    except ValueError as e:
+                        st.error(f" ❌ {e}")
+                        posiciones = None
                     
-                    if len(resultados) > 0:
-                        st.success(f" ✅ Se encontraron {len(resultados)} registros:")
-                        st.dataframe(resultados, use_container_width=True)
+                    if posiciones is None:
+                        pass
+                    elif len(posiciones) > 0:
+                        st.success(f" ✅ Se encontraron {len(posiciones)} registros:")
+                        paginas = filtros.cantidad_paginas(len(posiciones), tamano_pagina)
+                        numero_pagina = 1
+                        if paginas > 1:
+                            # La página vuelve a 1 cuando cambia el filtro o el tamaño de página
+                            numero_pagina = st.number_input(f"Página (de {paginas}):", min_value=1, max_value=paginas,
+                                                            value=1, key=f"filtro_pagina_{filtro.clave}_{tamano_pagina}")
+                        st.dataframe(filtros.pagina(columnas_filtro.df, posiciones, numero_pagina, tamano_pagina, mostrar),
+                                     use_container_width=True)
                     else:
                         st.info("No se encontraron registros que coincidan con la búsqueda.")
         
@@ -513,13 +890,22 @@ def main():
                 # Selector de tipo de gráfico
                 st.subheader("Configuración de Gráficos")
                 
-                # Generar gráficos automáticamente
+                # Cada gráfico se calcula solo al activarlo y queda en caché por versión de la tabla
                 st.subheader("Gráficos Automáticos")
-                graficos = generar_graficos(df)
+                especificaciones = especificaciones_graficos(df)
                 
-                if graficos:
-                    for nombre, fig in graficos:
-                        st.plotly_chart(fig, use_container_width=True)
+                if especificaciones:
+                    for spec, titulo in especificaciones:
+                        if st.toggle(titulo, key=f"grafico_{archivo_seleccionado}_{'_'.join(map(str, spec))}"):
+                            try:
+                                fig = obtener_grafico(ruta, spec)
+                            except Exception as e:
+                                st.warning(f"No se pudo generar el gráfico '{titulo}': {e}")
+                                continue
+                            if fig is not None:
+                                st.plotly_chart(fig, use_container_width=True)
+                            else:
+                                st.info("No hay datos suficientes para este gráfico.")
                 else:
                     st.info("No se pudieron generar gráficos automáticamente con los datos disponibles.")
                 
@@ -532,44 +918,41 @@ def main():
             if df.empty:
                 st.info("No hay datos para exportar.")
             else:
+                # Los archivos se generan recién al hacer clic en cada botón y quedan
+                # guardados por versión de la tabla (ver exportacion.py)
+                comprimir = st.checkbox("Comprimir con gzip (CSV y JSON)", key="exportar_gzip")
+                
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     st.subheader("Exportar Formato CSV")
                     nombre_csv = st.text_input("Nombre del archivo CSV:", 
-                                             value=f"{archivo_seleccionado.split('.')[0]}_export.csv")
+                                             value=exportacion.nombre_descarga(ruta, "csv", comprimir=comprimir))
                     
-                    csv_data = df.to_csv(index=False)
                     st.download_button(
                         label="📥 Descargar CSV",
-                        data=csv_data,
+                        data=descarga_diferida(ruta, df, "csv", comprimir=comprimir),
                         file_name=nombre_csv,
-                        mime="text/csv",
+                        mime=exportacion.tipo_mime("csv", comprimir),
                         key="download_csv"
                     )
                 
                 with col2:
                     st.subheader("Exportar Formato JSON")
                     nombre_json = st.text_input("Nombre del archivo JSON:", 
-                                              value=f"{archivo_seleccionado.split('.')[0]}_export.json")
+                                              value=exportacion.nombre_descarga(ruta, "json_records", comprimir=comprimir))
                     
                     # Opciones de formato JSON
                     formato_json = st.radio("Formato JSON:", 
                                           ["Records", "Split", "Values"], 
                                           help="Records: lista de objetos, Split: separado en índices y datos, Values: solo valores")
-                    
-                    if formato_json == "Records":
-                        json_data = df.to_json(orient='records', indent=2)
-                    elif formato_json == "Split":
-                        json_data = df.to_json(orient='split', indent=2)
-                    else:
-                        json_data = df.to_json(orient='values', indent=2)
+                    formato = f"json_{formato_json.lower()}"
                     
                     st.download_button(
                         label="📥 Descargar JSON",
-                        data=json_data,
+                        data=descarga_diferida(ruta, df, formato, comprimir=comprimir),
                         file_name=nombre_json,
-                        mime="application/json",
+                        mime=exportacion.tipo_mime(formato, comprimir),
                         key="download_json"
                     )
                 
@@ -583,25 +966,17 @@ def main():
                 with col3:
                     st.subheader("Exportar a Excel")
                     nombre_excel = st.text_input("Nombre del archivo Excel:", 
-                                               value=f"{archivo_seleccionado.split('.')[0]}_export.xlsx")
-                    
-                    # Crear archivo Excel en memoria
-                    excel_buffer = io.BytesIO()
-                    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                        df.to_excel(writer, sheet_name='Datos', index=False)
-                        
-                        # Agregar hoja con estadísticas si hay columnas numéricas
-                        columnas_numericas = df.select_dtypes(include=[np.number]).columns
-                        if len(columnas_numericas) > 0:
-                            df[columnas_numericas].describe().to_excel(writer, sheet_name='Estadísticas')
+                                               value=exportacion.nombre_descarga(ruta, "excel"))
                     
-                    excel_data = excel_buffer.getvalue()
+                    # Agregar hoja con estadísticas si hay columnas numéricas
+                    resumen = obtener_estadisticas(ruta).describir()
+                    hojas_extra = {} if resumen.empty else {"Estadísticas": resumen}
                     
                     st.download_button(
                         label="📥 Descargar Excel",
-                        data=excel_data,
+                        data=descarga_diferida(ruta, df, "excel", hojas_extra=hojas_extra),
                         file_name=nombre_excel,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        mime=exportacion.tipo_mime("excel"),
                         key="download_excel"
                     )
                 
@@ -616,37 +991,165 @@ def main():
                     )
                     
                     if columnas_exportar:
-                        df_filtrado = df[columnas_exportar]
-                        
+                        formatos_filtrado = {"CSV": "csv", "JSON": "json_records"}
+                        if exportacion.COLUMNARES:
+                            formatos_filtrado.update({"Parquet": "parquet", "Arrow IPC": "arrow"})
                         formato_filtrado = st.selectbox("Formato para datos filtrados:", 
-                                                      ["CSV", "JSON"])
+                                                      list(formatos_filtrado))
+                        formato = formatos_filtrado[formato_filtrado]
                         
                         nombre_filtrado = st.text_input("Nombre archivo filtrado:",
-                                                      value=f"{archivo_seleccionado.split('.')[0]}_filtrado.{formato_filtrado.lower()}")
-                        
-                        if formato_filtrado == "CSV":
-                            data_filtrado = df_filtrado.to_csv(index=False)
-                            mime_type = "text/csv"
-                        else:
-                            data_filtrado = df_filtrado.to_json(orient='records', indent=2)
-                            mime_type = "application/json"
+                                                      value=exportacion.nombre_descarga(ruta, formato, "filtrado", comprimir))
                         
                         st.download_button(
                             label=f"📥 Descargar {formato_filtrado} Filtrado",
-                            data=data_filtrado,
+                            data=descarga_diferida(ruta, df, formato, columnas=columnas_exportar, comprimir=comprimir),
                             file_name=nombre_filtrado,
-                            mime=mime_type,
+                            mime=exportacion.tipo_mime(formato, comprimir),
                             key="download_filtered"
                         )
+                
+                # Formatos columnares: más chicos y mucho más rápidos de leer que CSV o JSON
+                if exportacion.COLUMNARES:
+                    st.markdown("---")
+                    st.subheader("Exportar Formato Columnar")
+                    formato_columnar = st.radio("Formato:", ["Parquet", "Arrow IPC"], horizontal=True,
+                                                key="formato_columnar",
+                                                help=f"Comprimidos por columna ({exportacion.COMPRESION_COLUMNAR}); "
+                                                     "para leer solo algunas columnas usar 'Exportar Datos Filtrados'")
+                    formato = "parquet" if formato_columnar == "Parquet" else "arrow"
+                    nombre_columnar = st.text_input("Nombre del archivo columnar:",
+                                                    value=exportacion.nombre_descarga(ruta, formato))
+                    
+                    st.download_button(
+                        label=f"📥 Descargar {formato_columnar}",
+                        data=descarga_diferida(ruta, df, formato),
+                        file_name=nombre_columnar,
+                        mime=exportacion.tipo_mime(formato),
+                        key="download_columnar"
+                    )
         
+        # Tab 8: Cubo de ventas preagregado (todas las facturas, no solo el archivo seleccionado)
+        with tab8:
+            st.header("🧊 Cubo de Ventas")
+            
+            try:
+                cubo_ventas = obtener_cubo_ventas()
+            except (FileNotFoundError, KeyError) as e:
+                st.info(f"No se pudo armar el cubo de ventas: {e}")
+                cubo_ventas = None
+            
+            if cubo_ventas is not None:
+                col_dims, col_medida = st.columns([3, 1])
+                with col_dims:
+                    dimensiones_cubo = st.multiselect(
+                        "Agrupar por:",
+                        ["anio", "mes", "dia"] + cubo.DIMENSIONES[1:],
+                        default=["mes"],
+                        key="cubo_dimensiones"
+                    )
+                with col_medida:
+                    medida_cubo = st.selectbox("Medida:", cubo.MEDIDAS, key="cubo_medida")
+                
+                # Drill-down: cada filtro acota las opciones de los siguientes
+                filtros_cubo = {}
+                with st.expander("Filtros (drill-down)"):
+                    columnas_filtro = st.columns(3)
+                    for i, dimension in enumerate(cubo.DIMENSIONES[1:]):
+                        opciones = cubo.consultar(cubo_ventas, [dimension], filtros_cubo)[dimension].dropna()
+                        with columnas_filtro[i % 3]:
+                            elegidos = st.multiselect(dimension, sorted(opciones.unique()),
+                                                      key=f"cubo_filtro_{dimension}")
+                        if elegidos:
+                            filtros_cubo[dimension] = elegidos
+                
+                resultado_cubo = cubo.consultar(cubo_ventas, dimensiones_cubo, filtros_cubo)
+                totales = resultado_cubo[cubo.MEDIDAS].sum()
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Importe", f"{totales['importe']:,.2f}")
+                col2.metric("Cantidad", f"{totales['cantidad']:,.0f}")
+                col3.metric("Líneas", f"{totales['lineas']:,.0f}")
+                
+                if dimensiones_cubo and not resultado_cubo.empty:
+                    eje = dimensiones_cubo[0]
+                    color = dimensiones_cubo[1] if len(dimensiones_cubo) > 1 else None
+                    datos_grafico = resultado_cubo.copy()
+                    if color:
+                        datos_grafico[color] = datos_grafico[color].astype(str)
+                    if eje in cubo.NIVELES_FECHA:
+                        fig = px.line(datos_grafico.sort_values(eje), x=eje, y=medida_cubo, color=color,
+                                      markers=True, title=f"{medida_cubo} por {eje}")
+                    else:
+                        fig = px.bar(datos_grafico.sort_values(medida_cubo, ascending=False),
+                                     x=eje, y=medida_cubo, color=color,
+                                     title=f"{medida_cubo} por {eje}")
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                st.dataframe(resultado_cubo, use_container_width=True)
+                st.caption(f"{len(cubo_ventas)} celdas en el cubo")
         
+        # Tab 9: Consultas SQL sobre todas las tablas de la carpeta
+        with tab9:
+            st.header("🧮 Consulta SQL")
+            st.caption("Cada tabla se nombra como su archivo sin extensión (factura_det, producto...). "
+                       "Solo se leen las columnas que usa la consulta.")
+            
+            with st.form("form_consulta_sql"):
+                consulta_sql = st.text_area("Consulta:", value=CONSULTA_EJEMPLO, height=180, key="consulta_sql")
+                ejecutar_sql = st.form_submit_button("▶️ Ejecutar")
+            if ejecutar_sql:
+                st.session_state.consulta_sql_ejecutada = consulta_sql
+            
+            if st.session_state.get("consulta_sql_ejecutada"):
+                try:
+                    resultado_sql, informe_sql = consultas.ejecutar(CARPETA_DATOS, st.session_state.consulta_sql_ejecutada)
+                except Exception as e:
+                    st.error(f"❌ Error en la consulta: {e}")
+                else:
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Filas", f"{len(resultado_sql):,}")
+                    col2.metric("Tiempo", f"{informe_sql['segundos'] * 1000:.1f} ms",
+                                "resultado en caché" if informe_sql["desde_cache"] else None, delta_color="off")
+                    col3.metric("Motor", informe_sql["motor"])
+                    st.dataframe(resultado_sql, use_container_width=True)
+                    
+                    with st.expander("Lectura de las tablas"):
+                        st.dataframe(pd.DataFrame([
+                            {"Tabla": archivo,
+                             "Filas leídas": detalle["filas"],
+                             "Columnas": "(la base)" if detalle["columnas"] is None else ", ".join(detalle["columnas"]),
+                             "Condiciones al leer": "; ".join(detalle["filtros"])}
+                            for archivo, detalle in informe_sql["tablas"].items()
+                        ]), use_container_width=True)
         
         # Información adicional en sidebar
         st.sidebar.markdown("---")
         st.sidebar.header("ℹ Información")
-        st.sidebar.write(f"**Carpeta:** {CARPETA}")
+        st.sidebar.write(f"**Carpeta:** {CARPETA_DATOS}")
+        base = almacen.base_sqlite(ruta)
+        st.sidebar.write(f"**Almacenamiento:** {f'base SQLite ({base.ARCHIVO_BASE})' if base else 'CSV'}")
         st.sidebar.write(f"**Última actualización:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
+        # Cambios anotados en el diario que aún no se volcaron al CSV
+        pendientes_diario = len(almacen.leer_diario(ruta))
+        if pendientes_diario:
+            st.sidebar.write(f"**Diario:** {pendientes_diario} cambios sin compactar")
+            if st.sidebar.button("🗜️ Compactar archivo"):
+                # Bajo el bloqueo de la tabla, para no perder filas que otra sesión esté anexando
+                with almacen.bloqueo(ruta):
+                    almacen.compactar(ruta)
+                obtener_cache_tablas().invalidar(ruta)
+                st.rerun()
+        
+        # Verificación de integridad referencial de toda la carpeta
+        if st.sidebar.button("🔗 Verificar integridad"):
+            informe = integridad.verificar(CARPETA_DATOS)
+            lineas = integridad.formatear_informe(informe)
+            if lineas:
+                st.sidebar.error("\n".join(f"- {linea}" for linea in lineas))
+            else:
+                st.sidebar.success(f"Sin problemas ({informe['tablas']} tablas, {informe['segundos']:.2f} s)")
+        
         # Estadísticas rápidas en sidebar
         if not df.empty:
             st.sidebar.markdown("---")
@@ -654,13 +1157,35 @@ def main():
             st.sidebar.write(f"**Registros:** {len(df)}")
             st.sidebar.write(f"**Columnas:** {len(df.columns)}")
             
-            columnas_numericas = df.select_dtypes(include=[np.number]).columns
-            if len(columnas_numericas) > 0:
-                st.sidebar.write(f"**Columnas numéricas:** {len(columnas_numericas)}")
+            # Conteos de la pasada de estadísticas guardada por versión de la tabla
+            resumen = obtener_estadisticas(ruta)
+            if len(resumen.numericas) > 0:
+                st.sidebar.write(f"**Columnas numéricas:** {len(resumen.numericas)}")
             
-            nulos = df.isnull().sum().sum()
+            nulos = int(resumen.valores_nulos().sum())
             if nulos > 0:
                 st.sidebar.warning(f"**Valores nulos:** {nulos}")
+        
+        # Tiempos, filas y memoria de las operaciones medidas (en todas las sesiones del proceso)
+        st.sidebar.markdown("---")
+        st.sidebar.header("⏱️ Rendimiento")
+        st.sidebar.toggle("Medir operaciones", value=rendimiento.activo(), key="medir_rendimiento",
+                          on_change=cambiar_medicion)
+        mediciones = rendimiento.mediciones()
+        if mediciones:
+            st.sidebar.dataframe(rendimiento.resumen(mediciones), hide_index=True, use_container_width=True)
+            st.sidebar.caption("La memoria la mide una sesión a la vez: las operaciones que coinciden "
+                               "con otra medición en curso registran solo tiempo y filas.")
+            col_descarga, col_limpiar = st.sidebar.columns(2)
+            with col_descarga:
+                st.download_button("💾 JSON lines", data=rendimiento.lineas_json(mediciones),
+                                   file_name="rendimiento.jsonl", mime="application/x-ndjson")
+            with col_limpiar:
+                if st.button("🧹 Limpiar", key="limpiar_rendimiento"):
+                    rendimiento.limpiar()
+                    st.rerun()
+        elif rendimiento.activo():
+            st.sidebar.caption("Todavía no hay operaciones medidas.")
 
 if __name__ == "__main__":
 
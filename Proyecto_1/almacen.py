@@ -0,0 +1,807 @@
+"""Lectura y escritura de tablas CSV con copia binaria de respaldo.
+
+Junto a cada CSV se mantiene, dentro de la subcarpeta CARPETA_CACHE, una copia
+columnar (Parquet si pyarrow está disponible, pickle si no) y un archivo de
+metadatos con el tamaño, la fecha de modificación y el hash del CSV del que se
+generó. Mientras el CSV no cambie, la carga lee la copia binaria en lugar de
+volver a interpretar todo el texto.
+
+Las ediciones no reescriben el CSV completo: las inserciones se anexan al final
+del archivo y las modificaciones y eliminaciones se anotan en un diario por
+tabla que se reproduce al cargar y se compacta sobre el CSV periódicamente.
+
+Las funciones públicas de lectura y escritura son la interfaz de
+almacenamiento de todo el programa: si la tabla fue migrada a la base SQLite
+de su carpeta (ver base_sqlite y almacen_sqlite) delegan en ese módulo, y si
+no trabajan sobre el CSV.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Subcarpeta (dentro de la carpeta de datos) donde se guardan las copias binarias
+CARPETA_CACHE = ".cache"
+
+try:
+    import pyarrow  # noqa: F401
+    FORMATO_BINARIO = "parquet"
+except ImportError:
+    FORMATO_BINARIO = "pickle"
+
+
+def ruta_cache(ruta, sufijo):
+    """Ruta de un archivo auxiliar de la tabla dentro de CARPETA_CACHE"""
+    carpeta = os.path.join(os.path.dirname(ruta), CARPETA_CACHE)
+    return os.path.join(carpeta, os.path.basename(ruta) + sufijo)
+
+
+def _ruta_binaria(ruta):
+    return ruta_cache(ruta, "." + FORMATO_BINARIO)
+
+
+def _ruta_meta(ruta):
+    return ruta_cache(ruta, ".meta.json")
+
+
+def huella_archivo(ruta):
+    """Tamaño y fecha de modificación (ns) del archivo"""
+    info = os.stat(ruta)
+    return {"tamano": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+
+def hash_archivo(ruta, tamano_bloque=1024 * 1024):
+    """Hash SHA-1 del contenido del archivo, leído por bloques"""
+    sha = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def ruta_temporal(ruta):
+    """Temporal junto a ruta, propio del proceso y del hilo que escribe (las
+    sesiones del tablero son hilos de un mismo proceso)"""
+    return f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def escribir_json_atomico(ruta, datos, indent=None):
+    """Escribir JSON en un temporal y reemplazar, para no dejar archivos a medias"""
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=indent)
+    os.replace(temporal, ruta)
+
+
+def leer_json(ruta):
+    """Leer JSON; devuelve None si no existe o está dañado"""
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def bloqueo(ruta, espera=10.0, caducidad=60.0):
+    """Bloqueo entre procesos: creación exclusiva de ruta + '.lock'.
+
+    Un bloqueo más viejo que caducidad segundos se considera abandonado.
+    """
+    archivo = ruta + ".lock"
+    limite = time.monotonic() + espera
+    while True:
+        try:
+            fd = os.open(archivo, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(archivo) > caducidad:
+                    os.remove(archivo)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > limite:
+                raise TimeoutError(f"No se pudo bloquear '{os.path.basename(ruta)}'")
+            time.sleep(0.01)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        os.remove(archivo)
+
+
+def base_sqlite(ruta):
+    """Módulo almacen_sqlite si la tabla está guardada en la base SQLite de su
+    carpeta; None si se guarda como CSV"""
+    import almacen_sqlite  # importación diferida: almacen_sqlite depende de este módulo
+    return almacen_sqlite if almacen_sqlite.contiene(ruta) else None
+
+
+def listar_tablas(carpeta):
+    """Archivos de las tablas de la carpeta: los CSV y las tablas de su base SQLite"""
+    import almacen_sqlite
+    nombres = {archivo for archivo in os.listdir(carpeta) if archivo.endswith(".csv")}
+    nombres.update(tabla + ".csv" for tabla in almacen_sqlite.catalogo(carpeta))
+    return sorted(nombres)
+
+
+def leer_binario(archivo):
+    """Leer un DataFrame guardado con escribir_binario"""
+    if FORMATO_BINARIO == "parquet":
+        return pd.read_parquet(archivo)
+    return pd.read_pickle(archivo)
+
+
+def escribir_binario(df, archivo):
+    """Guardar un DataFrame en FORMATO_BINARIO (vía temporal, reemplazo atómico)"""
+    os.makedirs(os.path.dirname(archivo) or ".", exist_ok=True)
+    temporal = archivo + ".tmp"
+    if FORMATO_BINARIO == "parquet":
+        df.to_parquet(temporal, index=False)
+    else:
+        df.to_pickle(temporal)
+    os.replace(temporal, archivo)
+
+
+def _leer_binario(ruta):
+    return leer_binario(_ruta_binaria(ruta))
+
+
+def borrar_copia_binaria(ruta):
+    """Eliminar la copia binaria y sus metadatos (quedan obsoletos)"""
+    for auxiliar in (_ruta_meta(ruta), _ruta_binaria(ruta)):
+        if os.path.exists(auxiliar):
+            os.remove(auxiliar)
+
+
+def opciones_lectura(ruta, opciones=None):
+    """Argumentos de read_csv para la tabla: los dados o, si son None, los de su
+    esquema registrado ({} fuerza la inferencia de pandas)"""
+    if opciones is not None:
+        return opciones
+    import esquema  # importación diferida: esquema depende de este módulo
+    return esquema.opciones_lectura(esquema.esquema_tabla(ruta))
+
+
+def _firma_opciones(opciones):
+    #Las opciones de lectura forman parte de la identidad de la copia binaria
+    return json.dumps(opciones, sort_keys=True, default=str)
+
+
+def _tipos_de_lectura(df, opciones):
+    #La copia binaria debe dar los mismos tipos que leer el CSV: se deshace la
+    #representación compacta (ver esquema.compactar_tipos), que es solo de memoria
+    tipos = opciones.get("dtype", {})
+    columnas = {}
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            columnas[col] = serie.astype(tipos.get(col, serie.cat.categories.dtype))
+        elif (pd.api.types.is_integer_dtype(serie) and not pd.api.types.is_bool_dtype(serie)
+              and serie.dtype != "int64"):
+            columnas[col] = serie.astype(tipos.get(col, "int64"))
+    return df.assign(**columnas) if columnas else df
+
+
+def actualizar_copia_binaria(df, ruta, opciones=None):
+    """Regenerar la copia binaria de df tomando como referencia el CSV actual en ruta.
+
+    Se guarda con los tipos de lectura del CSV aunque df esté compactado.
+    """
+    try:
+        opciones = opciones_lectura(ruta, opciones)
+        escribir_binario(_tipos_de_lectura(df, opciones), _ruta_binaria(ruta))
+        meta = huella_archivo(ruta)
+        meta["hash"] = hash_archivo(ruta)
+        meta["hash_cola"] = _hash_cola(ruta, meta["tamano"])
+        meta["formato"] = FORMATO_BINARIO
+        meta["opciones"] = _firma_opciones(opciones)
+        escribir_json_atomico(_ruta_meta(ruta), meta)
+        return True
+    except Exception:
+        # Columnas con tipos mezclados u otro problema: sin copia, se leerá el CSV
+        borrar_copia_binaria(ruta)
+        return False
+
+
+def _hash_cola(ruta, tamano, largo=64 * 1024):
+    #Hash de los últimos bytes del archivo hasta la posición tamano
+    with open(ruta, "rb") as f:
+        f.seek(max(0, tamano - largo))
+        return hashlib.sha1(f.read(tamano - f.tell())).hexdigest()
+
+
+def _estado_copia(ruta, opciones):
+    #"vigente" si la copia binaria corresponde al CSV, "anexado" si el CSV solo
+    #creció desde entonces (filas agregadas al final), None en otro caso
+    meta = leer_json(_ruta_meta(ruta))
+    if (not meta or meta.get("formato") != FORMATO_BINARIO
+            or meta.get("opciones") != _firma_opciones(opciones)
+            or not os.path.exists(_ruta_binaria(ruta))):
+        return None, meta
+    huella = huella_archivo(ruta)
+    if meta["tamano"] < huella["tamano"] and meta.get("hash_cola") == _hash_cola(ruta, meta["tamano"]):
+        return "anexado", meta
+    if meta["tamano"] != huella["tamano"]:
+        return None, meta
+    if meta["mtime_ns"] == huella["mtime_ns"]:
+        return "vigente", meta
+    # Misma longitud pero otra fecha: decide el contenido
+    if meta.get("hash") == hash_archivo(ruta):
+        meta.update(huella)
+        escribir_json_atomico(_ruta_meta(ruta), meta)
+        return "vigente", meta
+    return None, meta
+
+
+def _conserva_valores(antes, despues):
+    #True si convertir la serie antes en despues no cambió ningún número
+    #(desborde de un entero, decimales truncados en un entero)
+    if (antes.dtype == despues.dtype or not pd.api.types.is_numeric_dtype(despues)
+            or pd.api.types.is_bool_dtype(despues)):
+        return True
+    if pd.api.types.is_integer_dtype(antes) and pd.api.types.is_integer_dtype(despues):
+        return bool((antes.astype("int64") == despues.astype("int64")).all())
+    antes = pd.to_numeric(antes, errors="coerce").astype("float64")
+    despues = despues.astype("float64")
+    return bool(((antes == despues) | (antes.isna() & despues.isna())).all())
+
+
+def _convertir_sin_perdida(nuevas, tipos):
+    #Filas anexadas convertidas a los tipos de la copia binaria. Lanza ValueError
+    #si algún número no se conserva; quien llama vuelve entonces a leer el CSV completo
+    convertidas = nuevas.astype(tipos)
+    for col in nuevas.columns:
+        if not _conserva_valores(nuevas[col], convertidas[col]):
+            raise ValueError(f"Las filas anexadas no entran en el tipo {tipos[col]} de '{col}'")
+    return convertidas
+
+
+def _leer_anexado(ruta, meta):
+    #Copia binaria + solo las filas agregadas al CSV después de generarla
+    base = _leer_binario(ruta)
+    with open(ruta, "rb") as f:
+        f.seek(meta["tamano"])
+        cola = f.read()
+    nuevas = pd.read_csv(io.BytesIO(cola), header=None, names=list(base.columns))
+    nuevas = _convertir_sin_perdida(nuevas, base.dtypes.to_dict())
+    return pd.concat([base, nuevas], ignore_index=True)
+
+
+def leer_csv(ruta, opciones=None):
+    """Cargar el CSV base desde la copia binaria si está vigente; si no, desde el texto.
+
+    opciones son argumentos de read_csv; por defecto los tipos del esquema
+    registrado. Si los datos no respetan esos tipos se vuelve a leer dejando
+    que pandas infiera.
+    """
+    opciones = opciones_lectura(ruta, opciones)
+    estado, meta = _estado_copia(ruta, opciones)
+    try:
+        if estado == "vigente":
+            return _leer_binario(ruta)
+        if estado == "anexado":
+            df = _leer_anexado(ruta, meta)
+            actualizar_copia_binaria(df, ruta, opciones)
+            return df
+    except Exception:
+        borrar_copia_binaria(ruta)
+    try:
+        df = pd.read_csv(ruta, **opciones)
+    except (ValueError, TypeError):
+        df = pd.read_csv(ruta)
+    actualizar_copia_binaria(df, ruta, opciones)
+    return df
+
+
+def leer_columnas(ruta, columnas):
+    """Cargar solo algunas columnas de la tabla (CSV base más el diario).
+
+    Usa la copia binaria si está vigente o si el CSV solo creció, pero no la
+    reemplaza: una lectura parcial no debe pisar la copia completa. Para que
+    el diario se pueda reproducir, columnas debe incluir la columna clave.
+    """
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.leer_columnas(ruta, columnas)
+    columnas = list(dict.fromkeys(columnas))
+    opciones = opciones_lectura(ruta)
+    estado, meta = _estado_copia(ruta, opciones)
+    df = None
+    if estado is not None:
+        try:
+            if FORMATO_BINARIO == "parquet":
+                df = pd.read_parquet(_ruta_binaria(ruta), columns=columnas)
+            else:
+                df = _leer_binario(ruta)[columnas]
+            if estado == "anexado":
+                #Solo las filas agregadas al CSV después de generar la copia
+                with open(ruta, "rb") as f:
+                    f.seek(meta["tamano"])
+                    cola = f.read()
+                encabezado = pd.read_csv(ruta, nrows=0).columns
+                nuevas = pd.read_csv(io.BytesIO(cola), header=None, names=list(encabezado), usecols=columnas)
+                df = pd.concat([df, _convertir_sin_perdida(nuevas[columnas], df.dtypes.to_dict())],
+                               ignore_index=True)
+        except Exception:
+            df = None
+    if df is None:
+        parciales = {"usecols": columnas}
+        if "dtype" in opciones:
+            parciales["dtype"] = {c: t for c, t in opciones["dtype"].items() if c in columnas}
+        fechas = [c for c in opciones.get("parse_dates", []) if c in columnas]
+        if fechas:
+            parciales["parse_dates"] = fechas
+            parciales["date_format"] = opciones["date_format"]
+        try:
+            df = pd.read_csv(ruta, **parciales)
+        except (ValueError, TypeError):
+            df = pd.read_csv(ruta, usecols=columnas)
+    return aplicar_diario(df, leer_diario(ruta))
+
+
+def escribir_csv(df, ruta, opciones=None):
+    """Guardar el CSV base completo y refrescar su copia binaria"""
+    df.to_csv(ruta, index=False)
+    actualizar_copia_binaria(df, ruta, opciones)
+
+
+def _ampliar_para(df, columna, valores):
+    #Preparar la columna de df para recibir valores sin perder su tipo:
+    #categorías nuevas se agregan y los enteros angostos se ensanchan si no alcanzan
+    serie = df[columna]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        nuevas = pd.Index(pd.Series(valores).dropna().unique()).difference(serie.cat.categories)
+        if len(nuevas) > 0:
+            df[columna] = serie.cat.add_categories(nuevas)
+    elif pd.api.types.is_integer_dtype(serie) and serie.dtype != "int64":
+        numeros = pd.to_numeric(pd.Series(valores), errors="coerce").dropna()
+        limites = np.iinfo(serie.dtype)
+        if len(numeros) and (numeros.min() < limites.min or numeros.max() > limites.max):
+            df[columna] = serie.astype("int64")
+
+
+def alinear_tipos(filas, df):
+    """Convertir las columnas de filas nuevas a los tipos de df (cuando es posible
+    sin cambiar ningún valor), para que al concatenarlas la tabla conserve sus
+    tipos. Puede ampliar df: una columna entera que recibe decimales pasa a
+    float64, como quedaría al leer el CSV."""
+    filas = filas.copy()
+    for col in filas.columns.intersection(df.columns):
+        _ampliar_para(df, col, filas[col])
+        if filas[col].dtype == df[col].dtype:
+            continue
+        try:
+            convertida = filas[col].astype(df[col].dtype)
+        except (TypeError, ValueError):
+            continue
+        if _conserva_valores(filas[col], convertida):
+            filas[col] = convertida
+        elif pd.api.types.is_integer_dtype(df[col]):
+            numeros = pd.to_numeric(filas[col], errors="coerce")
+            if numeros.notna().sum() == filas[col].notna().sum():
+                df[col] = df[col].astype("float64")
+                filas[col] = numeros.astype("float64")
+    return filas
+
+
+def concatenar_filas(df, filas):
+    """Agregar filas (DataFrame) al final de df conservando sus tipos"""
+    df = df.copy()
+    filas = alinear_tipos(filas, df)
+    return pd.concat([df, filas], ignore_index=True)
+
+
+# ---------------------------------------------------------------------------
+# Escrituras incrementales: filas anexadas al CSV y diario de cambios
+# ---------------------------------------------------------------------------
+
+# Cantidad de entradas del diario a partir de la cual se compacta automáticamente
+UMBRAL_COMPACTACION = 500
+
+
+def ruta_diario(ruta):
+    """Diario de modificaciones y eliminaciones pendientes de volcar al CSV.
+
+    Vive junto al CSV (no en CARPETA_CACHE) porque contiene datos que todavía
+    no están en ningún otro lugar.
+    """
+    return ruta + ".diario"
+
+
+def _valor_json(valor):
+    #Convertir escalares de numpy/pandas a tipos que json sabe escribir
+    if hasattr(valor, "item"):
+        return valor.item()
+    return str(valor)
+
+
+class RegistroCambios:
+    """Operaciones pendientes de guardar sobre una tabla.
+
+    Las inserciones se anexan al final del CSV; las modificaciones y
+    eliminaciones (identificadas por su clave) van al diario de la tabla
+    (ver aplicar_cambios para las inserciones que también van al diario).
+    version_base es la versión de la tabla (version_tabla) sobre la que se
+    hicieron los cambios; con ella confirmar_cambios detecta escrituras de
+    otras sesiones. Los valores anteriores de las filas tocadas permiten
+    decidir si esas escrituras chocan con las propias.
+    """
+
+    def __init__(self, version_base=None):
+        self.operaciones = []
+        self.reescritura_completa = False
+        self.version_base = version_base
+
+    def insertar(self, fila):
+        self.operaciones.append({"op": "insertar", "fila": dict(fila)})
+
+    def modificar(self, columna_clave, clave, valores, anteriores=None):
+        """anteriores: {columna: valor antes del cambio} de las columnas de valores"""
+        if valores:
+            operacion = {"op": "modificar", "columna_clave": columna_clave,
+                         "clave": clave, "valores": dict(valores)}
+            if anteriores is not None:
+                operacion["anteriores"] = dict(anteriores)
+            self.operaciones.append(operacion)
+
+    def eliminar(self, columna_clave, clave, fila=None):
+        """fila: la fila eliminada tal como estaba ({columna: valor})"""
+        operacion = {"op": "eliminar", "columna_clave": columna_clave, "clave": clave}
+        if fila is not None:
+            operacion["fila"] = dict(fila)
+        self.operaciones.append(operacion)
+
+    def forzar_reescritura(self):
+        """Marcar que los cambios no se pueden expresar por clave: guardar todo el archivo"""
+        self.reescritura_completa = True
+
+    def limpiar(self):
+        self.operaciones = []
+        self.reescritura_completa = False
+
+    def __len__(self):
+        return len(self.operaciones)
+
+
+def leer_diario(ruta):
+    """Entradas del diario de la tabla (lista vacía si no hay)"""
+    try:
+        with open(ruta_diario(ruta), encoding="utf-8") as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def clave_texto(valor):
+    """Forma normalizada de una clave: 3, 3.0 y "3" se comparan igual"""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+def asignar_valor(df, pos, columna, valor):
+    """Asignar el valor de columna en la fila pos, ampliando el tipo si no entra"""
+    _ampliar_para(df, columna, [valor])
+    loc = df.columns.get_loc(columna)
+    try:
+        df.iloc[pos, loc] = valor
+    except (TypeError, ValueError):
+        df[columna] = df[columna].astype(object)
+        df.iloc[pos, loc] = valor
+
+
+def aplicar_diario(df, entradas, inserciones=True):
+    """Reproducir las entradas del diario sobre df (devuelve un DataFrame nuevo).
+
+    Las entradas "insertar" agregan su fila al final en el punto del diario
+    en que se escribieron; inserciones=False las saltea (para reproducir el
+    diario por bloques y agregar esas filas una sola vez).
+    """
+    if not entradas:
+        return df
+    df = df.copy()
+    posiciones = {}  # columna_clave -> {clave: posición}
+    eliminadas = set()
+    for entrada in entradas:
+        if entrada["op"] == "insertar":
+            if inserciones:
+                fila = entrada["fila"]
+                df = concatenar_filas(df, pd.DataFrame([fila]).reindex(columns=df.columns))
+                for columna, mapa in posiciones.items():
+                    if columna in fila:
+                        mapa[clave_texto(fila[columna])] = len(df) - 1
+            continue
+        columna = entrada["columna_clave"]
+        if columna not in df.columns:
+            continue
+        if columna not in posiciones:
+            posiciones[columna] = {clave_texto(v): i for i, v in enumerate(df[columna].tolist())}
+        mapa = posiciones[columna]
+        pos = mapa.get(clave_texto(entrada["clave"]))
+        if pos is None:
+            continue
+        if entrada["op"] == "eliminar":
+            eliminadas.add(pos)
+            del mapa[clave_texto(entrada["clave"])]
+        else:
+            for col, valor in entrada["valores"].items():
+                if col in df.columns:
+                    asignar_valor(df, pos, col, valor)
+            nueva_clave = entrada["valores"].get(columna)
+            if nueva_clave is not None:
+                del mapa[clave_texto(entrada["clave"])]
+                mapa[clave_texto(nueva_clave)] = pos
+            # Otras columnas clave quedan desactualizadas: se recalculan si se usan
+            for otra in list(posiciones):
+                if otra != columna and otra in entrada["valores"]:
+                    del posiciones[otra]
+    if eliminadas:
+        df = df.drop(df.index[sorted(eliminadas)]).reset_index(drop=True)
+    return df
+
+
+def anexar_filas(filas, ruta):
+    """Agregar filas (DataFrame) al final del CSV sin reescribirlo"""
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.anexar_filas(filas, ruta)
+    if not os.path.exists(ruta) or os.path.getsize(ruta) == 0:
+        filas.to_csv(ruta, index=False)
+        return
+    columnas = pd.read_csv(ruta, nrows=0).columns
+    filas = filas.reindex(columns=columnas)
+    with open(ruta, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) not in (b"\n", b"\r"):
+            f.write(b"\n")
+    filas.to_csv(ruta, mode="a", header=False, index=False)
+
+
+def registrar_en_diario(ruta, entradas):
+    """Agregar entradas al diario; compacta la tabla si supera UMBRAL_COMPACTACION"""
+    if not entradas:
+        return
+    with open(ruta_diario(ruta), "a", encoding="utf-8") as f:
+        for entrada in entradas:
+            f.write(json.dumps(entrada, ensure_ascii=False, default=_valor_json) + "\n")
+    if len(leer_diario(ruta)) >= UMBRAL_COMPACTACION:
+        compactar(ruta)
+
+
+def _entrada_diario(operacion):
+    #Lo que se escribe en el diario (sin los valores anteriores de la fila)
+    if operacion["op"] == "insertar":
+        return {"op": "insertar", "fila": operacion["fila"]}
+    return {k: v for k, v in operacion.items() if k in ("op", "columna_clave", "clave", "valores")}
+
+
+def _claves_tocadas(entradas):
+    #(columna clave, clave) que nombran las entradas, con la clave anterior y la nueva
+    tocadas = set()
+    for entrada in entradas:
+        columna = entrada.get("columna_clave")
+        if columna is None:
+            continue
+        tocadas.add((columna, clave_texto(entrada["clave"])))
+        nueva_clave = entrada["valores"].get(columna) if "valores" in entrada else None
+        if nueva_clave is not None:
+            tocadas.add((columna, clave_texto(nueva_clave)))
+    return tocadas
+
+
+def aplicar_cambios(ruta, cambios):
+    """Persistir un RegistroCambios: inserciones al CSV, el resto al diario.
+
+    El diario identifica las filas por clave, así que una fila anexada al CSV
+    con una clave que ya nombra alguna entrada anterior (del diario pendiente
+    o de este mismo registro, como una clave eliminada o renombrada) recibiría
+    esas entradas al reproducirlo. Esas inserciones van al diario, en orden,
+    como entradas "insertar".
+    """
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.aplicar_cambios(ruta, cambios)
+    tocadas = _claves_tocadas(leer_diario(ruta))
+    inserciones, entradas = [], []
+    for op in cambios.operaciones:
+        if op["op"] != "insertar":
+            tocadas |= _claves_tocadas([op])
+        elif not any((columna, clave_texto(valor)) in tocadas for columna, valor in op["fila"].items()):
+            inserciones.append(op["fila"])
+            continue
+        entradas.append(_entrada_diario(op))
+    if inserciones:
+        anexar_filas(pd.DataFrame(inserciones), ruta)
+    registrar_en_diario(ruta, entradas)
+
+
+class ConflictoEscritura(Exception):
+    """Los cambios chocan con otros guardados después de leer la tabla"""
+
+    def __init__(self, conflictos):
+        self.conflictos = conflictos
+        super().__init__("; ".join(conflictos))
+
+
+def _mismo_valor(a, b):
+    #Igualdad tolerante a tipos: 3, 3.0 y "3" son el mismo valor; dos nulos también
+    nulo_a, nulo_b = bool(pd.isna(a)), bool(pd.isna(b))
+    if nulo_a or nulo_b:
+        return nulo_a and nulo_b
+    return clave_texto(a) == clave_texto(b)
+
+
+def conflictos_escritura(actual, operaciones, columna_clave=None):
+    """Descripción de las operaciones que chocan con la tabla actual.
+
+    Las operaciones se repasan en orden sobre las filas actuales. Chocan una
+    modificación de un campo que otro cambió a un valor distinto, una
+    modificación o eliminación de una fila que otro eliminó o modificó, y una
+    inserción (o cambio de clave) a una clave que ya existe. columna_clave es
+    la clave de la tabla, para las inserciones.
+    """
+    mapas = {}  # columna -> {clave: posición en actual}
+    estado = {}  # (columna, clave) -> fila después de las operaciones ya repasadas (None si no existe)
+
+    def fila(columna, clave):
+        if (columna, clave_texto(clave)) in estado:
+            return estado[(columna, clave_texto(clave))]
+        if columna not in mapas:
+            valores = actual[columna].tolist() if columna in actual.columns else []
+            mapas[columna] = {clave_texto(v): i for i, v in enumerate(valores)}
+        pos = mapas[columna].get(clave_texto(clave))
+        return None if pos is None else actual.iloc[pos].to_dict()
+
+    conflictos = []
+    for op in operaciones:
+        if op["op"] == "insertar":
+            clave = op["fila"].get(columna_clave) if columna_clave else None
+            if clave is None:
+                continue
+            if fila(columna_clave, clave) is not None:
+                conflictos.append(f"'{columna_clave}' {clave} ya existe (lo agregó otra sesión)")
+            estado[(columna_clave, clave_texto(clave))] = dict(op["fila"])
+            continue
+        columna, clave = op["columna_clave"], op["clave"]
+        actual_fila = fila(columna, clave)
+        if op["op"] == "eliminar":
+            if actual_fila is not None and any(not _mismo_valor(actual_fila[c], v)
+                                               for c, v in op.get("fila", {}).items() if c in actual_fila):
+                conflictos.append(f"{columna}={clave} fue modificado por otra sesión")
+            estado[(columna, clave_texto(clave))] = None
+            continue
+        if actual_fila is None:
+            conflictos.append(f"{columna}={clave} fue eliminado por otra sesión")
+            continue
+        anteriores = op.get("anteriores", {})
+        for c, valor in op["valores"].items():
+            if (c in anteriores and c in actual_fila and not _mismo_valor(actual_fila[c], anteriores[c])
+                    and not _mismo_valor(actual_fila[c], valor)):
+                conflictos.append(f"{columna}={clave}: '{c}' fue modificado por otra sesión")
+        nueva_clave = op["valores"].get(columna, clave)
+        if clave_texto(nueva_clave) != clave_texto(clave):
+            if fila(columna, nueva_clave) is not None:
+                conflictos.append(f"'{columna}' {nueva_clave} ya existe")
+            estado[(columna, clave_texto(clave))] = None
+        estado[(columna, clave_texto(nueva_clave))] = dict(actual_fila, **op["valores"])
+    return conflictos
+
+
+def confirmar_cambios(ruta, cambios, df, cargar_actual=None):
+    """Guardar un RegistroCambios con control de concurrencia optimista.
+
+    El bloqueo de la tabla se toma solo mientras dura la confirmación. Si la
+    tabla sigue en cambios.version_base, los cambios se guardan tal cual; si
+    otra sesión escribió mientras tanto, las operaciones por clave se
+    combinan fila por fila con lo que ya está guardado, salvo que choquen
+    (ver conflictos_escritura): en ese caso se lanza ConflictoEscritura sin
+    escribir nada. Una reescritura completa (df entero) solo se acepta sobre
+    la versión base. cargar_actual() devuelve la tabla vigente (por defecto
+    leer_tabla).
+
+    Devuelve True si hubo que combinar con cambios ajenos. Si no, la versión
+    base pasa a ser la resultante; si sí, se conserva, para que los
+    próximos cambios sobre el mismo df se vuelvan a verificar.
+    """
+    with bloqueo(ruta):
+        combinado = cambios.version_base is not None and version_tabla(ruta) != cambios.version_base
+        if cambios.reescritura_completa:
+            if combinado:
+                raise ConflictoEscritura(["la tabla cambió desde que se cargó y guardar la reescribiría completa"])
+            guardar_tabla(df, ruta)
+        else:
+            if combinado:
+                import esquema  # importación diferida: esquema depende de este módulo
+                actual = cargar_actual() if cargar_actual is not None else leer_tabla(ruta)
+                conflictos = conflictos_escritura(actual, cambios.operaciones, esquema.columna_clave(ruta))
+                if conflictos:
+                    raise ConflictoEscritura(conflictos)
+            aplicar_cambios(ruta, cambios)
+        if not combinado:
+            cambios.version_base = version_tabla(ruta)
+    return combinado
+
+
+def leer_tabla(ruta, opciones=None):
+    """Cargar la tabla completa: CSV base más los cambios del diario"""
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.leer_tabla(ruta)
+    return aplicar_diario(leer_csv(ruta, opciones), leer_diario(ruta))
+
+
+def guardar_tabla(df, ruta, opciones=None):
+    """Reescribir la tabla completa; el diario queda incorporado y se elimina"""
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.guardar_tabla(df, ruta)
+    escribir_csv(df, ruta, opciones)
+    if os.path.exists(ruta_diario(ruta)):
+        os.remove(ruta_diario(ruta))
+
+
+def compactar(ruta, opciones=None):
+    """Volcar el diario sobre el CSV base. Devuelve la cantidad de entradas aplicadas
+    (0 en una tabla de la base SQLite, que no tiene diario)"""
+    if base_sqlite(ruta) is not None:
+        return 0
+    entradas = leer_diario(ruta)
+    if entradas:
+        guardar_tabla(aplicar_diario(leer_csv(ruta, opciones), entradas), ruta, opciones)
+    return len(entradas)
+
+
+def huella_contenido(ruta):
+    """Huella para saber después si la tabla solo recibió filas anexadas
+    (ver solo_anexado)"""
+    base = base_sqlite(ruta)
+    if base is not None:
+        return {"version": base.version_tabla(ruta)[1]}
+    tamano = os.path.getsize(ruta)
+    try:
+        diario = os.path.getsize(ruta_diario(ruta))
+    except FileNotFoundError:
+        diario = 0
+    return {"tamano": tamano, "hash_cola": _hash_cola(ruta, tamano), "diario": diario}
+
+
+def solo_anexado(ruta, huella):
+    """True si desde huella la tabla no cambió o solo se le agregaron filas al final.
+
+    En una tabla de la base SQLite siempre es False: sus escrituras no
+    distinguen las filas agregadas del resto de los cambios.
+    """
+    if base_sqlite(ruta) is not None:
+        return False
+    try:
+        actual = huella_contenido(ruta)
+    except FileNotFoundError:
+        return False
+    return (actual["diario"] == huella["diario"] and actual["tamano"] >= huella["tamano"]
+            and _hash_cola(ruta, huella["tamano"]) == huella["hash_cola"])
+
+
+def version_tabla(ruta):
+    """Identificador de la versión actual de la tabla en disco (None si no existe)"""
+    base = base_sqlite(ruta)
+    if base is not None:
+        return base.version_tabla(ruta)
+    try:
+        huella = huella_archivo(ruta)
+    except FileNotFoundError:
+        return None
+    try:
+        diario = huella_archivo(ruta_diario(ruta))
+    except FileNotFoundError:
+        diario = {"tamano": 0, "mtime_ns": 0}
+    return (huella["tamano"], huella["mtime_ns"], diario["tamano"], diario["mtime_ns"])
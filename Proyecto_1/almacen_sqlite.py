@@ -0,0 +1,307 @@
+"""Almacenamiento de las tablas en una base SQLite embebida.
+
+Alternativa al CSV con diario: cada tabla migrada (ver migrar) vive en
+ARCHIVO_BASE, en la misma carpeta que los CSV, como una tabla SQLite con el
+nombre del CSV sin extensión, un índice (único si los datos lo permiten) sobre
+su columna clave e índices sobre sus claves foráneas. La tabla se sigue
+identificando por la ruta de su CSV: las funciones de almacen preguntan a
+almacen.base_sqlite(ruta) y, si la tabla está en la base, delegan en este
+módulo, así que los menús y el tablero funcionan igual con los dos formatos.
+
+Un RegistroCambios se guarda en una sola transacción, una sentencia por fila
+(INSERT, o UPDATE/DELETE por clave), sin reescribir la tabla. Los tipos de
+las columnas salen del esquema registrado (esquema.json). La versión de cada
+tabla es un identificador en TABLA_VERSIONES que cambia con cada escritura
+hecha a través de este módulo.
+"""
+import argparse
+import os
+import sqlite3
+import uuid
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+
+import almacen
+
+ARCHIVO_BASE = "datos.sqlite"
+
+# Tabla interna con la versión vigente de cada tabla de datos
+TABLA_VERSIONES = "_versiones"
+
+# Filas por bloque al leer con leer_bloques
+TAMANO_BLOQUE = 50_000
+
+# Segundos que una conexión espera a que otra libere la base
+ESPERA = 30
+
+_TIPOS_SQL = {"int64": "INTEGER", "float64": "REAL", "bool": "INTEGER", "fecha": "TEXT", "texto": "TEXT"}
+
+_catalogos = {}  # ruta de la base -> (huella del archivo, {tabla: versión})
+
+
+def ruta_base(ruta):
+    """Base SQLite de la carpeta de la tabla"""
+    return os.path.join(os.path.dirname(ruta), ARCHIVO_BASE)
+
+
+def nombre_tabla(ruta):
+    return os.path.splitext(os.path.basename(ruta))[0]
+
+
+def _sql(nombre):
+    #Identificador entre comillas dobles (los nombres vienen de archivos y columnas)
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+def conectar(ruta):
+    return sqlite3.connect(ruta_base(ruta), timeout=ESPERA)
+
+
+@contextmanager
+def _transaccion(ruta):
+    #Conexión con una transacción explícita: se confirma todo o nada
+    conexion = sqlite3.connect(ruta_base(ruta), timeout=ESPERA, isolation_level=None)
+    try:
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield conexion
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        conexion.execute("COMMIT")
+    finally:
+        conexion.close()
+
+
+def catalogo(carpeta):
+    """{tabla: versión} de las tablas guardadas en la base de la carpeta ({} si no hay base).
+
+    Se vuelve a consultar solo cuando cambia el archivo de la base.
+    """
+    base = os.path.join(carpeta, ARCHIVO_BASE)
+    try:
+        huella = almacen.huella_archivo(base)
+    except FileNotFoundError:
+        return {}
+    guardado = _catalogos.get(base)
+    if guardado is None or guardado[0] != huella:
+        with closing(sqlite3.connect(base, timeout=ESPERA)) as conexion:
+            nombres = [fila[0] for fila in conexion.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name != ?", (TABLA_VERSIONES,))]
+            versiones = {}
+            if conexion.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (TABLA_VERSIONES,)).fetchone():
+                versiones = dict(conexion.execute(f"SELECT tabla, version FROM {TABLA_VERSIONES}"))
+        guardado = (huella, {nombre: versiones.get(nombre) for nombre in nombres})
+        _catalogos[base] = guardado
+    return guardado[1]
+
+
+def contiene(ruta):
+    """True si la tabla de ruta (un .csv) está guardada en la base de su carpeta"""
+    return ruta.endswith(".csv") and nombre_tabla(ruta) in catalogo(os.path.dirname(ruta))
+
+
+def version_tabla(ruta):
+    return ("sqlite", catalogo(os.path.dirname(ruta)).get(nombre_tabla(ruta)))
+
+
+def _nueva_version(conexion, ruta):
+    conexion.execute(f"CREATE TABLE IF NOT EXISTS {TABLA_VERSIONES} (tabla TEXT PRIMARY KEY, version TEXT)")
+    conexion.execute(f"INSERT OR REPLACE INTO {TABLA_VERSIONES} VALUES (?, ?)",
+                     (nombre_tabla(ruta), uuid.uuid4().hex))
+
+
+def _entrada_esquema(ruta):
+    #Entrada registrada de la tabla, sin comparar con el encabezado del CSV (que puede no existir)
+    import esquema  # importación diferida: esquema depende de almacen
+    carpeta, tabla = os.path.split(ruta)
+    return esquema.cargar_esquema(carpeta)["tablas"].get(tabla) or {}
+
+
+def _valor_sql(valor):
+    #Escalares de numpy/pandas a tipos que sqlite3 sabe guardar; los nulos como NULL
+    if valor is None or (np.ndim(valor) == 0 and pd.isna(valor)):
+        return None
+    if isinstance(valor, pd.Timestamp):
+        return valor.strftime("%Y-%m-%d") if valor == valor.normalize() else valor.isoformat()
+    if hasattr(valor, "item"):
+        return valor.item()
+    return valor
+
+
+def _clave_sql(valor):
+    #Como clave_texto: 3.0 busca la fila de la clave 3
+    valor = _valor_sql(valor)
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _tipar(df, tipos):
+    #Llevar las columnas leídas a los tipos que tendrían al cargar el CSV con su esquema
+    for col in df.columns:
+        tipo = tipos.get(col)
+        if tipo == "fecha":
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="%Y-%m-%d")
+        elif tipo == "texto" or (tipo is None and df[col].dtype == object):
+            df[col] = df[col].astype("str")
+        elif tipo == "float64":
+            df[col] = df[col].astype("float64")
+        elif tipo == "bool" and df[col].notna().all():
+            df[col] = df[col].astype(bool)
+    return df
+
+
+def _consulta(ruta, columnas=None):
+    columnas = "*" if columnas is None else ", ".join(map(_sql, dict.fromkeys(columnas)))
+    return f"SELECT {columnas} FROM {_sql(nombre_tabla(ruta))} ORDER BY rowid"
+
+
+def leer_tabla(ruta, columnas=None):
+    """Cargar la tabla (o solo columnas), en el orden en que se agregaron las filas"""
+    with closing(conectar(ruta)) as conexion:
+        df = pd.read_sql_query(_consulta(ruta, columnas), conexion)
+    return _tipar(df, _entrada_esquema(ruta).get("columnas", {}))
+
+
+def leer_columnas(ruta, columnas):
+    return leer_tabla(ruta, columnas)
+
+
+def leer_bloques(ruta, tamano_bloque=TAMANO_BLOQUE):
+    """Recorrer la tabla de a tamano_bloque filas"""
+    tipos = _entrada_esquema(ruta).get("columnas", {})
+    with closing(conectar(ruta)) as conexion:
+        for bloque in pd.read_sql_query(_consulta(ruta), conexion, chunksize=tamano_bloque):
+            yield _tipar(bloque, tipos)
+
+
+def _tipo_sql(serie, tipo):
+    if tipo in _TIPOS_SQL:
+        return _TIPOS_SQL[tipo]
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(serie):
+        return "REAL"
+    return "TEXT"
+
+
+def _crear_tabla(conexion, ruta, df):
+    #Tabla con los tipos del esquema, índice sobre la clave y sobre cada clave foránea
+    entrada = _entrada_esquema(ruta)
+    tipos = entrada.get("columnas", {})
+    foraneas = {f["columna"]: f for f in entrada.get("foraneas", []) if f["columna"] in df.columns}
+    nombre = nombre_tabla(ruta)
+    definiciones = []
+    for col in df.columns:
+        definicion = f"{_sql(col)} {_tipo_sql(df[col], tipos.get(col))}"
+        if col in foraneas:
+            referida = foraneas[col]
+            definicion += f" REFERENCES {_sql(nombre_tabla(referida['tabla']))}({_sql(referida['columna_ref'])})"
+        definiciones.append(definicion)
+    conexion.execute(f"CREATE TABLE {_sql(nombre)} ({', '.join(definiciones)})")
+    clave = entrada.get("clave")
+    if clave in df.columns:
+        unico = "UNIQUE " if df[clave].is_unique else ""
+        conexion.execute(f"CREATE {unico}INDEX {_sql(f'{nombre}_{clave}')} ON {_sql(nombre)}({_sql(clave)})")
+    for col in foraneas:
+        conexion.execute(f"CREATE INDEX {_sql(f'{nombre}_{col}')} ON {_sql(nombre)}({_sql(col)})")
+
+
+def _insertar(conexion, ruta, filas):
+    #Agregar las filas de un DataFrame (solo las columnas que tiene la tabla)
+    nombre = _sql(nombre_tabla(ruta))
+    existentes = [fila[1] for fila in conexion.execute(f"PRAGMA table_info({nombre})")]
+    columnas = [col for col in filas.columns if col in existentes]
+    if not columnas or filas.empty:
+        return
+    conexion.executemany(
+        f"INSERT INTO {nombre} ({', '.join(map(_sql, columnas))}) VALUES ({', '.join('?' * len(columnas))})",
+        (tuple(map(_valor_sql, fila)) for fila in filas[columnas].itertuples(index=False, name=None)))
+
+
+def guardar_tabla(df, ruta):
+    """Reemplazar la tabla completa por df (se recrean la tabla y sus índices)"""
+    with _transaccion(ruta) as conexion:
+        conexion.execute(f"DROP TABLE IF EXISTS {_sql(nombre_tabla(ruta))}")
+        _crear_tabla(conexion, ruta, df)
+        _insertar(conexion, ruta, df)
+        _nueva_version(conexion, ruta)
+
+
+def anexar_filas(filas, ruta):
+    """Agregar filas (DataFrame) al final de la tabla"""
+    with _transaccion(ruta) as conexion:
+        _insertar(conexion, ruta, filas)
+        _nueva_version(conexion, ruta)
+
+
+def aplicar_cambios(ruta, cambios):
+    """Guardar las operaciones de un RegistroCambios en orden, en una sola transacción"""
+    nombre = _sql(nombre_tabla(ruta))
+    with _transaccion(ruta) as conexion:
+        existentes = {fila[1] for fila in conexion.execute(f"PRAGMA table_info({nombre})")}
+        for op in cambios.operaciones:
+            if op["op"] == "insertar":
+                _insertar(conexion, ruta, pd.DataFrame([op["fila"]]))
+                continue
+            condicion = f"{_sql(op['columna_clave'])} = ?"
+            if op["op"] == "eliminar":
+                conexion.execute(f"DELETE FROM {nombre} WHERE {condicion}", (_clave_sql(op["clave"]),))
+                continue
+            valores = {col: valor for col, valor in op["valores"].items() if col in existentes}
+            if valores:
+                asignaciones = ", ".join(f"{_sql(col)} = ?" for col in valores)
+                conexion.execute(f"UPDATE {nombre} SET {asignaciones} WHERE {condicion}",
+                                 [*map(_valor_sql, valores.values()), _clave_sql(op["clave"])])
+        _nueva_version(conexion, ruta)
+
+
+def migrar(carpeta, nombres=None, reemplazar=False):
+    """Copiar las tablas CSV de la carpeta (todas o las de nombres) a la base.
+
+    Cada tabla se lee con su diario aplicado y se guarda bajo su bloqueo;
+    desde ese momento la base es la copia vigente. Los CSV quedan como
+    respaldo, con el diario ya volcado. Las tablas que ya están en la base se
+    saltean, salvo reemplazar=True (vuelven a copiarse desde el CSV).
+    Devuelve {archivo: filas copiadas, o None si se salteó}.
+    """
+    import esquema  # importación diferida: esquema depende de almacen
+    if nombres is None:
+        nombres = sorted(f for f in os.listdir(carpeta) if f.endswith(".csv"))
+    resultado = {}
+    for archivo in nombres:
+        ruta = os.path.join(carpeta, archivo)
+        if contiene(ruta) and not reemplazar:
+            resultado[archivo] = None
+            continue
+        # El esquema (tipos, clave, foráneas) se registra desde el CSV antes de copiar
+        esquema.esquema_tabla(ruta)
+        with almacen.bloqueo(ruta):
+            entradas = almacen.leer_diario(ruta)
+            df = almacen.aplicar_diario(almacen.leer_csv(ruta), entradas)
+            guardar_tabla(df, ruta)
+            if entradas:
+                almacen.escribir_csv(df, ruta)
+                os.remove(almacen.ruta_diario(ruta))
+        resultado[archivo] = len(df)
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrar las tablas CSV a una base SQLite")
+    parser.add_argument("tablas", nargs="*", help="CSV a migrar (por defecto todos los de la carpeta)")
+    parser.add_argument("--carpeta", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--reemplazar", action="store_true",
+                        help="Volver a copiar desde el CSV las tablas que ya están en la base")
+    args = parser.parse_args()
+    resultado = migrar(args.carpeta, args.tablas or None, args.reemplazar)
+    for archivo, filas in resultado.items():
+        print(f" {archivo}: {'ya estaba en la base' if filas is None else f'{filas} filas'}")
+    print(f" Base: {os.path.join(args.carpeta, ARCHIVO_BASE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Caché de tablas compartida por todo el proceso.
+
+Pensada para el dashboard: todas las sesiones de Streamlit leen las tablas del
+mismo almacén en memoria en lugar de cargar cada una su propia copia. Cada
+entrada se guarda junto con la versión de la tabla en disco; si el archivo
+cambia, la entrada deja de valer y se vuelve a cargar. Cuando el total supera
+el presupuesto de memoria se descartan las tablas usadas hace más tiempo.
+
+Los DataFrames devueltos son compartidos: quien necesite modificarlos debe
+trabajar sobre una copia. Cada uno lleva en attrs["version_tabla"] la versión
+de la tabla que representa, la base para guardar cambios sobre él (ver
+almacen.confirmar_cambios).
+"""
+import threading
+from collections import OrderedDict
+
+import almacen
+
+
+class CacheTablas:
+    """Tablas en memoria indexadas por ruta y versión, con expulsión LRU.
+
+    Cada entrada puede llevar estructuras derivadas de la tabla (índices,
+    estadísticas...) que se descartan junto con ella.
+    """
+
+    def __init__(self, limite_bytes, cargador=almacen.leer_tabla):
+        self.limite_bytes = limite_bytes
+        self.cargador = cargador
+        self._entradas = OrderedDict()  # ruta -> {"version", "df", "bytes", "derivados"}
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _registrar(self, ruta, version, df, derivados=None, bytes_sin_compactar=None):
+        tamano = int(df.memory_usage(deep=True).sum())
+        if bytes_sin_compactar is None:
+            bytes_sin_compactar = df.attrs.get("bytes_sin_compactar", tamano)
+        df.attrs["version_tabla"] = version
+        self._entradas[ruta] = {"version": version, "df": df, "bytes": tamano,
+                                "bytes_sin_compactar": bytes_sin_compactar,
+                                "derivados": derivados or {}}
+        self._entradas.move_to_end(ruta)
+        self._expulsar()
+
+    def obtener(self, ruta):
+        """Devolver la tabla de ruta, cargándola con el cargador si no está vigente"""
+        version = almacen.version_tabla(ruta)
+        with self._bloqueo:
+            entrada = self._entradas.get(ruta)
+            if entrada is not None and entrada["version"] == version:
+                self._entradas.move_to_end(ruta)
+                self.aciertos += 1
+                return entrada["df"]
+            self.fallos += 1
+
+        df = self.cargador(ruta)
+        with self._bloqueo:
+            self._registrar(ruta, version, df)
+        return df
+
+    def derivado(self, ruta, nombre, constructor):
+        """Estructura derivada de la tabla vigente, construida con constructor(df) si falta"""
+        df = self.obtener(ruta)
+        with self._bloqueo:
+            entrada = self._entradas.get(ruta)
+            if entrada is not None and entrada["df"] is df and nombre in entrada["derivados"]:
+                return entrada["derivados"][nombre]
+        objeto = constructor(df)
+        with self._bloqueo:
+            entrada = self._entradas.get(ruta)
+            if entrada is not None and entrada["df"] is df:
+                entrada["derivados"][nombre] = objeto
+        return objeto
+
+    def reemplazar(self, ruta, version_anterior, version, df, cambios):
+        """Registrar df como la versión version de la tabla, resultante de guardar
+        cambios sobre version_anterior.
+
+        version debe tomarse bajo el bloqueo de la tabla en la misma escritura
+        (la cambios.version_base que deja almacen.confirmar_cambios): leída
+        después, podría ser ya la de otra sesión que guardó en el medio, y df no
+        tiene esas filas. Los derivados con método aplicar_operaciones se
+        actualizan en lugar de reconstruirse. Si la entrada en caché no era
+        version_anterior (otro proceso escribió en el medio) simplemente se
+        descarta.
+        """
+        with self._bloqueo:
+            entrada = self._entradas.pop(ruta, None)
+            if entrada is None or entrada["version"] != version_anterior:
+                return
+            derivados = {}
+            for nombre, objeto in entrada["derivados"].items():
+                if hasattr(objeto, "aplicar_operaciones"):
+                    objeto.aplicar_operaciones(cambios.operaciones, df)
+                    derivados[nombre] = objeto
+            # Se conserva la proporción de compactación de la versión anterior
+            proporcion = entrada["bytes_sin_compactar"] / max(entrada["bytes"], 1)
+            tamano = int(df.memory_usage(deep=True).sum())
+            self._registrar(ruta, version, df, derivados, int(tamano * proporcion))
+
+    def invalidar(self, ruta=None):
+        """Descartar la tabla de ruta (o todas si ruta es None)"""
+        with self._bloqueo:
+            if ruta is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(ruta, None)
+
+    def _expulsar(self):
+        #Quitar las tablas menos usadas hasta entrar en el presupuesto (siempre queda la última)
+        while len(self._entradas) > 1 and self.bytes_totales() > self.limite_bytes:
+            self._entradas.popitem(last=False)
+
+    def bytes_totales(self):
+        return sum(entrada["bytes"] for entrada in self._entradas.values())
+
+    def bytes_sin_compactar(self):
+        return sum(entrada["bytes_sin_compactar"] for entrada in self._entradas.values())
+
+    def tasa_aciertos(self):
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+    def estadisticas(self):
+        """Resumen del estado de la caché"""
+        with self._bloqueo:
+            return {
+                "tablas": len(self._entradas),
+                "bytes": self.bytes_totales(),
+                "bytes_sin_compactar": self.bytes_sin_compactar(),
+                "limite_bytes": self.limite_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.tasa_aciertos(),
+            }
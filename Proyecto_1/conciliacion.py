@@ -0,0 +1,168 @@
+"""Conciliación de totales de factura: venta.monto contra las líneas de factura_det.
+
+El total esperado de cada factura es la suma de cantidad * producto.precio de
+sus líneas, con el IVA de ALICUOTAS_IVA según la condición de IVA del
+encabezado. Se calcula para todas las facturas con una sola unión y un solo
+agrupamiento, y se informan las que difieren de venta.monto en más de la
+tolerancia, las que tienen líneas pero no venta y las que tienen venta pero no
+líneas.
+
+El resultado queda guardado en CARPETA_CACHE. En la siguiente ejecución, si
+producto no cambió y factura_det, factura_enc y venta solo recibieron filas
+al final, se vuelven a revisar únicamente las facturas tocadas por esas filas.
+
+Uso: python conciliacion.py [carpeta] [--completa] [--cada SEGUNDOS]
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import almacen
+
+# Diferencia máxima admitida entre venta.monto y el total calculado
+TOLERANCIA = 0.01
+
+# Alícuota de IVA por id_cond_iva que se suma al neto de las líneas
+# (vacío: venta.monto se compara contra el neto)
+ALICUOTAS_IVA = {}
+
+# Columnas que se cargan de cada tabla
+COLUMNAS = {
+    "factura_det.csv": ["id_factura_det", "id_factura_enc", "id_producto", "cantidad"],
+    "factura_enc.csv": ["id_factura_enc", "id_cond_iva"],
+    "venta.csv": ["id_venta", "id_factura_enc", "monto"],
+    "producto.csv": ["id_producto", "precio"],
+}
+# Tablas que pueden crecer por anexado sin obligar a revisar todo
+TABLAS_HECHOS = ["factura_det.csv", "factura_enc.csv", "venta.csv"]
+
+
+def cargar_tablas(carpeta):
+    """Solo las columnas necesarias de cada tabla"""
+    return {nombre: almacen.leer_columnas(os.path.join(carpeta, nombre), columnas)
+            for nombre, columnas in COLUMNAS.items()}
+
+
+def totales_esperados(det, producto, enc, alicuotas=None):
+    """Total calculado por id_factura_enc (Serie)"""
+    precios = producto.drop_duplicates("id_producto").set_index("id_producto")["precio"]
+    importe = det["cantidad"].to_numpy(dtype="float64") * precios.reindex(det["id_producto"]).to_numpy(dtype="float64")
+    esperado = pd.Series(importe, index=det["id_factura_enc"].to_numpy()).groupby(level=0).sum()
+    if alicuotas:
+        condicion = enc.drop_duplicates("id_factura_enc").set_index("id_factura_enc")["id_cond_iva"]
+        factor = 1 + condicion.map(alicuotas).astype("float64").fillna(0)
+        esperado = esperado * factor.reindex(esperado.index).fillna(1).to_numpy()
+    return esperado
+
+
+def conciliar(tablas, facturas=None, tolerancia=TOLERANCIA, alicuotas=None):
+    """Facturas cuyo monto no concilia (DataFrame con id_factura_enc, monto,
+    esperado, diferencia y motivo). facturas: revisar solo esos id_factura_enc."""
+    alicuotas = ALICUOTAS_IVA if alicuotas is None else alicuotas
+    det, enc, venta = (tablas[nombre] for nombre in TABLAS_HECHOS)
+    if facturas is not None:
+        det = det[det["id_factura_enc"].isin(facturas)]
+        enc = enc[enc["id_factura_enc"].isin(facturas)]
+        venta = venta[venta["id_factura_enc"].isin(facturas)]
+    esperado = totales_esperados(det, tablas["producto.csv"], enc, alicuotas)
+    monto = venta.groupby("id_factura_enc")["monto"].sum()
+    resultado = pd.DataFrame({"monto": monto, "esperado": esperado})
+    resultado["diferencia"] = resultado["monto"] - resultado["esperado"]
+    resultado["motivo"] = np.select(
+        [resultado["monto"].isna(), resultado["esperado"].isna(),
+         resultado["diferencia"].abs() > tolerancia],
+        ["sin venta", "sin líneas", "diferencia"], default="")
+    resultado.index.name = "id_factura_enc"
+    return resultado[resultado["motivo"] != ""].reset_index()
+
+
+def _ruta_estado(carpeta):
+    return os.path.join(carpeta, almacen.CARPETA_CACHE, "conciliacion.json")
+
+
+def _parametros(tolerancia):
+    #Con otra tolerancia u otras alícuotas el resultado guardado no sirve
+    return {"tolerancia": tolerancia, "alicuotas": {str(k): v for k, v in ALICUOTAS_IVA.items()}}
+
+
+def _huellas(carpeta):
+    return {nombre: almacen.huella_contenido(os.path.join(carpeta, nombre)) for nombre in COLUMNAS}
+
+
+def _facturas_tocadas(carpeta, estado, tablas):
+    #id_factura_enc de las filas anexadas desde la última ejecución, o None si
+    #hubo otros cambios y hay que revisar todo
+    if estado["huellas"].get("producto.csv") != almacen.huella_contenido(os.path.join(carpeta, "producto.csv")):
+        return None
+    for nombre in TABLAS_HECHOS:
+        if nombre not in estado["huellas"] or not almacen.solo_anexado(os.path.join(carpeta, nombre), estado["huellas"][nombre]):
+            return None
+    return pd.concat([tablas[nombre]["id_factura_enc"].iloc[estado["filas"][nombre]:]
+                      for nombre in TABLAS_HECHOS]).unique()
+
+
+def ejecutar(carpeta, forzar=False, tolerancia=TOLERANCIA):
+    """Conciliar la carpeta, de forma incremental si se puede.
+
+    Devuelve (discrepancias, modo, revisadas) con modo "vigente", "incremental"
+    o "completa" y revisadas la cantidad de facturas vueltas a calcular.
+    """
+    estado = almacen.leer_json(_ruta_estado(carpeta))
+    huellas = _huellas(carpeta)
+    if forzar or not estado or estado.get("parametros") != _parametros(tolerancia):
+        estado = None
+    elif estado["huellas"] == huellas:
+        return pd.DataFrame(estado["discrepancias"]), "vigente", 0
+
+    tablas = cargar_tablas(carpeta)
+    tocadas = _facturas_tocadas(carpeta, estado, tablas) if estado else None
+    if tocadas is None:
+        discrepancias = conciliar(tablas, tolerancia=tolerancia)
+        modo, revisadas = "completa", tablas["factura_enc.csv"]["id_factura_enc"].nunique()
+    else:
+        previas = pd.DataFrame(estado["discrepancias"])
+        if len(previas):
+            previas = previas[~previas["id_factura_enc"].isin(tocadas)]
+        nuevas = conciliar(tablas, facturas=tocadas, tolerancia=tolerancia)
+        discrepancias = pd.concat([previas, nuevas], ignore_index=True) if len(previas) else nuevas
+        modo, revisadas = "incremental", len(tocadas)
+
+    discrepancias = discrepancias.sort_values("id_factura_enc").reset_index(drop=True)
+    almacen.escribir_json_atomico(_ruta_estado(carpeta), {
+        "huellas": huellas,
+        "filas": {nombre: len(tablas[nombre]) for nombre in TABLAS_HECHOS},
+        "parametros": _parametros(tolerancia),
+        "discrepancias": discrepancias.to_dict("records"),
+    })
+    return discrepancias, modo, revisadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conciliar venta.monto con las líneas de factura")
+    parser.add_argument("carpeta", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--completa", action="store_true", help="Revisar todas las facturas")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    parser.add_argument("--cada", type=float, default=None,
+                        help="Repetir la conciliación cada tantos segundos")
+    args = parser.parse_args()
+    forzar = args.completa
+    while True:
+        inicio = time.perf_counter()
+        discrepancias, modo, revisadas = ejecutar(args.carpeta, forzar, args.tolerancia)
+        print(f" [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Conciliación {modo}: "
+              f"{revisadas} facturas revisadas en {time.perf_counter() - inicio:.2f} s, "
+              f"{len(discrepancias)} con diferencias")
+        if len(discrepancias):
+            print(discrepancias.to_string(index=False))
+        if args.cada is None:
+            return 1 if len(discrepancias) else 0
+        forzar = False
+        time.sleep(args.cada)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,329 @@
+"""Consultas SQL sobre todas las tablas de la carpeta.
+
+Antes de ejecutar una consulta se analiza su texto para leer lo mínimo: solo
+las tablas que nombra y, de cada una, solo las columnas que aparecen en la
+consulta (todas si hay un * o un NATURAL JOIN, que une por columnas que
+no se nombran). Si la consulta es un único SELECT sin uniones
+externas y su WHERE es una conjunción, las condiciones columna <op> valor
+que tocan una sola tabla se aplican al leerla, antes de pasar las filas al
+motor (que las vuelve a evaluar, así que el resultado no cambia).
+
+Motores, en orden de preferencia:
+- la base SQLite de la carpeta (ver almacen_sqlite), si todas las tablas de
+  la consulta están migradas: la consulta corre allí, en solo lectura, con
+  sus índices;
+- DuckDB, si está instalado;
+- SQLite en memoria, con las tablas ya recortadas.
+
+Los resultados se guardan en memoria por (consulta, motor, versiones de las
+tablas): repetir una consulta sin que cambien los datos no la vuelve a correr.
+
+Uso: python consultas.py "SELECT ..." [--carpeta CARPETA] [--verificar]
+"""
+import argparse
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+import pandas as pd
+
+import almacen
+import esquema
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Resultados que se conservan en memoria (se descartan los usados hace más tiempo)
+RESULTADOS_EN_CACHE = 32
+
+_resultados = OrderedDict()  # (consulta, motor, versiones) -> (resultado, tablas)
+_bloqueo = threading.Lock()
+
+_TOKENS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+_IDENTIFICADOR = re.compile(r'"((?:[^"]|"")+)"|\b([A-Za-z_][A-Za-z0-9_]*)\b')
+_ASTERISCO = re.compile(r"(?:\bselect\s+(?:distinct\s+)?|,|\.)\s*\*", re.I)
+_NATURAL = re.compile(r"\bnatural\b", re.I)
+_ORIGEN = re.compile(r'\b(?:from|join)\s+("(?:[^"]|"")+"|\w+)(?:\s+(?:as\s+)?(\w+))?', re.I)
+_SIN_FILTROS = re.compile(r"\b(?:union|intersect|except|left|right|full|outer|natural|between)\b", re.I)
+_WHERE = re.compile(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\bhaving\b|\blimit\b|\bwindow\b|;|$)",
+                    re.I | re.S)
+_CONDICION = re.compile(r'^\s*(?:(\w+)\.)?(\w+|"(?:[^"]|"")+")\s*(<=|>=|<>|!=|==|=|<|>)\s*'
+                        r"(\x00\d+\x00|-?\d+(?:\.\d+)?)\s*$")
+_PALABRAS_CLAVE = {"where", "on", "join", "inner", "left", "right", "full", "cross", "natural", "group",
+                   "order", "limit", "having", "using", "union", "window", "outer", "as"}
+
+_COMPARAR = {
+    "=": lambda serie, valor: serie == valor,
+    "==": lambda serie, valor: serie == valor,
+    "<>": lambda serie, valor: serie.notna() & (serie != valor),
+    "!=": lambda serie, valor: serie.notna() & (serie != valor),
+    "<": lambda serie, valor: serie < valor,
+    "<=": lambda serie, valor: serie <= valor,
+    ">": lambda serie, valor: serie > valor,
+    ">=": lambda serie, valor: serie >= valor,
+}
+
+
+def _sin_literales(sql):
+    #Texto sin comentarios y con cada literal reemplazado por una marca \x00n\x00
+    literales = []
+
+    def reemplazar(m):
+        if not m.group(0).startswith("'"):
+            return " "
+        literales.append(m.group(0)[1:-1].replace("''", "'"))
+        return f"\x00{len(literales) - 1}\x00"
+
+    return _TOKENS.sub(reemplazar, sql), literales
+
+
+def _nombre(identificador):
+    #Identificador sin comillas, en minúsculas (SQL no distingue mayúsculas)
+    if identificador.startswith('"'):
+        identificador = identificador[1:-1].replace('""', '"')
+    return identificador.lower()
+
+
+def columnas_tabla(ruta):
+    """Columnas de la tabla según su esquema registrado (o el encabezado del CSV)"""
+    entrada = esquema.esquema_tabla(ruta)
+    if entrada:
+        return list(entrada["columnas"])
+    return list(pd.read_csv(ruta, nrows=0).columns)
+
+
+def _condiciones(where):
+    #Partes de where unidas por AND fuera de paréntesis; None si hay un OR a ese nivel
+    partes, actual, profundidad = [], "", 0
+    for token in re.split(r"(\(|\)|\band\b|\bor\b)", where, flags=re.I):
+        palabra = token.lower()
+        if profundidad == 0 and palabra == "or":
+            return None
+        if profundidad == 0 and palabra == "and":
+            partes.append(actual)
+            actual = ""
+            continue
+        profundidad += {"(": 1, ")": -1}.get(token, 0)
+        actual += token
+    return partes + [actual]
+
+
+def analizar(sql, carpeta):
+    """Plan de lectura de la consulta: {archivo: {"columnas": [...] o None (todas),
+    "filtros": [(columna, operador, valor)]}} para cada tabla de la carpeta que nombra"""
+    texto, literales = _sin_literales(sql)
+    nombres = [(m.group(0), m.start(), m.end()) for m in _IDENTIFICADOR.finditer(texto)]
+    usados = {_nombre(nombre) for nombre, _, _ in nombres}
+    disponibles = {os.path.splitext(archivo)[0].lower(): archivo for archivo in almacen.listar_tablas(carpeta)}
+    # Un NATURAL JOIN une por las columnas comunes sin nombrarlas: hay que leerlas todas
+    todas = _ASTERISCO.search(texto) is not None or _NATURAL.search(texto) is not None
+
+    plan, columnas = {}, {}
+    for nombre, archivo in disponibles.items():
+        if nombre not in usados:
+            continue
+        columnas[archivo] = {col.lower(): col for col in columnas_tabla(os.path.join(carpeta, archivo))}
+        plan[archivo] = {
+            "columnas": None if todas else [col for clave, col in columnas[archivo].items() if clave in usados],
+            "filtros": [],
+        }
+
+    # Condiciones que se pueden aplicar al leer cada tabla
+    where = _WHERE.search(texto)
+    selects = len(re.findall(r"\bselect\b", texto, re.I))
+    if where is None or selects != 1 or _SIN_FILTROS.search(texto):
+        return plan
+    condiciones = _condiciones(where.group(1))
+    if condiciones is None:
+        return plan
+    alias = {}
+    for m in _ORIGEN.finditer(texto):
+        archivo = disponibles.get(_nombre(m.group(1)))
+        if archivo is not None:
+            alias[_nombre(m.group(1))] = archivo
+            if m.group(2) and m.group(2).lower() not in _PALABRAS_CLAVE:
+                alias[m.group(2).lower()] = archivo
+    # Una tabla nombrada dos veces (autounión) no se puede recortar por una sola de sus apariciones
+    apariciones = {}
+    for nombre, _, fin in nombres:
+        archivo = disponibles.get(_nombre(nombre))
+        if archivo is not None and not texto[fin:].lstrip().startswith("."):
+            apariciones[archivo] = apariciones.get(archivo, 0) + 1
+    for condicion in condiciones:
+        m = _CONDICION.match(condicion)
+        if m is None:
+            continue
+        calificador, columna, operador, literal = m.groups()
+        columna = _nombre(columna)
+        if calificador is not None:
+            candidatas = [alias.get(calificador.lower())]
+        else:
+            candidatas = [archivo for archivo in plan if columna in columnas[archivo]]
+        if len(candidatas) != 1 or candidatas[0] not in plan or columna not in columnas[candidatas[0]]:
+            continue
+        archivo = candidatas[0]
+        if apariciones.get(archivo, 0) != 1:
+            continue
+        if literal.startswith("\x00"):
+            valor = literales[int(literal.strip("\x00"))]
+        else:
+            valor = float(literal) if "." in literal else int(literal)
+        plan[archivo]["filtros"].append((columnas[archivo][columna], operador, valor))
+    return plan
+
+
+def _filtrar(df, filtros):
+    #Aplicar las condiciones cuyo tipo coincide con el de la columna (las demás las evalúa el motor)
+    mascara = pd.Series(True, index=df.index)
+    aplicados = []
+    for columna, operador, valor in filtros:
+        serie = df[columna]
+        if isinstance(valor, str):
+            compatible = pd.api.types.is_string_dtype(serie)
+        else:
+            compatible = pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie)
+        if compatible:
+            mascara &= _COMPARAR[operador](serie, valor).fillna(False).astype(bool)
+            aplicados.append(f"{columna} {operador} {valor!r}")
+    return (df[mascara] if aplicados else df), aplicados
+
+
+def _leer(ruta, detalle):
+    #Leer la tabla recortada según el plan
+    if detalle["columnas"] is None:
+        df = almacen.leer_tabla(ruta)
+    else:
+        # La clave se lee siempre: el diario del CSV se reproduce por clave
+        clave = esquema.columna_clave(ruta)
+        columnas = detalle["columnas"] or [columnas_tabla(ruta)[0]]
+        df = almacen.leer_columnas(ruta, ([clave] if clave else []) + columnas)
+    return _filtrar(df, detalle["filtros"])
+
+
+def motor_para(carpeta, plan):
+    """Motor con el que se ejecutaría una consulta con ese plan"""
+    if plan and all(almacen.base_sqlite(os.path.join(carpeta, archivo)) for archivo in plan):
+        return "sqlite (base)"
+    return "duckdb" if duckdb is not None else "sqlite (memoria)"
+
+
+def _ejecutar_en_base(carpeta, sql):
+    import almacen_sqlite
+    uri = pathlib.Path(os.path.abspath(os.path.join(carpeta, almacen_sqlite.ARCHIVO_BASE))).as_uri() + "?mode=ro"
+    with closing(sqlite3.connect(uri, uri=True, timeout=almacen_sqlite.ESPERA)) as conexion:
+        return pd.read_sql_query(sql, conexion)
+
+
+def _ejecutar_en_memoria(sql, tablas):
+    if duckdb is not None:
+        with duckdb.connect() as conexion:
+            for nombre, df in tablas.items():
+                conexion.register(nombre, df)
+            return conexion.execute(sql).df()
+    with closing(sqlite3.connect(":memory:")) as conexion:
+        for nombre, df in tablas.items():
+            # Fechas como 'AAAA-MM-DD', igual que en el CSV y en la base
+            fechas = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])
+                      and (df[col].dropna() == df[col].dropna().dt.normalize()).all()]
+            if fechas:
+                df = df.assign(**{col: df[col].dt.strftime("%Y-%m-%d") for col in fechas})
+            df.to_sql(nombre, conexion, index=False)
+        return pd.read_sql_query(sql, conexion)
+
+
+def ejecutar(carpeta, sql, recortar=True):
+    """Ejecutar una consulta SELECT sobre las tablas de la carpeta.
+
+    Devuelve (resultado, informe); informe tiene el motor, los segundos que
+    tardó, si el resultado vino de la caché y, por tabla, las columnas
+    leídas, las filas que pasaron al motor y las condiciones aplicadas al
+    leer. Con recortar=False las tablas se leen completas, sin filtros
+    previos (ver verificar). El resultado es compartido con la caché: no
+    modificarlo.
+    """
+    inicio = time.perf_counter()
+    sql = sql.strip().rstrip(";").strip()
+    texto, _ = _sin_literales(sql)
+    if not re.match(r"\s*(select|with)\b", texto, re.I) or ";" in texto:
+        raise ValueError("Solo se admite una consulta SELECT (o WITH ... SELECT)")
+    plan = analizar(sql, carpeta)
+    if not recortar:
+        plan = {archivo: {"columnas": None, "filtros": []} for archivo in plan}
+    motor = motor_para(carpeta, plan)
+    versiones = tuple(sorted((archivo, almacen.version_tabla(os.path.join(carpeta, archivo)))
+                             for archivo in plan))
+    clave = (sql, motor, versiones, recortar)
+    with _bloqueo:
+        guardado = _resultados.get(clave)
+        if guardado is not None:
+            _resultados.move_to_end(clave)
+    if guardado is not None:
+        resultado, tablas = guardado
+        return resultado, {"motor": motor, "segundos": time.perf_counter() - inicio,
+                           "desde_cache": True, "tablas": tablas}
+
+    tablas = {}
+    if motor == "sqlite (base)":
+        resultado = _ejecutar_en_base(carpeta, sql)
+        # La base resuelve columnas y condiciones con sus propios índices
+        tablas = {archivo: {"columnas": None, "filas": None, "filtros": []} for archivo in plan}
+    else:
+        datos = {}
+        for archivo, detalle in plan.items():
+            df, aplicados = _leer(os.path.join(carpeta, archivo), detalle)
+            datos[os.path.splitext(archivo)[0]] = df
+            tablas[archivo] = {"columnas": list(df.columns), "filas": len(df), "filtros": aplicados}
+        resultado = _ejecutar_en_memoria(sql, datos)
+
+    with _bloqueo:
+        _resultados[clave] = (resultado, tablas)
+        while len(_resultados) > RESULTADOS_EN_CACHE:
+            _resultados.popitem(last=False)
+    return resultado, {"motor": motor, "segundos": time.perf_counter() - inicio,
+                       "desde_cache": False, "tablas": tablas}
+
+
+def verificar(carpeta, sql):
+    """True si la consulta da el mismo resultado leyendo lo mínimo que leyendo
+    las tablas completas (el orden de las filas no cuenta)"""
+    recortado, _ = ejecutar(carpeta, sql)
+    completo, _ = ejecutar(carpeta, sql, recortar=False)
+    if list(recortado.columns) != list(completo.columns) or len(recortado) != len(completo):
+        return False
+    columnas = list(recortado.columns)
+    return (recortado.sort_values(columnas).reset_index(drop=True)
+            .equals(completo.sort_values(columnas).reset_index(drop=True)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultar con SQL las tablas de la carpeta")
+    parser.add_argument("consulta")
+    parser.add_argument("--carpeta", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--verificar", action="store_true",
+                        help="Comparar el resultado con el de leer las tablas completas")
+    args = parser.parse_args()
+    if args.verificar:
+        iguales = verificar(args.carpeta, args.consulta)
+        print(" Mismo resultado que leyendo las tablas completas" if iguales
+              else " DISTINTO resultado que leyendo las tablas completas")
+        raise SystemExit(0 if iguales else 1)
+    resultado, informe = ejecutar(args.carpeta, args.consulta)
+    print(resultado.to_string(index=False))
+    print(f"\n {len(resultado)} filas en {informe['segundos'] * 1000:.1f} ms ({informe['motor']})")
+    for archivo, detalle in informe["tablas"].items():
+        filtros = f", filtros: {'; '.join(detalle['filtros'])}" if detalle["filtros"] else ""
+        if detalle["columnas"] is None:
+            print(f"   {archivo}: leída por la base")
+        else:
+            print(f"   {archivo}: {detalle['filas']} filas, columnas {', '.join(detalle['columnas'])}{filtros}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cubo OLAP de ventas preagregado sobre la vista materializada (ver vistas.py).
+
+El cubo guarda importe, cantidad y cantidad de líneas agrupados por el nivel
+más fino de cada dimensión (día, rubro, provincia, localidad, proveedor,
+cond_iva e id_sucursal). Las consultas de roll-up (por mes, por provincia...)
+y drill-down (filtrar un valor y bajar a una dimensión más fina) se resuelven
+agrupando el cubo, que es mucho más chico que la vista. Cuando la vista se
+actualiza de forma incremental, el cubo solo suma las líneas agregadas y
+resta las descartadas.
+
+Uso: python cubo.py [carpeta] [--por dim1,dim2] [--completo]
+"""
+import argparse
+import os
+
+import pandas as pd
+
+import almacen
+import vistas
+
+# Dimensiones guardadas en el cubo, de la vista de ventas
+DIMENSIONES = ["dia", "rubro", "provincia", "localidad", "proveedor", "cond_iva", "id_sucursal"]
+MEDIDAS = ["importe", "cantidad", "lineas"]
+
+# Niveles de fecha para el roll-up, calculados desde "dia"
+NIVELES_FECHA = {
+    "dia": lambda dia: dia,
+    "mes": lambda dia: dia.dt.to_period("M").astype(str),
+    "anio": lambda dia: dia.dt.year,
+}
+
+
+def _ruta_cubo(carpeta, nombre):
+    return os.path.join(carpeta, almacen.CARPETA_CACHE, nombre)
+
+
+def agregar(lineas):
+    """Agregar líneas de la vista de ventas al nivel más fino del cubo"""
+    base = lineas[["rubro", "provincia", "localidad", "proveedor", "cond_iva", "id_sucursal",
+                   "importe", "cantidad"]].copy()
+    base.insert(0, "dia", pd.to_datetime(lineas["fecha"]).dt.normalize())
+    base["lineas"] = 1
+    return (base.groupby(DIMENSIONES, dropna=False, observed=True, sort=False)[MEDIDAS]
+            .sum().reset_index())
+
+
+def combinar(cubo, agregadas, quitadas):
+    """Sumar al cubo las líneas agregadas y restarle las quitadas"""
+    partes = [cubo, agregar(agregadas)]
+    if len(quitadas):
+        restar = agregar(quitadas)
+        restar[MEDIDAS] = -restar[MEDIDAS]
+        partes.append(restar)
+    cubo = (pd.concat(partes, ignore_index=True)
+            .groupby(DIMENSIONES, dropna=False, sort=False)[MEDIDAS].sum().reset_index())
+    return cubo[cubo["lineas"] != 0].reset_index(drop=True)
+
+
+def actualizar_cubo(carpeta, forzar=False):
+    """Devolver el cubo al día con la vista de ventas.
+
+    Devuelve (cubo, modo) con modo "vigente", "incremental" o "completo".
+    """
+    archivo = _ruta_cubo(carpeta, "cubo_ventas." + almacen.FORMATO_BINARIO)
+    archivo_meta = _ruta_cubo(carpeta, "cubo_ventas.meta.json")
+    meta = almacen.leer_json(archivo_meta)
+    vigente = (not forzar and meta and os.path.exists(archivo)
+               and meta.get("formato") == almacen.FORMATO_BINARIO)
+    #Si las tablas de origen no cambiaron no hace falta ni abrir la vista
+    if vigente and meta["huellas"] == vistas.huellas_origen(carpeta):
+        return almacen.leer_binario(archivo), "vigente"
+
+    huellas_previas = vistas.huellas_vista(carpeta)
+    vista, modo_vista, quitadas, agregadas = vistas.refrescar_vista(carpeta, forzar)
+    huellas = vistas.huellas_vista(carpeta)
+
+    #Solo se puede sumar el cambio si el cubo estaba al día con la vista anterior
+    if vigente and modo_vista == "incremental" and meta["huellas"] == huellas_previas:
+        cubo = combinar(almacen.leer_binario(archivo), agregadas, quitadas)
+        _guardar(cubo, huellas, archivo, archivo_meta)
+        return cubo, "incremental"
+
+    cubo = agregar(vista)
+    _guardar(cubo, huellas, archivo, archivo_meta)
+    return cubo, "completo"
+
+
+def _guardar(cubo, huellas, archivo, archivo_meta):
+    almacen.escribir_binario(cubo, archivo)
+    almacen.escribir_json_atomico(archivo_meta, {"formato": almacen.FORMATO_BINARIO, "huellas": huellas})
+
+
+def consultar(cubo, dimensiones, filtros=None):
+    """Agrupar el cubo por dimensiones (DIMENSIONES o niveles de NIVELES_FECHA).
+
+    filtros: {dimensión: valor o lista de valores} para hacer drill-down.
+    """
+    datos = cubo
+    necesarias = set(dimensiones) | set(filtros or {})
+    extra = {nivel: NIVELES_FECHA[nivel](cubo["dia"]) for nivel in necesarias
+             if nivel in NIVELES_FECHA and nivel != "dia"}
+    if extra:
+        datos = cubo.assign(**extra)
+    for dimension, valor in (filtros or {}).items():
+        valores = valor if isinstance(valor, (list, tuple, set)) else [valor]
+        datos = datos[datos[dimension].isin(valores)]
+    if not dimensiones:
+        return datos[MEDIDAS].sum().to_frame().T
+    return (datos.groupby(list(dimensiones), dropna=False, observed=True)[MEDIDAS]
+            .sum().reset_index())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Actualizar y consultar el cubo de ventas")
+    parser.add_argument("carpeta", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--por", default="mes", help="Dimensiones separadas por coma")
+    parser.add_argument("--completo", action="store_true", help="Reconstruir desde cero")
+    args = parser.parse_args()
+    cubo, modo = actualizar_cubo(args.carpeta, forzar=args.completo)
+    print(f" Cubo de ventas ({modo}): {len(cubo)} celdas")
+    dimensiones = [d.strip() for d in args.por.split(",") if d.strip()]
+    print(consultar(cubo, dimensiones).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Registro de esquemas de las tablas CSV.
+
+ARCHIVO_ESQUEMA, en la carpeta de los datos, describe para cada CSV sus
+columnas y tipos, la columna clave y las claves foráneas. Se infiere una sola
+vez a partir de una muestra de filas (y se puede editar a mano); después las
+cargas pasan esos tipos a read_csv en lugar de dejar que pandas los adivine, y
+la columna clave se obtiene del registro sin recorrer los datos.
+
+Tipos admitidos: "int64", "float64", "bool", "fecha" y "texto".
+"""
+import os
+
+import pandas as pd
+
+import almacen
+
+ARCHIVO_ESQUEMA = "esquema.json"
+
+# Filas que se leen para inferir el esquema de una tabla
+FILAS_MUESTRA = 1000
+
+_TIPOS_PANDAS = {"int64": "int64", "float64": "float64", "bool": "bool", "texto": str}
+
+
+def _ruta_esquema(carpeta):
+    return os.path.join(carpeta, ARCHIVO_ESQUEMA)
+
+
+def cargar_esquema(carpeta):
+    """Registro completo de la carpeta ({"tablas": {...}})"""
+    return almacen.leer_json(_ruta_esquema(carpeta)) or {"tablas": {}}
+
+
+def guardar_esquema(carpeta, esquema):
+    almacen.escribir_json_atomico(_ruta_esquema(carpeta), esquema, indent=2)
+
+
+def _tipo_columna(nombre, serie):
+    if pd.api.types.is_bool_dtype(serie):
+        return "bool"
+    if pd.api.types.is_integer_dtype(serie):
+        return "int64"
+    if pd.api.types.is_float_dtype(serie):
+        return "float64"
+    if "fecha" in nombre.lower():
+        fechas = pd.to_datetime(serie.dropna(), errors="coerce", format="%Y-%m-%d")
+        if len(fechas) > 0 and fechas.notna().all():
+            return "fecha"
+    return "texto"
+
+
+def _inferir_clave(tabla, muestra):
+    #id_<tabla> si existe; si no, la primera columna id* con valores únicos
+    nombre = os.path.splitext(tabla)[0]
+    if f"id_{nombre}" in muestra.columns:
+        return f"id_{nombre}"
+    for col in muestra.columns:
+        if col.lower().startswith("id") and muestra[col].is_unique:
+            return col
+    return None
+
+
+def inferir_tabla(ruta):
+    """Esquema de un CSV a partir de sus primeras FILAS_MUESTRA filas"""
+    muestra = pd.read_csv(ruta, nrows=FILAS_MUESTRA)
+    carpeta, tabla = os.path.split(ruta)
+    columnas = {col: _tipo_columna(col, muestra[col]) for col in muestra.columns}
+    clave = _inferir_clave(tabla, muestra)
+    foraneas = []
+    for col in muestra.columns:
+        referida = col[3:] + ".csv" if col.lower().startswith("id_") else None
+        if col != clave and referida and referida != tabla and os.path.exists(os.path.join(carpeta, referida)):
+            foraneas.append({"columna": col, "tabla": referida, "columna_ref": col})
+    return {"columnas": columnas, "clave": clave, "foraneas": foraneas}
+
+
+def esquema_tabla(ruta, inferir=True):
+    """Esquema registrado de la tabla; si falta o no coincide con el encabezado del CSV,
+    se infiere y se registra (salvo inferir=False, que devuelve None)"""
+    carpeta, tabla = os.path.split(ruta)
+    esquema = cargar_esquema(carpeta)
+    entrada = esquema["tablas"].get(tabla)
+    if entrada is not None and os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            encabezado = list(pd.read_csv(f, nrows=0).columns)
+        if encabezado != list(entrada["columnas"]):
+            entrada = None
+    if entrada is None and inferir and os.path.exists(ruta):
+        entrada = inferir_tabla(ruta)
+        esquema["tablas"][tabla] = entrada
+        guardar_esquema(carpeta, esquema)
+    return entrada
+
+
+def registrar_carpeta(carpeta):
+    """Inferir y registrar el esquema de todos los CSV de la carpeta"""
+    esquema = cargar_esquema(carpeta)
+    for archivo in sorted(os.listdir(carpeta)):
+        if archivo.endswith(".csv"):
+            esquema["tablas"][archivo] = inferir_tabla(os.path.join(carpeta, archivo))
+    guardar_esquema(carpeta, esquema)
+    return esquema
+
+
+def columna_clave(ruta):
+    """Columna clave registrada para la tabla (None si no tiene)"""
+    entrada = esquema_tabla(ruta)
+    return entrada["clave"] if entrada else None
+
+
+def opciones_lectura(entrada):
+    """Argumentos de read_csv (dtype, usecols, parse_dates) para un esquema de tabla"""
+    if not entrada:
+        return {}
+    columnas = entrada["columnas"]
+    opciones = {
+        "usecols": list(columnas),
+        "dtype": {col: _TIPOS_PANDAS[tipo] for col, tipo in columnas.items() if tipo in _TIPOS_PANDAS},
+    }
+    fechas = [col for col, tipo in columnas.items() if tipo == "fecha"]
+    if fechas:
+        opciones["parse_dates"] = fechas
+        opciones["date_format"] = "%Y-%m-%d"
+    return opciones
+
+
+# Proporción máxima de valores distintos para guardar un texto como categoría
+UMBRAL_CATEGORIAS = 0.5
+
+
+def compactar_tipos(df, entrada=None, umbral_categorias=UMBRAL_CATEGORIAS):
+    """Representación compacta de la tabla.
+
+    Los textos con pocos valores distintos pasan a categóricos (cada valor se
+    guarda una sola vez), los enteros se reducen al menor ancho que los
+    contiene y las columnas de tipo "fecha" del esquema pasan a datetime64.
+    Devuelve el DataFrame nuevo; la memoria previa queda en
+    attrs["bytes_sin_compactar"].
+    """
+    bytes_antes = int(df.memory_usage(deep=True).sum())
+    df = df.copy()
+    tipos = entrada["columnas"] if entrada else {}
+    for col in df.columns:
+        serie = df[col]
+        if tipos.get(col) == "fecha" and not pd.api.types.is_datetime64_any_dtype(serie):
+            df[col] = pd.to_datetime(serie, errors="coerce", format="%Y-%m-%d")
+        elif pd.api.types.is_integer_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+            df[col] = pd.to_numeric(serie, downcast="integer")
+        elif (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)) and len(serie) > 0:
+            if serie.nunique(dropna=True) <= umbral_categorias * len(serie):
+                df[col] = serie.astype("category")
+    df.attrs["bytes_sin_compactar"] = bytes_antes
+    return df
@@ -0,0 +1,325 @@
+"""Estadísticas descriptivas de una pasada, sin cargar la tabla completa.
+
+EstadisticasFlujo recorre la tabla por bloques (los de read_csv con
+chunksize) y acumula para cada columna numérica cantidad, media y suma de
+cuadrados de desvíos (Welford/Chan), mínimo, máximo y una muestra uniforme de
+tamaño fijo para los cuantiles aproximados; para cada par de columnas guarda
+además los co-momentos que dan la correlación (con eliminación por pares,
+igual que DataFrame.corr). Dos acumuladores de partes distintas de la tabla se
+combinan en uno, así que las filas anexadas a un CSV solo se suman a lo que
+ya estaba calculado.
+
+El resultado de cada tabla queda en CARPETA_CACHE junto con la huella del CSV
+y de su diario: mientras la tabla no cambie no se vuelve a leer, y si solo
+recibió filas al final se procesan únicamente esas filas.
+
+Uso: python estadisticas.py tabla.csv [--carpeta CARPETA] [--completo]
+"""
+import argparse
+import io
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import almacen
+
+# Filas por bloque al recorrer un CSV
+TAMANO_BLOQUE = 200_000
+
+# Valores por columna que se conservan para estimar los cuantiles
+TAMANO_MUESTRA = 10_000
+
+PERCENTILES = (0.25, 0.5, 0.75)
+
+
+def _dividir(numerador, denominador):
+    #Cociente elemento a elemento; 0 donde el denominador es 0
+    return np.divide(numerador, denominador, out=np.zeros_like(numerador, dtype="float64"),
+                     where=denominador > 0)
+
+
+def _combinar_muestras(a, na, b, nb, tamano, rng):
+    #Muestra uniforme de la unión a partir de las muestras de cada parte
+    if na + nb <= tamano:
+        return np.concatenate([a, b])
+    # Cuántos de los tamano elegidos caen en cada parte: hipergeométrica
+    ka = int(np.clip(rng.hypergeometric(na, nb, tamano), tamano - len(b), len(a)))
+    return np.concatenate([rng.choice(a, ka, replace=False), rng.choice(b, tamano - ka, replace=False)])
+
+
+class EstadisticasFlujo:
+    """Acumulador combinable de estadísticas por columna y por par de columnas.
+
+    Las matrices son de k x k (k columnas numéricas): n[i, j] filas con i y j
+    presentes, medias[i, j] media de i en esas filas, m2[i, j] suma de
+    cuadrados de desvíos de i en esas filas y comomentos[i, j] suma de
+    productos de desvíos. La diagonal da las estadísticas de cada columna.
+    """
+
+    def __init__(self, tamano_muestra=TAMANO_MUESTRA, semilla=0):
+        self.tamano_muestra = tamano_muestra
+        self.rng = np.random.default_rng(semilla)
+        self.columnas = None  # todas las columnas, en orden
+        self.numericas = []
+        self.filas = 0
+        self.nulos = {}
+
+    def _iniciar(self, columnas, numericas):
+        self.columnas = list(columnas)
+        self.numericas = list(numericas)
+        self.nulos = {col: 0 for col in self.columnas}
+        k = len(self.numericas)
+        self.n = np.zeros((k, k))
+        self.medias = np.zeros((k, k))
+        self.m2 = np.zeros((k, k))
+        self.comomentos = np.zeros((k, k))
+        self.minimos = np.full(k, np.nan)
+        self.maximos = np.full(k, np.nan)
+        self.muestras = [np.empty(0) for _ in range(k)]
+
+    def actualizar(self, bloque):
+        """Sumar las filas de un DataFrame (un bloque de la tabla)"""
+        if self.columnas is None:
+            self._iniciar(bloque.columns, [col for col in bloque.columns
+                                           if pd.api.types.is_numeric_dtype(bloque[col])
+                                           and not pd.api.types.is_bool_dtype(bloque[col])])
+        elif list(bloque.columns) != self.columnas:
+            raise ValueError("El bloque no tiene las mismas columnas que los anteriores")
+        self.filas += len(bloque)
+        for col, cantidad in bloque.isna().sum().items():
+            self.nulos[col] += int(cantidad)
+        if not self.numericas or len(bloque) == 0:
+            return self
+        valores = np.column_stack([pd.to_numeric(bloque[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+                                   for col in self.numericas])
+        presentes = ~np.isnan(valores)
+        p = presentes.astype("float64")
+        # Se centra en la media de cada columna para no perder precisión al restar
+        centro = _dividir(np.where(presentes, valores, 0).sum(axis=0), p.sum(axis=0))
+        x = np.where(presentes, valores - centro, 0.0)
+        n = p.T @ p
+        medias = _dividir(x.T @ p, n)
+        parcial = {
+            "n": n,
+            "medias": medias + centro[:, None],
+            "m2": (x * x).T @ p - n * medias ** 2,
+            "comomentos": x.T @ x - n * medias * medias.T,
+        }
+        self._combinar_momentos(parcial)
+        if presentes.any():
+            self.minimos = np.fmin(self.minimos, np.fmin.reduce(np.where(presentes, valores, np.nan), axis=0))
+            self.maximos = np.fmax(self.maximos, np.fmax.reduce(np.where(presentes, valores, np.nan), axis=0))
+        for j in range(len(self.numericas)):
+            nuevos = valores[presentes[:, j], j]
+            if len(nuevos) > self.tamano_muestra:
+                nuevos = self.rng.choice(nuevos, self.tamano_muestra, replace=False)
+            previos = int(self.n[j, j] - n[j, j])
+            self.muestras[j] = _combinar_muestras(self.muestras[j], previos, nuevos, int(n[j, j]),
+                                                  self.tamano_muestra, self.rng)
+        return self
+
+    def _combinar_momentos(self, otro):
+        #Fórmulas de Chan et al. para unir los momentos de dos partes
+        na, nb = self.n, otro["n"]
+        n = na + nb
+        delta = otro["medias"] - self.medias
+        peso = _dividir(na * nb, n)
+        self.medias = self.medias + delta * _dividir(nb, n)
+        self.m2 = self.m2 + otro["m2"] + delta ** 2 * peso
+        self.comomentos = self.comomentos + otro["comomentos"] + delta * delta.T * peso
+        self.n = n
+
+    def combinar(self, otra):
+        """Incorporar las estadísticas de otra parte de la misma tabla"""
+        if otra.columnas is None:
+            return self
+        if self.columnas is None:
+            self._iniciar(otra.columnas, otra.numericas)
+        elif otra.columnas != self.columnas or otra.numericas != self.numericas:
+            raise ValueError("Las estadísticas no son de la misma tabla")
+        previos = np.diag(self.n).astype(int)
+        self._combinar_momentos({"n": otra.n, "medias": otra.medias, "m2": otra.m2,
+                                 "comomentos": otra.comomentos})
+        self.minimos = np.fmin(self.minimos, otra.minimos)
+        self.maximos = np.fmax(self.maximos, otra.maximos)
+        self.muestras = [_combinar_muestras(a, na, b, nb, self.tamano_muestra, self.rng)
+                         for a, na, b, nb in zip(self.muestras, previos, otra.muestras,
+                                                 np.diag(otra.n).astype(int))]
+        self.filas += otra.filas
+        for col, cantidad in otra.nulos.items():
+            self.nulos[col] += cantidad
+        return self
+
+    def estado(self):
+        """Diccionario con el estado del acumulador (para guardarlo en disco)"""
+        return dict(vars(self), rng=self.rng.bit_generator.state)
+
+    @classmethod
+    def desde_estado(cls, estado):
+        """Acumulador reconstruido desde estado()"""
+        resultado = cls(estado["tamano_muestra"])
+        vars(resultado).update(estado)
+        resultado.rng = np.random.default_rng()
+        resultado.rng.bit_generator.state = estado["rng"]
+        return resultado
+
+    def describir(self, percentiles=PERCENTILES):
+        """Equivalente a DataFrame.describe() de las columnas numéricas.
+
+        Los percentiles son exactos mientras cada columna tenga hasta
+        tamano_muestra valores y aproximados a partir de ahí.
+        """
+        if not self.numericas:
+            return pd.DataFrame()
+        cantidad = np.diag(self.n)
+        varianza = np.divide(np.diag(self.m2), cantidad - 1, out=np.full(len(cantidad), np.nan),
+                             where=cantidad > 1)
+        filas = {"count": cantidad, "mean": np.where(cantidad > 0, np.diag(self.medias), np.nan),
+                 "std": np.sqrt(varianza), "min": self.minimos}
+        for p in percentiles:
+            filas[f"{p * 100:g}%"] = [np.quantile(m, p) if len(m) else np.nan for m in self.muestras]
+        filas["max"] = self.maximos
+        return pd.DataFrame(filas, index=self.numericas).T
+
+    def valores_nulos(self):
+        """Cantidad de valores faltantes por columna"""
+        return pd.Series(self.nulos, dtype="int64")
+
+    def correlacion(self):
+        """Matriz de correlación de Pearson (eliminación por pares, como DataFrame.corr)"""
+        escala = np.sqrt(self.m2 * self.m2.T)
+        valida = (self.n > 1) & (escala > 0)
+        matriz = np.divide(self.comomentos, escala, out=np.full(self.n.shape, np.nan), where=valida)
+        return pd.DataFrame(np.clip(matriz, -1, 1), index=self.numericas, columns=self.numericas)
+
+
+def de_bloques(bloques, tamano_muestra=TAMANO_MUESTRA):
+    """Estadísticas de una secuencia de DataFrames con las mismas columnas"""
+    resultado = EstadisticasFlujo(tamano_muestra)
+    for bloque in bloques:
+        resultado.actualizar(bloque)
+    return resultado
+
+
+def de_dataframe(df, tamano_bloque=TAMANO_BLOQUE):
+    """Estadísticas de un DataFrame ya cargado, recorrido por bloques"""
+    return de_bloques(df.iloc[inicio:inicio + tamano_bloque]
+                      for inicio in range(0, max(len(df), 1), tamano_bloque))
+
+
+class _Tramo(io.RawIOBase):
+    #El archivo f desde su posición actual hasta el byte hasta, como un archivo aparte
+    def __init__(self, f, hasta):
+        self.f = f
+        self.restante = hasta - f.tell()
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        leidos = self.f.readinto(memoryview(destino)[:max(self.restante, 0)])
+        self.restante -= leidos
+        return leidos
+
+
+def leer_bloques(ruta, tamano_bloque=TAMANO_BLOQUE, desde=0, opciones=None, hasta=None):
+    """Bloques de la tabla en ruta (CSV más diario) desde el byte desde hasta
+    el byte hasta (por defecto el final).
+
+    opciones son argumentos de read_csv (por defecto los tipos del esquema, sin
+    interpretar fechas). Las entradas del diario se reproducen sobre cada
+    bloque: cada una afecta solo al bloque que contiene su clave. Las filas
+    que el diario inserta llegan en un último bloque, solo al leer desde el
+    comienzo (una lectura desde un byte posterior trae filas anexadas al CSV,
+    y el diario no cambió desde la anterior). Una tabla de la base SQLite se
+    recorre entera con sus propios tipos.
+    """
+    base = almacen.base_sqlite(ruta)
+    if base is not None:
+        yield from base.leer_bloques(ruta, tamano_bloque)
+        return
+    if opciones is None:
+        opciones = {k: v for k, v in almacen.opciones_lectura(ruta).items()
+                    if k not in ("parse_dates", "date_format")}
+    if desde:
+        if os.path.getsize(ruta) <= desde:
+            return
+        opciones = dict(opciones, header=None, names=list(pd.read_csv(ruta, nrows=0).columns))
+    entradas = almacen.leer_diario(ruta)
+    with open(ruta, "rb") as f:
+        f.seek(desde)
+        for bloque in pd.read_csv(f if hasta is None else _Tramo(f, hasta), chunksize=tamano_bloque, **opciones):
+            yield almacen.aplicar_diario(bloque, entradas, inserciones=False)
+    if not desde and any(entrada["op"] == "insertar" for entrada in entradas):
+        # Se reproduce todo el diario sobre una tabla vacía: solo quedan sus filas insertadas
+        vacia = pd.read_csv(ruta, nrows=0, **opciones)
+        insertadas = almacen.aplicar_diario(vacia, entradas)
+        if len(insertadas):
+            yield insertadas
+
+
+def actualizar_estadisticas(ruta, forzar=False):
+    """Estadísticas al día con la tabla en ruta.
+
+    Devuelve (estadisticas, modo) con modo "vigente", "incremental" (solo se
+    leyeron las filas anexadas) o "completo".
+    """
+    archivo = almacen.ruta_cache(ruta, ".estadisticas.pkl")
+    guardado = None
+    if not forzar and os.path.exists(archivo):
+        try:
+            with open(archivo, "rb") as f:
+                guardado = pickle.load(f)
+            guardado["estadisticas"] = EstadisticasFlujo.desde_estado(guardado["estadisticas"])
+        except Exception:
+            guardado = None
+    version = almacen.version_tabla(ruta)
+    if guardado is not None and guardado["version"] == version:
+        return guardado["estadisticas"], "vigente"
+
+    # Versión y huella se toman antes de leer y la lectura se detiene en la huella: las
+    # filas que se anexen mientras tanto quedan para la próxima pasada incremental
+    huella = almacen.huella_contenido(ruta)
+    hasta = huella.get("tamano")  # None en una tabla de la base SQLite
+    try:
+        if guardado is not None and almacen.solo_anexado(ruta, guardado["huella"]):
+            resultado = guardado["estadisticas"]
+            for bloque in leer_bloques(ruta, desde=guardado["huella"]["tamano"], hasta=hasta):
+                resultado.actualizar(bloque)
+            modo = "incremental"
+        else:
+            resultado, modo = de_bloques(leer_bloques(ruta, hasta=hasta)), "completo"
+    except (ValueError, TypeError):
+        # Datos que no respetan los tipos del esquema: se deja inferir a pandas
+        resultado, modo = de_bloques(leer_bloques(ruta, opciones={}, hasta=hasta)), "completo"
+
+    os.makedirs(os.path.dirname(archivo), exist_ok=True)
+    temporal = almacen.ruta_temporal(archivo)
+    with open(temporal, "wb") as f:
+        pickle.dump({"version": version, "huella": huella, "estadisticas": resultado.estado()}, f)
+    os.replace(temporal, archivo)
+    return resultado, modo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estadísticas de una tabla recorriéndola por bloques")
+    parser.add_argument("tabla", help="Nombre del CSV (p. ej. factura_det.csv)")
+    parser.add_argument("--carpeta", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--completo", action="store_true", help="Recalcular desde cero")
+    args = parser.parse_args()
+    resultado, modo = actualizar_estadisticas(os.path.join(args.carpeta, args.tabla), forzar=args.completo)
+    print(f" {args.tabla} ({modo}): {resultado.filas} filas")
+    print(resultado.describir().to_string())
+    nulos = resultado.valores_nulos()
+    if nulos.sum():
+        print("\n Valores nulos:")
+        print(nulos[nulos > 0].to_string())
+    if len(resultado.numericas) >= 2:
+        print("\n Correlación:")
+        print(resultado.correlacion().round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Exportación de tablas a archivos descargables, generados por bloques.
+
+Cada exportación se escribe en disco de a TAMANO_BLOQUE filas (sin armar
+nunca el archivo completo como un solo texto en memoria), opcionalmente
+comprimida con gzip, dentro de CARPETA_EXPORTACIONES. El nombre del archivo
+lleva la versión de la tabla y los parámetros (formato, columnas,
+compresión): pedir dos veces la misma exportación devuelve el archivo ya
+generado, y al exportar una versión nueva se borran las de versiones
+anteriores de esa tabla.
+
+Si pyarrow está disponible se ofrecen también Parquet y Arrow IPC (cada
+bloque es un grupo de filas o un lote, comprimido con COMPRESION_COLUMNAR),
+que leer_exportacion vuelve a cargar leyendo solo las columnas pedidas.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+import almacen
+import rendimiento
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Subcarpeta de CARPETA_CACHE donde quedan los archivos exportados
+CARPETA_EXPORTACIONES = "exportaciones"
+
+# Filas que se serializan por vez
+TAMANO_BLOQUE = 50_000
+
+# formato -> (extensión, tipo MIME)
+FORMATOS = {
+    "csv": (".csv", "text/csv"),
+    "json_records": (".json", "application/json"),
+    "json_split": (".json", "application/json"),
+    "json_values": (".json", "application/json"),
+    "excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Formatos de texto, los únicos que tiene sentido comprimir
+COMPRIMIBLES = {"csv", "json_records", "json_split", "json_values"}
+
+# Formatos columnares (requieren pyarrow); se comprimen siempre, por columna
+COLUMNARES = {}
+if pa is not None:
+    COLUMNARES = {
+        "parquet": (".parquet", "application/vnd.apache.parquet"),
+        "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+    }
+    FORMATOS.update(COLUMNARES)
+
+COMPRESION_COLUMNAR = "zstd"
+
+# Extensiones que leer_exportacion sabe cargar
+EXTENSIONES_COLUMNARES = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+def _bloques(df, tamano_bloque):
+    for inicio in range(0, len(df), tamano_bloque):
+        yield df.iloc[inicio:inicio + tamano_bloque]
+
+
+def _sin_corchetes(texto):
+    #Contenido de una lista JSON sin los corchetes que la rodean
+    return texto.strip()[1:-1].strip()
+
+
+def _escribir_csv(df, f, tamano_bloque):
+    df.iloc[:0].to_csv(f, index=False)
+    for bloque in _bloques(df, tamano_bloque):
+        bloque.to_csv(f, index=False, header=False)
+
+
+def _escribir_lista_json(f, partes):
+    #Escribir una lista JSON a partir de los textos de sus elementos por bloque
+    f.write("[")
+    primero = True
+    for parte in partes:
+        if parte:
+            f.write(("" if primero else ",") + "\n" + parte)
+            primero = False
+    f.write("\n]")
+
+
+def _escribir_json(df, f, orient, tamano_bloque):
+    if orient == "split":
+        f.write('{"columns":' + json.dumps([str(col) for col in df.columns], ensure_ascii=False) + ',"index":')
+        _escribir_lista_json(f, (",".join(map(json.dumps, bloque.index.tolist()))
+                                 for bloque in _bloques(df, tamano_bloque)))
+        f.write(',"data":')
+        _escribir_lista_json(f, (_sin_corchetes(bloque.to_json(orient="values", force_ascii=False))
+                                 for bloque in _bloques(df, tamano_bloque)))
+        f.write("}")
+    else:
+        _escribir_lista_json(f, (_sin_corchetes(bloque.to_json(orient=orient, indent=2, force_ascii=False))
+                                 for bloque in _bloques(df, tamano_bloque)))
+
+
+def _escribir_excel(df, archivo, tamano_bloque, hojas_extra):
+    with pd.ExcelWriter(archivo, engine="xlsxwriter") as writer:
+        df.iloc[:0].to_excel(writer, sheet_name="Datos", index=False)
+        for numero, bloque in enumerate(_bloques(df, tamano_bloque)):
+            bloque.to_excel(writer, sheet_name="Datos", index=False, header=False,
+                            startrow=1 + numero * tamano_bloque)
+        for nombre, hoja in (hojas_extra or {}).items():
+            hoja.to_excel(writer, sheet_name=nombre)
+
+
+def _escribir_columnar(df, archivo, formato, tamano_bloque):
+    # Esquema de la tabla completa: un bloque con todos nulos no debe fijar el tipo
+    esquema = pa.Schema.from_pandas(df, preserve_index=False)
+    if formato == "parquet":
+        escritor = pq.ParquetWriter(archivo, esquema, compression=COMPRESION_COLUMNAR)
+    else:
+        opciones = pa.ipc.IpcWriteOptions(compression=COMPRESION_COLUMNAR)
+        escritor = pa.ipc.new_file(archivo, esquema, options=opciones)
+    with escritor:
+        for bloque in _bloques(df, tamano_bloque):
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+
+
+def es_columnar(origen):
+    """True si origen (ruta u objeto archivo con name) es un Parquet o Arrow IPC"""
+    extension = os.path.splitext(getattr(origen, "name", origen))[1].lower()
+    return extension in EXTENSIONES_COLUMNARES
+
+
+def leer_exportacion(origen, columnas=None):
+    """Cargar un archivo Parquet o Arrow IPC (ruta u objeto archivo con name),
+    leyendo solo columnas si se indican"""
+    if pa is None:
+        raise ImportError("Leer Parquet o Arrow requiere pyarrow")
+    extension = os.path.splitext(getattr(origen, "name", origen))[1].lower()
+    if EXTENSIONES_COLUMNARES.get(extension) == "parquet":
+        return pd.read_parquet(origen, columns=columnas)
+    if extension not in EXTENSIONES_COLUMNARES:
+        raise ValueError(f"No es un archivo Parquet ni Arrow: {getattr(origen, 'name', origen)}")
+    fuente = pa.memory_map(origen) if isinstance(origen, str) else origen
+    tabla = pa.ipc.open_file(fuente).read_all()
+    if columnas is not None:
+        tabla = tabla.select(list(columnas))
+    return tabla.to_pandas()
+
+
+def _carpeta(ruta):
+    return os.path.join(os.path.dirname(ruta), almacen.CARPETA_CACHE, CARPETA_EXPORTACIONES)
+
+
+def _huella(valor):
+    return hashlib.sha1(json.dumps(valor, default=str).encode()).hexdigest()[:12]
+
+
+def nombre_descarga(ruta, formato, sufijo="export", comprimir=False):
+    """Nombre sugerido para el archivo descargado (p. ej. venta_export.csv.gz)"""
+    extension = FORMATOS[formato][0]
+    nombre = f"{os.path.splitext(os.path.basename(ruta))[0]}_{sufijo}{extension}"
+    return nombre + ".gz" if comprimir and formato in COMPRIMIBLES else nombre
+
+
+def tipo_mime(formato, comprimir=False):
+    return "application/gzip" if comprimir and formato in COMPRIMIBLES else FORMATOS[formato][1]
+
+
+def exportar(ruta, df, formato, columnas=None, comprimir=False, hojas_extra=None,
+             tamano_bloque=TAMANO_BLOQUE):
+    """Ruta del archivo con la exportación de df (la tabla en ruta) en formato.
+
+    columnas limita la exportación a esas columnas; comprimir aplica gzip a
+    los formatos de COMPRIMIBLES; hojas_extra ({nombre: DataFrame}) agrega
+    hojas a un Excel. Si la misma exportación ya existe para la versión actual
+    de la tabla no se vuelve a generar.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    comprimir = comprimir and formato in COMPRIMIBLES
+    columnas = list(columnas) if columnas is not None else list(df.columns)
+    tabla = os.path.basename(ruta)
+    version = _huella(almacen.version_tabla(ruta))
+    parametros = _huella([formato, columnas, comprimir, sorted(hojas_extra or {})])
+    carpeta = _carpeta(ruta)
+    archivo = os.path.join(carpeta, f"{tabla}.{version}.{parametros}{FORMATOS[formato][0]}"
+                                    + (".gz" if comprimir else ""))
+    if os.path.exists(archivo):
+        return archivo
+
+    os.makedirs(carpeta, exist_ok=True)
+    # Las exportaciones de versiones anteriores de la tabla ya no sirven
+    for viejo in os.listdir(carpeta):
+        if viejo.startswith(tabla + ".") and not viejo.startswith(f"{tabla}.{version}."):
+            try:
+                os.remove(os.path.join(carpeta, viejo))
+            except OSError:
+                pass
+
+    datos = df[columnas]
+    # Temporal con la misma extensión (ExcelWriter la exige), reemplazo atómico al final; lleva
+    # el hilo además del proceso porque las sesiones del tablero son hilos de un mismo proceso
+    temporal = os.path.join(carpeta, f"tmp{os.getpid()}.{threading.get_ident()}.{os.path.basename(archivo)}")
+    with rendimiento.medir("exportar", filas=len(datos), tabla=tabla, formato=formato, comprimir=comprimir):
+        if formato == "excel":
+            _escribir_excel(datos, temporal, tamano_bloque, hojas_extra)
+        elif formato in COLUMNARES:
+            _escribir_columnar(datos, temporal, formato, tamano_bloque)
+        else:
+            abrir = gzip.open if comprimir else open
+            with abrir(temporal, "wt", encoding="utf-8", newline="") as f:
+                if formato == "csv":
+                    _escribir_csv(datos, f, tamano_bloque)
+                else:
+                    _escribir_json(datos, f, formato.split("_")[1], tamano_bloque)
+    os.replace(temporal, archivo)
+    return archivo
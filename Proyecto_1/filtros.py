@@ -0,0 +1,325 @@
+"""Filtros de varias condiciones compilados a máscaras vectorizadas.
+
+Una expresión es una condición o una combinación de condiciones:
+    {"columna": "precio", "op": "entre", "valor": [1000, 5000]}
+    {"y": [expresión, ...]}   (se cumplen todas)
+    {"o": [expresión, ...]}   (se cumple alguna)
+Operadores: "igual", "entre" ([desde, hasta]; None deja abierto el extremo),
+"en" (lista de valores, típicamente IDs), "contiene" y "empieza" (texto, sin
+distinguir mayúsculas). compilar() valida la expresión contra las columnas de
+la tabla y convierte cada valor al tipo de su columna una sola vez. El Filtro
+resultante se evalúa sobre ColumnasNormalizadas: las columnas ya convertidas a
+arreglos (números, fechas o texto en minúsculas), que se reutilizan mientras
+la tabla no cambie, junto con las posiciones de los últimos filtros evaluados.
+pagina() devuelve una página de resultados solo con las columnas pedidas.
+
+Uso: python filtros.py tabla.csv "precio entre 1000 5000" "id_rubro en 1,2" [--o]
+                       [--columnas c1,c2] [--pagina N] [--carpeta CARPETA]
+"""
+import argparse
+import functools
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import almacen
+
+# Operadores de condición con su descripción para los menús
+OPERADORES = {
+    "igual": "igual a",
+    "entre": "entre (desde y hasta)",
+    "en": "en la lista",
+    "contiene": "contiene",
+    "empieza": "empieza con",
+}
+# Operadores que se ofrecen según el tipo de la columna
+OPERADORES_POR_TIPO = {
+    "numero": ["entre", "igual", "en"],
+    "fecha": ["entre", "igual", "en"],
+    "texto": ["contiene", "empieza", "igual", "en"],
+}
+# Filas por página de resultados
+TAMANO_PAGINA = 50
+# Posiciones de filtros ya evaluados que se recuerdan por versión de la tabla
+FILTROS_EN_CACHE = 16
+# Las subcadenas de al menos este largo se buscan con el índice de trigramas (si hay)
+LARGO_MINIMO_TRIGRAMAS = 3
+
+
+def tipo_columna(serie):
+    """"numero", "fecha" o "texto" según el tipo de datos de la columna"""
+    if pd.api.types.is_bool_dtype(serie):
+        return "texto"
+    if pd.api.types.is_numeric_dtype(serie):
+        return "numero"
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return "fecha"
+    return "texto"
+
+
+def _booleanos(resultado):
+    #Máscara numpy de una comparación sobre un arreglo o una serie (los nulos no cumplen)
+    if isinstance(resultado, pd.Series):
+        return resultado.to_numpy(dtype=bool, na_value=False)
+    return np.asarray(resultado, dtype=bool)
+
+
+class ColumnasNormalizadas:
+    """Columnas de una versión de la tabla convertidas para filtrar.
+
+    Cada columna se convierte la primera vez que un filtro la usa: números a
+    float64, fechas a datetime64 y cualquier columna a texto en minúsculas
+    (para contiene/empieza). No se mantiene con las operaciones: la caché de
+    tablas la descarta cuando la tabla cambia. indice_texto(columna), si se
+    da, devuelve el IndiceTrigramas de la columna para resolver "contiene" sin
+    recorrer todos los textos.
+    """
+
+    def __init__(self, df, indice_texto=None):
+        self.df = df
+        self.filas = len(df)
+        self._indice_texto = indice_texto
+        self._arreglos = {}
+        self._resultados = OrderedDict()  # clave del filtro -> posiciones
+        self._bloqueo = threading.Lock()
+
+    def _arreglo(self, tipo, columna, convertir):
+        clave = (tipo, columna)
+        arreglo = self._arreglos.get(clave)
+        if arreglo is None:
+            arreglo = self._arreglos[clave] = convertir(self.df[columna])
+        return arreglo
+
+    def numeros(self, columna):
+        """Columna como float64 (NaN donde no hay un número)"""
+        return self._arreglo("numero", columna, lambda serie: pd.to_numeric(serie, errors="coerce")
+                             .to_numpy(dtype="float64", na_value=np.nan))
+
+    def fechas(self, columna):
+        """Columna como datetime64 (NaT donde no hay una fecha)"""
+        return self._arreglo("fecha", columna, lambda serie: pd.to_datetime(serie, errors="coerce").to_numpy())
+
+    def textos(self, columna):
+        """Columna como serie de texto en minúsculas"""
+        return self._arreglo("texto", columna, lambda serie: serie.astype("str").str.lower())
+
+    def contiene(self, columna, texto):
+        """Máscara de las filas cuyo texto en minúsculas contiene texto"""
+        if self._indice_texto is not None and len(texto) >= LARGO_MINIMO_TRIGRAMAS:
+            mascara = np.zeros(self.filas, dtype=bool)
+            mascara[self._indice_texto(columna).buscar(texto)] = True
+            return mascara
+        return _booleanos(self.textos(columna).str.contains(texto, regex=False, na=False))
+
+    def posiciones(self, filtro):
+        """Posiciones de las filas que cumplen filtro, en el orden de la tabla"""
+        with self._bloqueo:
+            posiciones = self._resultados.get(filtro.clave)
+            if posiciones is not None:
+                self._resultados.move_to_end(filtro.clave)
+                return posiciones
+        posiciones = np.flatnonzero(filtro.mascara(self))
+        with self._bloqueo:
+            self._resultados[filtro.clave] = posiciones
+            while len(self._resultados) > FILTROS_EN_CACHE:
+                self._resultados.popitem(last=False)
+        return posiciones
+
+
+class Filtro:
+    """Expresión compilada: mascara(columnas) la evalúa sobre ColumnasNormalizadas"""
+
+    def __init__(self, evaluar, clave, columnas):
+        self._evaluar = evaluar
+        self.clave = clave  # identifica la expresión en la caché de resultados
+        self.columnas = columnas  # columnas que usa la expresión
+
+    def mascara(self, columnas):
+        return self._evaluar(columnas)
+
+
+def compilar(expresion, df):
+    """Validar expresion contra las columnas de df y compilarla a un Filtro.
+
+    Lanza ValueError si una columna u operador no existe o si un valor no se
+    puede convertir al tipo de su columna.
+    """
+    usadas = set()
+    evaluar = _compilar(expresion, df, usadas)
+    return Filtro(evaluar, json.dumps(expresion, sort_keys=True, default=str), sorted(usadas))
+
+
+def _compilar(expresion, df, usadas):
+    for conector, combinar in (("y", np.logical_and), ("o", np.logical_or)):
+        if conector in expresion:
+            partes = [_compilar(parte, df, usadas) for parte in expresion[conector]]
+            if not partes:
+                raise ValueError(f"La combinación '{conector}' no tiene condiciones")
+            if len(partes) == 1:
+                return partes[0]
+            return lambda columnas: functools.reduce(combinar, (parte(columnas) for parte in partes))
+
+    columna, operador, valor = expresion.get("columna"), expresion.get("op"), expresion.get("valor")
+    if columna not in df.columns:
+        raise ValueError(f"La columna '{columna}' no existe")
+    if operador not in OPERADORES:
+        raise ValueError(f"Operador '{operador}' no válido (use {', '.join(OPERADORES)})")
+    usadas.add(columna)
+
+    if operador in ("contiene", "empieza"):
+        texto = str(valor).lower()
+        if operador == "contiene":
+            return lambda columnas: columnas.contiene(columna, texto)
+        return lambda columnas: _booleanos(columnas.textos(columna).str.startswith(texto, na=False))
+
+    tipo = tipo_columna(df[columna])
+    arreglo = {"numero": ColumnasNormalizadas.numeros,
+               "fecha": ColumnasNormalizadas.fechas,
+               "texto": ColumnasNormalizadas.textos}[tipo]
+
+    if operador == "en":
+        valores = [_convertir(v, tipo, columna) for v in _lista(valor)]
+        if tipo == "fecha":
+            # Una fecha de la lista abarca todo ese día
+            dias = np.array(valores, dtype="datetime64[D]")
+            return lambda columnas: np.isin(arreglo(columnas, columna).astype("datetime64[D]"), dias)
+        if tipo == "numero":
+            valores = np.array(valores, dtype="float64")
+            return lambda columnas: np.isin(arreglo(columnas, columna), valores)
+        return lambda columnas: _booleanos(arreglo(columnas, columna).isin(valores))
+
+    if operador == "igual" and tipo != "fecha":
+        valor = _convertir(valor, tipo, columna)
+        return lambda columnas: _booleanos(arreglo(columnas, columna) == valor)
+
+    # "entre", o "igual" en una fecha: el rango de ese día
+    desde, hasta = (valor, valor) if operador == "igual" else _extremos(valor)
+    desde = None if desde is None else _convertir(desde, tipo, columna)
+    hasta = None if hasta is None else _convertir(hasta, tipo, columna)
+    if desde is None and hasta is None:
+        raise ValueError("'entre' necesita al menos uno de los dos extremos")
+    hasta_excluido = False
+    if tipo == "fecha" and hasta is not None and hasta == hasta.astype("datetime64[D]"):
+        # Una fecha sin hora como extremo superior incluye todo ese día
+        hasta, hasta_excluido = hasta + np.timedelta64(1, "D"), True
+
+    def evaluar(columnas):
+        valores = arreglo(columnas, columna)
+        mascara = np.ones(columnas.filas, dtype=bool)
+        if desde is not None:
+            mascara &= _booleanos(valores >= desde)
+        if hasta is not None:
+            mascara &= _booleanos(valores < hasta if hasta_excluido else valores <= hasta)
+        return mascara
+    return evaluar
+
+
+def _convertir(valor, tipo, columna):
+    #Valor de una condición convertido al tipo normalizado de la columna
+    try:
+        if tipo == "numero":
+            return float(valor)
+        if tipo == "fecha":
+            fecha = pd.Timestamp(valor)
+            if pd.isna(fecha):
+                raise ValueError(valor)
+            return fecha.to_datetime64()
+    except (TypeError, ValueError):
+        descripcion = "un número" if tipo == "numero" else "una fecha (AAAA-MM-DD)"
+        raise ValueError(f"'{valor}' no es {descripcion} válido para '{columna}'") from None
+    return str(valor).lower()
+
+
+def _lista(valor):
+    #Valores de "en": una lista o un texto separado por comas
+    if isinstance(valor, str):
+        valor = valor.split(",")
+    valores = [v.strip() if isinstance(v, str) else v for v in valor]
+    valores = [v for v in valores if v not in ("", None)]
+    if not valores:
+        raise ValueError("'en' necesita al menos un valor")
+    return valores
+
+
+def _extremos(valor):
+    #Extremos de "entre": [desde, hasta] o un texto "desde hasta"; "*" o "" dejan abierto
+    if isinstance(valor, str):
+        valor = valor.split()
+    if not isinstance(valor, (list, tuple)) or len(valor) != 2:
+        raise ValueError("'entre' lleva dos valores: desde y hasta")
+    return [None if v is None or str(v).strip() in ("", "*") else v for v in valor]
+
+
+def condicion_desde_texto(texto):
+    """Condición a partir de "columna operador valor".
+
+    Por ejemplo "precio entre 1000 5000" ('*' deja abierto un extremo),
+    "id_rubro en 1,2,3" o "descripcion contiene led".
+    """
+    partes = texto.split(None, 2)
+    if len(partes) < 3:
+        raise ValueError("Escriba columna, operador y valor (por ejemplo 'precio entre 1000 5000')")
+    columna, operador, valor = partes
+    operador = operador.lower()
+    if operador == "entre":
+        valor = _extremos(valor)
+    elif operador == "en":
+        valor = _lista(valor)
+    return {"columna": columna, "op": operador, "valor": valor}
+
+
+def validar_columnas(df, columnas):
+    """Lanzar ValueError si alguna de las columnas a mostrar no existe en df"""
+    faltantes = [col for col in columnas or [] if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"Columnas inexistentes: {', '.join(faltantes)}")
+
+
+def cantidad_paginas(total, tamano=TAMANO_PAGINA):
+    """Páginas necesarias para total filas (al menos una)"""
+    return max(1, -(-total // tamano))
+
+
+def pagina(df, posiciones, numero=1, tamano=TAMANO_PAGINA, columnas=None):
+    """Filas de la página numero (desde 1) de posiciones, solo con columnas (todas si es None)"""
+    inicio = (numero - 1) * tamano
+    filas = posiciones[inicio:inicio + tamano]
+    if not columnas:
+        return df.iloc[filas]
+    return df.iloc[filas, df.columns.get_indexer(columnas)]
+
+
+def filtrar(df, expresion, columnas_normalizadas=None):
+    """Posiciones de las filas de df que cumplen expresion"""
+    filtro = compilar(expresion, df)
+    return (columnas_normalizadas or ColumnasNormalizadas(df)).posiciones(filtro)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filtrar una tabla con varias condiciones")
+    parser.add_argument("tabla", help="Archivo de la tabla, por ejemplo producto.csv")
+    parser.add_argument("condiciones", nargs="+", help="Condiciones 'columna operador valor'")
+    parser.add_argument("--o", action="store_true", help="Basta con que se cumpla una condición")
+    parser.add_argument("--columnas", help="Columnas a mostrar, separadas por coma")
+    parser.add_argument("--pagina", type=int, default=1)
+    parser.add_argument("--carpeta", default=os.path.dirname(os.path.abspath(__file__)))
+    args = parser.parse_args()
+
+    df = almacen.leer_tabla(os.path.join(args.carpeta, args.tabla))
+    columnas = [c.strip() for c in (args.columnas or "").split(",") if c.strip()]
+    try:
+        condiciones = [condicion_desde_texto(texto) for texto in args.condiciones]
+        validar_columnas(df, columnas)
+        posiciones = filtrar(df, {"o" if args.o else "y": condiciones})
+    except ValueError as e:
+        parser.error(str(e))
+    print(f" {len(posiciones)} registros (página {args.pagina} de {cantidad_paginas(len(posiciones))})")
+    print(pagina(df, posiciones, args.pagina, columnas=columnas).to_string())
+
+
+if __name__ == "__main__":
+    main()
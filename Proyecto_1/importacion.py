@@ -0,0 +1,181 @@
+"""Importación masiva de filas a una tabla desde un archivo CSV, JSON, Parquet o Arrow.
+
+Todo el lote se valida de una vez: los valores se convierten a los tipos del
+esquema registrado (ver esquema.py), las filas sin ID reciben IDs consecutivos
+de la secuencia de la tabla (ver secuencias.py), se comprueba que ninguna clave
+se repita dentro del lote ni con la tabla y, opcionalmente, que las claves
+foráneas apunten a filas existentes. Si algo falla no se escribe nada; si no,
+las filas se anexan al CSV con una sola escritura.
+
+Uso: python importacion.py tabla.csv archivo.(csv|json|jsonl|parquet|arrow) [--carpeta CARPETA]
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+
+import almacen
+import esquema
+import exportacion
+import integridad
+import secuencias
+
+# Cantidad máxima de errores que se detallan en el mensaje
+ERRORES_MOSTRADOS = 10
+
+_VERDADEROS = {"true", "1", "si", "sí", "s", "verdadero"}
+_FALSOS = {"false", "0", "no", "n", "falso"}
+
+
+def leer_lote(origen, columnas=None):
+    """Filas a importar desde un DataFrame o un archivo .csv, .json, .jsonl,
+    .parquet o .arrow (ruta u objeto archivo con atributo name).
+
+    columnas ({columna: tipo} del esquema) evita que pandas convierta a número
+    los textos y fechas de un CSV; las columnas numéricas se dejan al lector.
+    """
+    if isinstance(origen, pd.DataFrame):
+        return origen.copy()
+    if exportacion.es_columnar(origen):
+        return exportacion.leer_exportacion(origen)
+    extension = os.path.splitext(getattr(origen, "name", origen))[1].lower()
+    if extension == ".json":
+        return pd.read_json(origen, orient="records", dtype=False)
+    if extension == ".jsonl":
+        return pd.read_json(origen, orient="records", lines=True, dtype=False)
+    textos = {col: str for col, tipo in (columnas or {}).items() if tipo in ("texto", "fecha")}
+    return pd.read_csv(origen, dtype=textos or str, skipinitialspace=True)
+
+
+def _convertir(serie, tipo):
+    #Serie convertida al tipo del esquema y máscara de valores inválidos
+    #(los valores faltantes no son inválidos)
+    if pd.api.types.is_numeric_dtype(serie):
+        presentes = serie.notna()
+    else:
+        presentes = serie.notna() & (serie.astype(str).str.strip() != "")
+    if tipo in ("int64", "float64"):
+        numeros = pd.to_numeric(serie.where(presentes), errors="coerce")
+        invalidos = presentes & numeros.isna()
+        if tipo == "int64":
+            invalidos |= numeros.notna() & (numeros % 1 != 0)
+            return numeros.where(~invalidos).round().astype("Int64"), invalidos
+        return numeros.astype("float64"), invalidos
+    if tipo == "bool":
+        texto = serie.astype(str).str.strip().str.lower()
+        valores = pd.Series(pd.NA, index=serie.index, dtype="boolean")
+        valores[presentes & texto.isin(_VERDADEROS)] = True
+        valores[presentes & texto.isin(_FALSOS)] = False
+        return valores, presentes & valores.isna()
+    if tipo == "fecha":
+        fechas = pd.to_datetime(serie.where(presentes), errors="coerce", format="%Y-%m-%d")
+        return fechas.dt.strftime("%Y-%m-%d"), presentes & fechas.isna()
+    texto = serie.astype(str).str.strip().where(presentes)
+    return texto, pd.Series(False, index=serie.index)
+
+
+def _resumen(errores):
+    detalle = "\n".join(f"  - {error}" for error in errores[:ERRORES_MOSTRADOS])
+    if len(errores) > ERRORES_MOSTRADOS:
+        detalle += f"\n  ... y {len(errores) - ERRORES_MOSTRADOS} más"
+    return detalle
+
+
+def convertir_tipos(lote, columnas):
+    """Convertir el lote a los tipos de columnas ({columna: tipo}).
+
+    Devuelve (lote, errores) con una descripción por valor inválido.
+    """
+    lote = lote.reset_index(drop=True).reindex(columns=list(columnas))
+    convertido = pd.DataFrame(index=lote.index)
+    errores = []
+    for columna, tipo in columnas.items():
+        convertido[columna], invalidos = _convertir(lote[columna], tipo)
+        for fila, valor in lote.loc[invalidos, columna].items():
+            errores.append(f"fila {fila + 1}, '{columna}': '{valor}' no es {tipo}")
+    return convertido, errores
+
+
+def importar(ruta, origen, verificar_foraneas=True):
+    """Importar las filas de origen (archivo o DataFrame) a la tabla en ruta.
+
+    Lanza ValueError, sin escribir nada, si alguna fila no es válida.
+    Devuelve {"insertadas", "ids_asignados", "segundos"}.
+    """
+    inicio = time.perf_counter()
+    entrada = esquema.esquema_tabla(ruta)
+    if entrada is None:
+        raise FileNotFoundError(f"La tabla '{os.path.basename(ruta)}' no existe")
+    lote = leer_lote(origen, entrada["columnas"])
+    desconocidas = [col for col in lote.columns if col not in entrada["columnas"]]
+    if desconocidas:
+        raise ValueError(f"Columnas que no existen en la tabla: {', '.join(map(str, desconocidas))}")
+    lote, errores = convertir_tipos(lote, entrada["columnas"])
+    if errores:
+        raise ValueError(f"{len(errores)} valores inválidos:\n{_resumen(errores)}")
+    if lote.empty:
+        return {"insertadas": 0, "ids_asignados": 0, "segundos": time.perf_counter() - inicio}
+
+    if verificar_foraneas:
+        carpeta = os.path.dirname(ruta)
+        for foranea in entrada["foraneas"]:
+            ruta_ref = os.path.join(carpeta, foranea["tabla"])
+            valores = lote[foranea["columna"]].dropna()
+            if not os.path.exists(ruta_ref) or valores.empty:
+                continue
+            clave_ref = esquema.columna_clave(ruta_ref)
+            referencia = almacen.leer_columnas(ruta_ref, [c for c in (clave_ref, foranea["columna_ref"]) if c])
+            faltan = valores[~integridad.pertenece(valores, referencia[foranea["columna_ref"]])]
+            errores += [f"fila {fila + 1}, '{foranea['columna']}': {valor} no existe en {foranea['tabla']}"
+                        for fila, valor in faltan.items()]
+        if errores:
+            raise ValueError(f"{len(errores)} claves foráneas sin fila referida:\n{_resumen(errores)}")
+
+    clave = entrada["clave"]
+    asignados = 0
+    with almacen.bloqueo(ruta):
+        if clave:
+            existentes = almacen.leer_columnas(ruta, [clave])
+            explicitos = lote[clave].dropna()
+            faltan = lote[clave].isna()
+            asignados = int(faltan.sum())
+            # Primero se registra el mayor ID explícito para que la reserva no lo repita
+            if len(explicitos) and entrada["columnas"][clave] == "int64":
+                secuencias.registrar_uso(ruta, clave, int(explicitos.max()), existentes)
+            if asignados:
+                if entrada["columnas"][clave] != "int64":
+                    raise ValueError(f"Hay filas sin '{clave}' y la clave no es numérica")
+                primero = secuencias.reservar(ruta, clave, asignados, existentes)
+                lote.loc[faltan, clave] = range(primero, primero + asignados)
+            claves = lote[clave]
+            repetidas = claves[claves.duplicated()]
+            en_tabla = claves[integridad.pertenece(claves, existentes[clave])]
+            errores = ([f"'{clave}' {valor} repetido en el lote" for valor in repetidas.unique()] +
+                       [f"'{clave}' {valor} ya existe en la tabla" for valor in en_tabla.unique()])
+            if errores:
+                raise ValueError(f"{len(errores)} claves duplicadas:\n{_resumen(errores)}")
+        almacen.anexar_filas(lote, ruta)
+    return {"insertadas": len(lote), "ids_asignados": asignados, "segundos": time.perf_counter() - inicio}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importar filas a una tabla desde CSV, JSON, Parquet o Arrow")
+    parser.add_argument("tabla", help="Nombre del CSV destino (p. ej. factura_det.csv)")
+    parser.add_argument("archivo", help="Archivo con las filas nuevas (.csv, .json, .jsonl, .parquet o .arrow)")
+    parser.add_argument("--carpeta", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--sin-foraneas", action="store_true", help="No verificar claves foráneas")
+    args = parser.parse_args()
+    try:
+        resultado = importar(os.path.join(args.carpeta, args.tabla), args.archivo,
+                             verificar_foraneas=not args.sin_foraneas)
+    except (ValueError, FileNotFoundError) as e:
+        print(f" Importación cancelada: {e}")
+        return 1
+    print(f" {resultado['insertadas']} filas importadas en '{args.tabla}' "
+          f"({resultado['ids_asignados']} IDs asignados) en {resultado['segundos']:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,285 @@
+"""Índices en memoria sobre las tablas cargadas."""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import almacen
+from almacen import clave_texto
+
+
+class IndiceClave:
+    """Índice hash de la columna clave: valor -> posición de la fila.
+
+    Se construye una vez por versión de la tabla y luego se mantiene con las
+    operaciones de un RegistroCambios. Las eliminaciones desplazan las filas
+    siguientes, así que después de una eliminación las posiciones se recalculan
+    en la próxima búsqueda por clave; la pertenencia sigue siendo O(1).
+    """
+
+    def __init__(self, columna, posiciones, filas, unico):
+        self.columna = columna
+        self.unico = unico
+        self._posiciones = posiciones
+        self._filas = filas
+        self._desfasado = False
+
+    @classmethod
+    def construir(cls, df, columna):
+        posiciones = {}
+        valores = df[columna].tolist()
+        for i, valor in enumerate(valores):
+            posiciones.setdefault(clave_texto(valor), i)
+        return cls(columna, posiciones, len(valores), len(posiciones) == len(valores))
+
+    def __contains__(self, valor):
+        return clave_texto(valor) in self._posiciones
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def _reconstruir(self, df):
+        nuevo = IndiceClave.construir(df, self.columna)
+        self._posiciones, self._filas, self.unico = nuevo._posiciones, nuevo._filas, nuevo.unico
+        self._desfasado = False
+
+    def posicion(self, valor, df):
+        """Posición de la fila con esa clave en df (None si no existe)"""
+        if self._desfasado:
+            self._reconstruir(df)
+        return self._posiciones.get(clave_texto(valor))
+
+    def fila(self, df, valor):
+        """Fila de df con esa clave (None si no existe)"""
+        pos = self.posicion(valor, df)
+        return None if pos is None else df.iloc[pos]
+
+    def aplicar_operaciones(self, operaciones, df):
+        """Actualizar el índice con operaciones de un RegistroCambios ya aplicadas a df"""
+        for op in operaciones:
+            if op["op"] == "insertar":
+                clave = clave_texto(op["fila"].get(self.columna))
+                if clave in self._posiciones:
+                    self.unico = False
+                else:
+                    self._posiciones[clave] = self._filas
+                self._filas += 1
+            elif op.get("columna_clave") != self.columna:
+                # Cambios identificados por otra columna: no se pueden seguir
+                self._reconstruir(df)
+                return
+            elif op["op"] == "eliminar":
+                self._posiciones.pop(clave_texto(op["clave"]), None)
+                self._filas -= 1
+                self._desfasado = True
+            elif self.columna in op["valores"]:
+                pos = self._posiciones.pop(clave_texto(op["clave"]), None)
+                if pos is not None:
+                    self._posiciones[clave_texto(op["valores"][self.columna])] = pos
+
+
+class IndicePrefijos:
+    """Valores de una columna (como texto en minúsculas) ordenados, para
+    encontrar por búsqueda binaria las filas cuyo valor empieza con un prefijo.
+
+    No se mantiene con las operaciones: la caché de tablas lo descarta cuando
+    la tabla cambia y se vuelve a construir en la próxima búsqueda.
+    """
+
+    def __init__(self, columna, textos, orden):
+        self.columna = columna
+        self._textos = textos  # np.ndarray (object) ordenado
+        self._orden = orden  # posición en la tabla de cada texto ordenado
+
+    @classmethod
+    def construir(cls, df, columna):
+        textos = np.array([clave_texto(v).lower() for v in df[columna].tolist()], dtype=object)
+        orden = np.argsort(textos, kind="stable")
+        return cls(columna, textos[orden], orden)
+
+    def buscar(self, prefijo, limite=None):
+        """Posiciones de las filas cuyo valor empieza con prefijo, en orden de valor"""
+        prefijo = clave_texto(prefijo).lower()
+        inicio = int(np.searchsorted(self._textos, prefijo, side="left"))
+        fin = int(np.searchsorted(self._textos, prefijo + "\U0010ffff", side="left"))
+        if limite is not None:
+            fin = min(fin, inicio + limite)
+        return self._orden[inicio:fin]
+
+
+def trigramas(texto):
+    """Códigos enteros de las subcadenas de 3 caracteres de texto"""
+    return {(ord(texto[i]) << 42) | (ord(texto[i + 1]) << 21) | ord(texto[i + 2])
+            for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """Índice invertido de trigramas de una columna de texto.
+
+    Para buscar una subcadena se intersectan las listas de los trigramas de la
+    consulta y solo esos candidatos se verifican contra el texto (ya en
+    minúsculas) con str.contains; las consultas de menos de tres caracteres no
+    tienen trigramas y se verifican directamente sobre todos los textos. Cada fila tiene un número interno fijo: las inserciones
+    agregan números al final, las eliminaciones solo los marcan como muertos y
+    la posición en la tabla se obtiene contando los vivos anteriores. Las
+    modificaciones agregan los trigramas nuevos sin quitar los viejos; los
+    candidatos de más se descartan en la verificación.
+    """
+
+    def __init__(self, columna, columna_clave, textos, listas, claves):
+        self.columna = columna
+        self.columna_clave = columna_clave
+        self.version_origen = None
+        self._textos = textos
+        self._listas = listas  # código de trigrama -> np.ndarray ordenado de números internos
+        self._extra = {}  # código de trigrama -> list de números agregados después de construir
+        self._claves = claves  # clave -> número interno (None si la tabla no tiene clave única)
+        self._vivos = np.ones(len(textos), dtype=bool)
+        self._posiciones = None
+        self._serie = None  # los textos como Series, para verificar con str.contains
+
+    def __getstate__(self):
+        #La Series de textos no se guarda con el índice: se rearma en la primera búsqueda
+        return dict(self.__dict__, _serie=None)
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._serie = None
+
+    @classmethod
+    def construir(cls, df, columna, columna_clave=None):
+        textos = [str(v).lower() for v in df[columna].tolist()]
+        listas = cls._listas_vectorizadas(textos)
+        claves = None
+        if columna_clave is not None and df[columna_clave].is_unique:
+            claves = {clave_texto(v): i for i, v in enumerate(df[columna_clave].tolist())}
+        return cls(columna, columna_clave, textos, listas, claves)
+
+    @staticmethod
+    def _listas_vectorizadas(textos, filas_por_bloque=100_000):
+        #Los textos se pasan a una matriz de códigos Unicode (una fila por texto)
+        #y cada trigrama se codifica como un entero; se agrupan por código
+        partes_codigos, partes_numeros = [], []
+        for inicio in range(0, len(textos), filas_por_bloque):
+            bloque = np.array(textos[inicio:inicio + filas_por_bloque], dtype=str)
+            ancho = bloque.dtype.itemsize // 4
+            if ancho < 3:
+                continue
+            letras = bloque.view(np.uint32).reshape(len(bloque), ancho).astype(np.int64)
+            codigos = (letras[:, :-2] << 42) | (letras[:, 1:-1] << 21) | letras[:, 2:]
+            # Los trigramas que tocan el relleno (código 0) no existen en el texto
+            validos = (letras[:, 2:] != 0).ravel()
+            partes_codigos.append(codigos.ravel()[validos])
+            partes_numeros.append(np.repeat(np.arange(inicio, inicio + len(bloque)), ancho - 2)[validos])
+        if not partes_codigos:
+            return {}
+        codigos = np.concatenate(partes_codigos)
+        numeros = np.concatenate(partes_numeros)
+        # Ordenar por (trigrama, número) y quitar repetidos dentro de una misma fila
+        orden = np.lexsort((numeros, codigos))
+        codigos, numeros = codigos[orden], numeros[orden]
+        distintos = np.ones(len(codigos), dtype=bool)
+        distintos[1:] = (codigos[1:] != codigos[:-1]) | (numeros[1:] != numeros[:-1])
+        codigos, numeros = codigos[distintos], numeros[distintos]
+        cortes = np.flatnonzero(np.diff(codigos)) + 1
+        return dict(zip(codigos[np.r_[0, cortes]].tolist(), np.split(numeros, cortes)))
+
+    def _lista(self, trigrama):
+        lista = self._listas.get(trigrama, np.empty(0, dtype=np.int64))
+        if trigrama in self._extra:
+            lista = np.union1d(lista, self._extra[trigrama])
+        return lista
+
+    def _posicion_de(self):
+        #Número interno -> posición actual en la tabla
+        if self._posiciones is None:
+            self._posiciones = np.cumsum(self._vivos) - 1
+        return self._posiciones
+
+    def _textos_serie(self):
+        if self._serie is None:
+            self._serie = pd.Series(self._textos)
+        return self._serie
+
+    def buscar(self, consulta):
+        """Posiciones (en la tabla actual) de las filas cuyo texto contiene consulta"""
+        consulta = str(consulta).lower()
+        serie = self._textos_serie()
+        if len(consulta) < 3:
+            coincide = serie.str.contains(consulta, regex=False).to_numpy(dtype=bool) & self._vivos
+            return self._posicion_de()[np.flatnonzero(coincide)]
+        listas = sorted((self._lista(t) for t in trigramas(consulta)), key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+        candidatos = candidatos[self._vivos[candidatos]]
+        if len(candidatos) > 0:
+            coincide = serie.iloc[candidatos].str.contains(consulta, regex=False).to_numpy(dtype=bool)
+            candidatos = candidatos[coincide]
+        return self._posicion_de()[candidatos.astype(np.int64)]
+
+    def _agregar_trigramas(self, numero, texto):
+        for trigrama in trigramas(texto):
+            self._extra.setdefault(trigrama, []).append(numero)
+
+    def aplicar_operaciones(self, operaciones, df):
+        """Actualizar el índice con operaciones de un RegistroCambios ya aplicadas a df"""
+        self._posiciones = None
+        self._serie = None
+        for op in operaciones:
+            if op["op"] == "insertar":
+                numero = len(self._textos)
+                texto = str(op["fila"].get(self.columna)).lower()
+                self._textos.append(texto)
+                self._vivos = np.append(self._vivos, True)
+                self._agregar_trigramas(numero, texto)
+                if self._claves is not None:
+                    self._claves[clave_texto(op["fila"].get(self.columna_clave))] = numero
+                continue
+            numero = None
+            if self._claves is not None and op.get("columna_clave") == self.columna_clave:
+                numero = self._claves.get(clave_texto(op["clave"]))
+            if numero is None:
+                # No se puede ubicar la fila: reconstruir desde la tabla
+                nuevo = IndiceTrigramas.construir(df, self.columna, self.columna_clave)
+                self.__dict__.update(nuevo.__dict__)
+                return
+            if op["op"] == "eliminar":
+                self._vivos[numero] = False
+                del self._claves[clave_texto(op["clave"])]
+                continue
+            if self.columna in op["valores"]:
+                texto = str(op["valores"][self.columna]).lower()
+                self._textos[numero] = texto
+                self._agregar_trigramas(numero, texto)
+            if self.columna_clave in op["valores"]:
+                del self._claves[clave_texto(op["clave"])]
+                self._claves[clave_texto(op["valores"][self.columna_clave])] = numero
+
+
+def indice_trigramas(ruta, df, columna, columna_clave=None):
+    """Índice de trigramas de la columna, leído de CARPETA_CACHE si corresponde a la
+    versión actual de la tabla; si no, se construye y se guarda allí"""
+    archivo = almacen.ruta_cache(ruta, f".trigramas.{columna}.pkl")
+    version = almacen.version_tabla(ruta)
+    try:
+        with open(archivo, "rb") as f:
+            indice = pickle.load(f)
+        if indice.version_origen == version and indice.columna_clave == columna_clave:
+            return indice
+    except Exception:
+        pass
+    indice = IndiceTrigramas.construir(df, columna, columna_clave)
+    indice.version_origen = version
+    try:
+        os.makedirs(os.path.dirname(archivo), exist_ok=True)
+        temporal = almacen.ruta_temporal(archivo)
+        with open(temporal, "wb") as f:
+            pickle.dump(indice, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, archivo)
+    except OSError:
+        pass
+    return indice
@@ -0,0 +1,291 @@
+"""Verificación de integridad referencial de todas las tablas de la carpeta.
+
+Recorre las claves foráneas declaradas en el esquema (ver esquema.py) y
+comprueba, columna contra columna y sin iterar filas, que cada valor apunte a
+una fila existente de la tabla referida; además informa claves duplicadas.
+Solo se cargan las columnas clave y foráneas de cada tabla. Los valores nulos
+en una clave foránea no se consideran huérfanos.
+
+Uso: python integridad.py [carpeta] [--cada SEGUNDOS]
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import almacen
+import esquema
+
+# Cantidad de valores de ejemplo que se muestran por problema
+EJEMPLOS = 5
+
+# Rango máximo de claves enteras para verificar con una tabla de presencia
+# (un byte por valor posible); por encima se busca en el arreglo ordenado
+RANGO_TABLA = 50_000_000
+
+
+def pertenece(valores, referencia):
+    """Máscara booleana: qué valores están en referencia.
+
+    Para enteros se usa una tabla de presencia si el rango de la referencia
+    es acotado, o búsqueda binaria en la referencia ordenada; para el resto,
+    un conjunto hash (isin).
+    """
+    valores = pd.Series(valores)
+    referencia = pd.Series(referencia).dropna()
+    if pd.api.types.is_integer_dtype(valores) and pd.api.types.is_integer_dtype(referencia):
+        ordenada = np.unique(referencia.to_numpy(dtype="int64"))
+        buscados = valores.to_numpy(dtype="int64")
+        if len(ordenada) == 0:
+            return np.zeros(len(buscados), dtype=bool)
+        if ordenada[-1] - ordenada[0] <= RANGO_TABLA:
+            return np.isin(buscados, ordenada, kind="table")
+        posiciones = np.minimum(np.searchsorted(ordenada, buscados), len(ordenada) - 1)
+        return ordenada[posiciones] == buscados
+    return valores.isin(referencia).to_numpy()
+
+
+def _columnas_necesarias(tablas):
+    #Por tabla: su clave, sus foráneas y las columnas que otras tablas referencian
+    columnas = {nombre: ([entrada["clave"]] if entrada.get("clave") else []) for nombre, entrada in tablas.items()}
+    for nombre, entrada in tablas.items():
+        for foranea in entrada.get("foraneas", []):
+            columnas[nombre].append(foranea["columna"])
+            if foranea["tabla"] in columnas:
+                columnas[foranea["tabla"]].append(foranea["columna_ref"])
+    return columnas
+
+
+def _duplicados(tabla, df, clave):
+    valores = df[clave].dropna()
+    #Claves enteras estrictamente crecientes (el caso habitual) no pueden repetirse
+    if pd.api.types.is_integer_dtype(valores) and (np.diff(valores.to_numpy()) > 0).all():
+        return None
+    repetidos = valores[valores.duplicated(keep=False)]
+    if len(repetidos) == 0:
+        return None
+    return {"tabla": tabla, "columna": clave, "cantidad": int(len(repetidos)),
+            "ejemplos": repetidos.drop_duplicates().head(EJEMPLOS).tolist()}
+
+
+def _huerfanos(tabla, df, foranea, df_ref):
+    valores = df[foranea["columna"]].dropna()
+    faltan = valores[~pertenece(valores, df_ref[foranea["columna_ref"]])]
+    if len(faltan) == 0:
+        return None
+    return {"tabla": tabla, "columna": foranea["columna"], "tabla_ref": foranea["tabla"],
+            "columna_ref": foranea["columna_ref"], "cantidad": int(len(faltan)),
+            "ejemplos": faltan.drop_duplicates().head(EJEMPLOS).tolist()}
+
+
+def verificar(carpeta, reemplazos=None, solo=None):
+    """Verificar las tablas de la carpeta.
+
+    reemplazos: {nombre_csv: DataFrame} que se usan en lugar de lo que hay en
+    disco (para validar una tabla antes de guardarla). solo: si se indica, se
+    revisan únicamente las relaciones en las que participan esas tablas.
+    Devuelve {"huerfanos": [...], "duplicados": [...], "tablas": n, "segundos": s}.
+    """
+    inicio = time.perf_counter()
+    reemplazos = reemplazos or {}
+    tablas = {nombre: entrada for nombre, entrada in esquema.cargar_esquema(carpeta)["tablas"].items()
+              if nombre in reemplazos or os.path.exists(os.path.join(carpeta, nombre))}
+    relaciones = [(nombre, foranea) for nombre, entrada in tablas.items()
+                  for foranea in entrada.get("foraneas", []) if foranea["tabla"] in tablas]
+    revisar_claves = list(tablas)
+    if solo is not None:
+        relaciones = [(nombre, foranea) for nombre, foranea in relaciones
+                      if nombre in solo or foranea["tabla"] in solo]
+        revisar_claves = [nombre for nombre in tablas if nombre in solo]
+
+    usadas = set(revisar_claves) | {n for n, _ in relaciones} | {f["tabla"] for _, f in relaciones}
+    columnas = _columnas_necesarias(tablas)
+    datos = {}
+    for nombre in usadas:
+        if nombre in reemplazos:
+            datos[nombre] = reemplazos[nombre]
+        else:
+            datos[nombre] = almacen.leer_columnas(os.path.join(carpeta, nombre), columnas[nombre])
+
+    informe = {"huerfanos": [], "duplicados": []}
+    for nombre in revisar_claves:
+        clave = tablas[nombre].get("clave")
+        if clave and clave in datos[nombre].columns:
+            problema = _duplicados(nombre, datos[nombre], clave)
+            if problema:
+                informe["duplicados"].append(problema)
+    for nombre, foranea in relaciones:
+        df, df_ref = datos[nombre], datos[foranea["tabla"]]
+        if foranea["columna"] in df.columns and foranea["columna_ref"] in df_ref.columns:
+            problema = _huerfanos(nombre, df, foranea, df_ref)
+            if problema:
+                informe["huerfanos"].append(problema)
+    informe["tablas"] = len(usadas)
+    informe["segundos"] = time.perf_counter() - inicio
+    return informe
+
+
+def verificar_tabla(ruta, df):
+    """Verificar df como nuevo contenido de la tabla en ruta, antes de guardarlo"""
+    nombre = os.path.basename(ruta)
+    return verificar(os.path.dirname(ruta) or ".", reemplazos={nombre: df}, solo={nombre})
+
+
+def _como(valores, serie):
+    #Valores de operaciones convertidos al tipo de la columna para compararlos
+    valores = pd.Series(list(valores))
+    try:
+        return valores.astype(serie.dtype)
+    except (TypeError, ValueError):
+        return valores
+
+
+def _nuevos_problemas(despues, antes):
+    #Problemas de despues que no estaban en antes (o que afectan a más filas)
+    previos = {(tipo, p["tabla"], p["columna"], p.get("tabla_ref")): p["cantidad"]
+               for tipo in ("huerfanos", "duplicados") for p in antes[tipo]}
+    for tipo in ("huerfanos", "duplicados"):
+        despues[tipo] = [p for p in despues[tipo]
+                         if p["cantidad"] > previos.get((tipo, p["tabla"], p["columna"], p.get("tabla_ref")), 0)]
+    return despues
+
+
+def verificar_cambios(ruta, df, cambios=None):
+    """Verificar solo lo que cambian las operaciones de un RegistroCambios.
+
+    df es la tabla en ruta con los cambios ya aplicados. Se informan
+    únicamente los problemas que introduciría guardar: claves insertadas o
+    cambiadas que se repiten, foráneas nuevas que no apuntan a ninguna fila y
+    filas de otras tablas que se quedan sin la fila que referenciaban (por una
+    eliminación o un cambio de clave). Los problemas que ya había en disco no
+    impiden guardar. Sin cambios, o con una reescritura completa, se verifica
+    toda la tabla y se descuenta lo que ya había.
+    """
+    inicio = time.perf_counter()
+    carpeta = os.path.dirname(ruta) or "."
+    nombre = os.path.basename(ruta)
+    if cambios is None or cambios.reescritura_completa:
+        informe = verificar_tabla(ruta, df)
+        if os.path.exists(ruta):
+            informe = _nuevos_problemas(informe, verificar(carpeta, solo={nombre}))
+        informe["segundos"] = time.perf_counter() - inicio
+        return informe
+
+    tablas = esquema.cargar_esquema(carpeta)["tablas"]
+    entrada = tablas.get(nombre, {})
+    clave = entrada.get("clave")
+    foraneas = [f for f in entrada.get("foraneas", []) if f["columna"] in df.columns]
+    claves_nuevas, claves_quitadas = [], []
+    foraneas_nuevas = {f["columna"]: [] for f in foraneas}
+    for op in cambios.operaciones:
+        por_clave = op.get("columna_clave") == clave
+        if op["op"] == "insertar":
+            valores = op["fila"]
+            if clave in valores:
+                claves_nuevas.append(valores[clave])
+        elif op["op"] == "modificar":
+            valores = op["valores"]
+            if clave in valores:
+                claves_nuevas.append(valores[clave])
+                claves_quitadas.append(op["clave"] if por_clave else op.get("anteriores", {}).get(clave))
+        else:
+            valores = {}
+            claves_quitadas.append(op["clave"] if por_clave else op.get("fila", {}).get(clave))
+        for col, nuevos in foraneas_nuevas.items():
+            if valores.get(col) is not None:
+                nuevos.append(valores[col])
+
+    informe = {"huerfanos": [], "duplicados": []}
+    leidas = set()
+    if clave and claves_nuevas and clave in df.columns:
+        serie = df[clave]
+        repetidos = serie[serie.isin(_como(claves_nuevas, serie)) & serie.duplicated(keep=False)]
+        if len(repetidos):
+            informe["duplicados"].append({"tabla": nombre, "columna": clave, "cantidad": int(len(repetidos)),
+                                          "ejemplos": repetidos.drop_duplicates().head(EJEMPLOS).tolist()})
+    for foranea in foraneas:
+        nuevos = foraneas_nuevas[foranea["columna"]]
+        if not nuevos or foranea["tabla"] not in tablas:
+            continue
+        if foranea["tabla"] == nombre:
+            df_ref = df
+        else:
+            ruta_ref = os.path.join(carpeta, foranea["tabla"])
+            if not os.path.exists(ruta_ref):
+                continue
+            df_ref = almacen.leer_columnas(ruta_ref, _columnas_necesarias(tablas)[foranea["tabla"]])
+            leidas.add(foranea["tabla"])
+        problema = _huerfanos(nombre, pd.DataFrame({foranea["columna"]: _como(nuevos, df[foranea["columna"]])}),
+                              foranea, df_ref)
+        if problema:
+            informe["huerfanos"].append(problema)
+
+    # Claves que dejan de existir: las filas que las referenciaban quedan huérfanas
+    quitadas = [valor for valor in claves_quitadas if valor is not None]
+    if clave and quitadas and clave in df.columns:
+        quitadas = _como(quitadas, df[clave])
+        quitadas = quitadas[~quitadas.isin(df[clave])]
+        for otra, entrada_otra in tablas.items():
+            for foranea in entrada_otra.get("foraneas", []):
+                if foranea["tabla"] != nombre or foranea["columna_ref"] != clave or len(quitadas) == 0:
+                    continue
+                if otra == nombre:
+                    df_otra = df
+                else:
+                    ruta_otra = os.path.join(carpeta, otra)
+                    if not os.path.exists(ruta_otra):
+                        continue
+                    df_otra = almacen.leer_columnas(ruta_otra, _columnas_necesarias(tablas)[otra])
+                    leidas.add(otra)
+                referencias = df_otra[foranea["columna"]].dropna()
+                faltan = referencias[pertenece(referencias, quitadas)]
+                if len(faltan):
+                    informe["huerfanos"].append({
+                        "tabla": otra, "columna": foranea["columna"], "tabla_ref": nombre,
+                        "columna_ref": clave, "cantidad": int(len(faltan)),
+                        "ejemplos": faltan.drop_duplicates().head(EJEMPLOS).tolist()})
+    informe["tablas"] = len(leidas) + 1
+    informe["segundos"] = time.perf_counter() - inicio
+    return informe
+
+
+def hay_problemas(informe):
+    return bool(informe["huerfanos"] or informe["duplicados"])
+
+
+def formatear_informe(informe):
+    """Líneas de texto que describen los problemas del informe"""
+    lineas = []
+    for p in informe["duplicados"]:
+        lineas.append(f"{p['tabla']}: {p['cantidad']} filas con {p['columna']} duplicado "
+                      f"(p. ej. {', '.join(map(str, p['ejemplos']))})")
+    for p in informe["huerfanos"]:
+        lineas.append(f"{p['tabla']}.{p['columna']}: {p['cantidad']} valores sin fila en "
+                      f"{p['tabla_ref']}.{p['columna_ref']} (p. ej. {', '.join(map(str, p['ejemplos']))})")
+    return lineas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificar la integridad referencial de los CSV")
+    parser.add_argument("carpeta", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--cada", type=float, default=None,
+                        help="Repetir la verificación cada tantos segundos")
+    args = parser.parse_args()
+    while True:
+        informe = verificar(args.carpeta)
+        print(f" [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {informe['tablas']} tablas "
+              f"verificadas en {informe['segundos']:.2f} s")
+        for linea in formatear_informe(informe):
+            print(f"   {linea}")
+        if not hay_problemas(informe):
+            print("   Sin problemas de integridad")
+        if args.cada is None:
+            return 1 if hay_problemas(informe) else 0
+        time.sleep(args.cada)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
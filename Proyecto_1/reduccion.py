@@ -0,0 +1,112 @@
+"""Reducción de datos para gráficos: que lo que se envía al navegador no crezca
+con la tabla.
+
+Los histogramas se agrupan en intervalos con NumPy, los diagramas de caja se
+describen con sus cuartiles, las series temporales se submuestrean con LTTB
+(Largest-Triangle-Three-Buckets, que conserva picos y forma) y las nubes de
+puntos grandes se convierten en una grilla de densidad.
+"""
+import numpy as np
+import pandas as pd
+
+# Intervalos por defecto de un histograma
+INTERVALOS_HISTOGRAMA = 50
+
+# Puntos máximos de una serie temporal después de submuestrear
+PUNTOS_SERIE = 2000
+
+# Filas a partir de las cuales una nube de puntos se dibuja como densidad
+UMBRAL_DENSIDAD = 5000
+
+# Celdas por eje de la grilla de densidad
+CELDAS_DENSIDAD = 80
+
+# Valores atípicos que se dibujan como máximo por diagrama de caja
+ATIPICOS_CAJA = 200
+
+
+def _numeros(serie):
+    valores = pd.to_numeric(pd.Series(serie), errors="coerce").to_numpy(dtype="float64")
+    return valores[np.isfinite(valores)]
+
+
+def histograma(serie, intervalos=INTERVALOS_HISTOGRAMA):
+    """(centros, conteos, anchos) del histograma de la serie"""
+    valores = _numeros(serie)
+    if len(valores) == 0:
+        return np.array([]), np.array([]), np.array([])
+    # Enteros con pocos valores distintos: un intervalo por valor
+    minimo, maximo = valores.min(), valores.max()
+    if np.all(valores == np.round(valores)) and maximo - minimo < intervalos:
+        bordes = np.arange(minimo - 0.5, maximo + 1.5)
+    else:
+        bordes = np.histogram_bin_edges(valores, bins=intervalos)
+    conteos, bordes = np.histogram(valores, bins=bordes)
+    return (bordes[:-1] + bordes[1:]) / 2, conteos, np.diff(bordes)
+
+
+def cuartiles(serie, atipicos=ATIPICOS_CAJA):
+    """Estadísticos de un diagrama de caja (bigotes de Tukey, 1.5 * IQR).
+
+    Devuelve None si la serie no tiene valores numéricos; si no, un diccionario
+    con q1, mediana, q3, limite_inferior, limite_superior y hasta atipicos
+    valores atípicos (los más extremos).
+    """
+    valores = _numeros(serie)
+    if len(valores) == 0:
+        return None
+    q1, mediana, q3 = np.percentile(valores, [25, 50, 75])
+    rango = q3 - q1
+    dentro = valores[(valores >= q1 - 1.5 * rango) & (valores <= q3 + 1.5 * rango)]
+    fuera = valores[(valores < q1 - 1.5 * rango) | (valores > q3 + 1.5 * rango)]
+    if len(fuera) > atipicos:
+        # Los más alejados de la mediana
+        fuera = fuera[np.argsort(np.abs(fuera - mediana))[-atipicos:]]
+    return {"q1": q1, "mediana": mediana, "q3": q3,
+            "limite_inferior": dentro.min(), "limite_superior": dentro.max(),
+            "atipicos": fuera}
+
+
+def lttb(x, y, puntos=PUNTOS_SERIE):
+    """Posiciones de los puntos que conserva LTTB al reducir (x, y) a puntos.
+
+    x debe estar ordenado. Se conservan siempre el primero y el último.
+    """
+    n = len(x)
+    if puntos >= n or puntos < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    bordes = np.linspace(1, n - 1, puntos - 1).astype(np.int64)
+    elegidos = np.empty(puntos, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    anterior = 0
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        # Promedio del grupo siguiente: tercer vértice del triángulo
+        siguiente_fin = bordes[i + 2] if i + 2 < len(bordes) else n
+        media_x = x[fin:siguiente_fin].mean() if siguiente_fin > fin else x[-1]
+        media_y = y[fin:siguiente_fin].mean() if siguiente_fin > fin else y[-1]
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fin] - y[anterior])
+                       - (x[anterior] - x[inicio:fin]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.argmax(areas))
+        elegidos[i + 1] = anterior
+    return elegidos
+
+
+def submuestrear_serie(fechas, valores, puntos=PUNTOS_SERIE):
+    """Serie ordenada por fecha y reducida con LTTB: (fechas, valores)"""
+    serie = pd.DataFrame({"x": pd.to_datetime(fechas, errors="coerce"),
+                          "y": pd.to_numeric(valores, errors="coerce")}).dropna()
+    serie = serie.sort_values("x", kind="stable")
+    posiciones = lttb(serie["x"].to_numpy(dtype="datetime64[ns]").astype("int64"), serie["y"].to_numpy(), puntos)
+    reducida = serie.iloc[posiciones]
+    return reducida["x"], reducida["y"]
+
+
+def densidad(x, y, celdas=CELDAS_DENSIDAD):
+    """Grilla de conteos de (x, y): (centros_x, centros_y, conteos[y, x])"""
+    datos = pd.DataFrame({"x": pd.to_numeric(x, errors="coerce"),
+                          "y": pd.to_numeric(y, errors="coerce")}).dropna()
+    conteos, bordes_x, bordes_y = np.histogram2d(datos["x"], datos["y"], bins=celdas)
+    return (bordes_x[:-1] + bordes_x[1:]) / 2, (bordes_y[:-1] + bordes_y[1:]) / 2, conteos.T
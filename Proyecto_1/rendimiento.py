@@ -0,0 +1,273 @@
+"""Mediciones de rendimiento de las operaciones del gestor.
+
+Cada operación instrumentada (cargar y guardar tablas, búsquedas, gráficos y
+exportaciones) se envuelve en medir() o en el decorador medido(). Mientras la
+medición está desactivada, medir() devuelve un contexto vacío y medido() llama
+directamente a la función, así que el costo es una comprobación por llamada.
+Activada, cada operación registra su tiempo de reloj, las filas procesadas y
+el pico de memoria asignada durante la operación (con tracemalloc, que
+enlentece las asignaciones mientras está encendido). Las mediciones quedan en
+memoria (las últimas MEDICIONES_EN_MEMORIA) y, si se indica un registro, se
+agregan a un archivo JSON lines para analizarlas después.
+
+tracemalloc cuenta la memoria de todo el proceso, así que el pico lo mide un
+solo hilo a la vez: cuando dos hilos (dos sesiones del tablero) miden
+operaciones que se superponen, ninguna de las dos registra memoria_pico
+(queda None) y solo cuentan tiempo y filas. Lo que asignen hilos que no
+están midiendo sí se suma al pico.
+
+Uso: python rendimiento.py registro.jsonl   (resumen por operación de un registro)
+"""
+import argparse
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+# Mediciones que se conservan en memoria (las más viejas se descartan)
+MEDICIONES_EN_MEMORIA = 1000
+
+_activo = False
+_registro = None  # archivo JSON lines donde se agrega cada medición
+_tracemalloc_propio = False  # tracemalloc lo encendió activar() y lo apaga desactivar()
+_mediciones = deque(maxlen=MEDICIONES_EN_MEMORIA)
+_bloqueo = threading.Lock()
+_hilos = threading.local()  # mediciones abiertas de cada hilo, para propagar el pico de memoria
+_bloqueo_memoria = threading.RLock()  # hilo que está midiendo memoria (reentrante para las anidadas)
+_superpuestas = 0  # mediciones que empezaron mientras otro hilo medía memoria
+
+
+def activar(registro=None, memoria=True):
+    """Empezar a medir. registro: archivo JSON lines donde agregar cada medición;
+    memoria: medir el pico de memoria con tracemalloc"""
+    global _activo, _registro, _tracemalloc_propio
+    with _bloqueo:
+        _registro = registro
+        if memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_propio = True
+        _activo = True
+
+
+def desactivar():
+    """Dejar de medir (las mediciones ya tomadas se conservan)"""
+    global _activo, _tracemalloc_propio
+    with _bloqueo:
+        _activo = False
+        if _tracemalloc_propio:
+            tracemalloc.stop()
+            _tracemalloc_propio = False
+
+
+def activo():
+    return _activo
+
+
+def registro():
+    """Archivo JSON lines donde se agregan las mediciones (None si solo quedan en memoria)"""
+    return _registro
+
+
+def _abiertas():
+    if not hasattr(_hilos, "pila"):
+        _hilos.pila = []
+    return _hilos.pila
+
+
+class Medicion:
+    """Una operación medida; se registra al salir del bloque with.
+
+    Dentro del bloque se pueden completar filas y detalles (por ejemplo la
+    cantidad de resultados) cuando recién se conocen al final.
+    """
+
+    __slots__ = ("operacion", "filas", "detalles", "inicio", "segundos", "memoria_pico",
+                 "_reloj", "_memoria_inicial", "_pico", "_midiendo_memoria", "_superpuestas")
+
+    def __init__(self, operacion, filas=None, detalles=None):
+        self.operacion = operacion
+        self.filas = filas
+        self.detalles = detalles or {}
+        self.inicio = None
+        self.segundos = None
+        self.memoria_pico = None  # bytes asignados por encima de los del comienzo
+        self._memoria_inicial = None
+        self._pico = 0
+        self._midiendo_memoria = False
+        self._superpuestas = 0
+
+    def __enter__(self):
+        global _superpuestas
+        self.inicio = datetime.now()
+        abiertas = _abiertas()
+        # Sin esperar: si otro hilo está midiendo memoria, ni esta medición ni esa tienen pico válido
+        if tracemalloc.is_tracing() and not _bloqueo_memoria.acquire(blocking=False):
+            with _bloqueo:
+                _superpuestas += 1
+        elif tracemalloc.is_tracing():
+            self._midiendo_memoria = True
+            self._superpuestas = _superpuestas
+            # reset_peak es global: el pico hasta acá se guarda en la medición que contiene a esta
+            actual, pico = tracemalloc.get_traced_memory()
+            if abiertas:
+                abiertas[-1]._pico = max(abiertas[-1]._pico, pico)
+            tracemalloc.reset_peak()
+            self._memoria_inicial = self._pico = actual
+        abiertas.append(self)
+        self._reloj = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.segundos = time.perf_counter() - self._reloj
+        abiertas = _abiertas()
+        abiertas.pop()
+        if self._midiendo_memoria:
+            if tracemalloc.is_tracing():
+                self._pico = max(self._pico, tracemalloc.get_traced_memory()[1])
+                if _superpuestas == self._superpuestas:
+                    self.memoria_pico = self._pico - self._memoria_inicial
+                if abiertas:
+                    abiertas[-1]._pico = max(abiertas[-1]._pico, self._pico)
+            _bloqueo_memoria.release()
+        if tipo is not None:
+            self.detalles["error"] = tipo.__name__
+        _registrar(self)
+        return False
+
+    def como_dict(self):
+        return {
+            "operacion": self.operacion,
+            "inicio": self.inicio.isoformat(timespec="milliseconds"),
+            "segundos": round(self.segundos, 6),
+            "filas": self.filas,
+            "memoria_pico": self.memoria_pico,
+            "detalles": self.detalles,
+        }
+
+
+class _SinMedir:
+    #Contexto vacío de medir() cuando la medición está desactivada
+    __slots__ = ()
+    filas = None
+
+    @property
+    def detalles(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        return False
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+
+_SIN_MEDIR = _SinMedir()
+
+
+def medir(operacion, filas=None, **detalles):
+    """Contexto que mide el bloque como operacion (no hace nada si la medición está desactivada)"""
+    if not _activo:
+        return _SIN_MEDIR
+    return Medicion(operacion, filas, detalles)
+
+
+def medido(operacion, filas=None):
+    """Decorador que mide cada llamada a la función como operacion.
+
+    filas, si se da, calcula las filas procesadas a partir de los mismos
+    argumentos de la función (por ejemplo len para una función que recibe un
+    DataFrame).
+    """
+    def decorar(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not _activo:
+                return funcion(*args, **kwargs)
+            with Medicion(operacion, filas(*args, **kwargs) if filas else None):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorar
+
+
+def _registrar(medicion):
+    entrada = medicion.como_dict()
+    _mediciones.append(entrada)
+    if _registro is not None:
+        with _bloqueo:
+            with open(_registro, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entrada, ensure_ascii=False, default=str) + "\n")
+
+
+def mediciones():
+    """Mediciones en memoria, de la más vieja a la más nueva"""
+    return list(_mediciones)
+
+
+def limpiar():
+    """Descartar las mediciones en memoria (el registro en disco no se toca)"""
+    _mediciones.clear()
+
+
+def lineas_json(entradas=None):
+    """Mediciones como texto JSON lines (por defecto las que están en memoria)"""
+    return "".join(json.dumps(entrada, ensure_ascii=False, default=str) + "\n"
+                   for entrada in (mediciones() if entradas is None else entradas))
+
+
+def volcar(ruta):
+    """Escribir las mediciones en memoria en ruta como JSON lines; devuelve cuántas se escribieron"""
+    entradas = mediciones()
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(lineas_json(entradas))
+    return len(entradas)
+
+
+def leer_registro(ruta):
+    """Mediciones de un archivo JSON lines escrito por el registro o por volcar()"""
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def resumen(entradas=None):
+    """DataFrame con una fila por operación: veces, tiempos, filas y pico de memoria"""
+    entradas = mediciones() if entradas is None else entradas
+    columnas = ["Operación", "Veces", "Total (s)", "Promedio (ms)", "Máximo (ms)",
+                "Filas", "Filas/s", "Memoria pico (MB)"]
+    if not entradas:
+        return pd.DataFrame(columns=columnas)
+    datos = pd.DataFrame(entradas, columns=["operacion", "segundos", "filas", "memoria_pico"])
+    datos[["filas", "memoria_pico"]] = datos[["filas", "memoria_pico"]].astype("float64")
+    grupos = datos.groupby("operacion", sort=False)
+    tabla = pd.DataFrame({
+        "Veces": grupos.size(),
+        "Total (s)": grupos["segundos"].sum().round(3),
+        "Promedio (ms)": (grupos["segundos"].mean() * 1000).round(2),
+        "Máximo (ms)": (grupos["segundos"].max() * 1000).round(2),
+        "Filas": grupos["filas"].sum(min_count=1),
+        "Memoria pico (MB)": (grupos["memoria_pico"].max() / 1024**2).round(2),
+    })
+    tabla.insert(5, "Filas/s", (tabla["Filas"] / grupos["segundos"].sum()).round(0))
+    return (tabla.sort_values("Total (s)", ascending=False)
+            .rename_axis("Operación").reset_index()[columnas])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumir un registro de mediciones de rendimiento")
+    parser.add_argument("registro", help="Archivo JSON lines con las mediciones")
+    args = parser.parse_args()
+    entradas = leer_registro(args.registro)
+    print(f" {len(entradas)} mediciones en {args.registro}")
+    if entradas:
+        print(resumen(entradas).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Secuencias persistentes para las columnas de ID de cada tabla.
+
+El último ID entregado de cada tabla se guarda en ARCHIVO_SECUENCIAS, en la
+misma carpeta que los CSV, de modo que pedir el siguiente ID no requiere
+recorrer la columna. Las reservas se hacen bajo un bloqueo entre procesos, así
+dos sesiones que insertan a la vez nunca reciben el mismo valor.
+"""
+import os
+
+import pandas as pd
+
+import almacen
+
+ARCHIVO_SECUENCIAS = "secuencias.json"
+
+
+def _ruta_secuencias(ruta):
+    return os.path.join(os.path.dirname(ruta), ARCHIVO_SECUENCIAS)
+
+
+def _leer(ruta):
+    return almacen.leer_json(_ruta_secuencias(ruta)) or {}
+
+
+def maximo_en_datos(df, columna_id):
+    """Mayor valor numérico de la columna (0 si no hay ninguno)"""
+    if df is None or df.empty or columna_id not in df.columns:
+        return 0
+    ids_numericos = pd.to_numeric(df[columna_id], errors='coerce').dropna()
+    return int(ids_numericos.max()) if len(ids_numericos) > 0 else 0
+
+
+def _entrada(secuencias, ruta, columna_id, df):
+    #Entrada de la tabla; si no existe (o cambió la columna) se inicializa desde los datos
+    tabla = os.path.basename(ruta)
+    entrada = secuencias.get(tabla)
+    if entrada is None or entrada.get("columna") != columna_id:
+        if df is None and almacen.version_tabla(ruta) is not None:
+            df = almacen.leer_columnas(ruta, [columna_id])
+        entrada = {"columna": columna_id, "ultimo": maximo_en_datos(df, columna_id)}
+        secuencias[tabla] = entrada
+    return entrada
+
+
+def columna_registrada(ruta):
+    """Columna de ID registrada para la tabla (None si todavía no tiene secuencia)"""
+    entrada = _leer(ruta).get(os.path.basename(ruta))
+    return entrada["columna"] if entrada else None
+
+
+def consultar(ruta, columna_id, df=None):
+    """Siguiente ID que se entregaría, sin reservarlo"""
+    secuencias = _leer(ruta)
+    if os.path.basename(ruta) not in secuencias:
+        return reservar(ruta, columna_id, cantidad=0, df=df)
+    return _entrada(secuencias, ruta, columna_id, df)["ultimo"] + 1
+
+
+def reservar(ruta, columna_id, cantidad=1, df=None):
+    """Reservar cantidad IDs consecutivos y devolver el primero"""
+    archivo = _ruta_secuencias(ruta)
+    with almacen.bloqueo(archivo):
+        secuencias = _leer(ruta)
+        entrada = _entrada(secuencias, ruta, columna_id, df)
+        primero = entrada["ultimo"] + 1
+        entrada["ultimo"] += cantidad
+        almacen.escribir_json_atomico(archivo, secuencias)
+    return primero
+
+
+def registrar_uso(ruta, columna_id, valor, df=None):
+    """Avisar que se usó un ID elegido a mano, para no volver a entregarlo"""
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        return
+    archivo = _ruta_secuencias(ruta)
+    with almacen.bloqueo(archivo):
+        secuencias = _leer(ruta)
+        entrada = _entrada(secuencias, ruta, columna_id, df)
+        if valor > entrada["ultimo"]:
+            entrada["ultimo"] = valor
+            almacen.escribir_json_atomico(archivo, secuencias)
+
+
+def resincronizar(ruta, columna_id, df):
+    """Volver a calcular la secuencia a partir de los datos. Devuelve el siguiente ID"""
+    archivo = _ruta_secuencias(ruta)
+    with almacen.bloqueo(archivo):
+        secuencias = _leer(ruta)
+        secuencias[os.path.basename(ruta)] = {"columna": columna_id,
+                                              "ultimo": maximo_en_datos(df, columna_id)}
+        almacen.escribir_json_atomico(archivo, secuencias)
+    return secuencias[os.path.basename(ruta)]["ultimo"] + 1
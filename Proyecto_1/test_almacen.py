@@ -0,0 +1,60 @@
+"""Pruebas del diario de cambios de almacen.
+
+Uso: python -m unittest test_almacen   (o pytest, desde la carpeta Proyecto_1)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import almacen
+import estadisticas
+
+
+class DiarioConInserciones(unittest.TestCase):
+    """Una clave eliminada o renombrada que se vuelve a insertar no debe
+    confundirse con la fila que la tenía antes"""
+
+    def setUp(self):
+        self.carpeta = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.carpeta, "tabla.csv")
+        pd.DataFrame({"id": [1, 2, 3], "nombre": ["a", "b", "c"]}).to_csv(self.ruta, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.carpeta)
+
+    def guardar(self, *operaciones):
+        cambios = almacen.RegistroCambios()
+        for metodo, *argumentos in operaciones:
+            getattr(cambios, metodo)(*argumentos)
+        almacen.aplicar_cambios(self.ruta, cambios)
+
+    def filas(self):
+        return dict(almacen.leer_tabla(self.ruta)[["id", "nombre"]].itertuples(index=False))
+
+    def comprobar(self, esperado):
+        self.assertEqual(self.filas(), esperado)
+        self.assertEqual(estadisticas.actualizar_estadisticas(self.ruta, forzar=True)[0].filas, len(esperado))
+        almacen.compactar(self.ruta)
+        self.assertEqual(self.filas(), esperado)
+
+    def test_eliminar_y_volver_a_insertar(self):
+        self.guardar(("eliminar", "id", 2))
+        self.guardar(("insertar", {"id": 2, "nombre": "nuevo"}))
+        self.comprobar({1: "a", 3: "c", 2: "nuevo"})
+
+    def test_renombrar_y_volver_a_insertar(self):
+        self.guardar(("modificar", "id", 3, {"id": 7}))
+        self.guardar(("insertar", {"id": 3, "nombre": "otro"}))
+        self.comprobar({1: "a", 2: "b", 7: "c", 3: "otro"})
+
+    def test_en_el_mismo_registro(self):
+        self.guardar(("eliminar", "id", 2), ("insertar", {"id": 2, "nombre": "nuevo"}),
+                     ("modificar", "id", 2, {"nombre": "nuevo2"}))
+        self.comprobar({1: "a", 3: "c", 2: "nuevo2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
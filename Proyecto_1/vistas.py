@@ -0,0 +1,156 @@
+"""Vista materializada de ventas: una fila por línea de factura con todos sus atributos.
+
+Une factura_det -> factura_enc -> cliente -> localidad -> provincia,
+producto -> rubro / proveedor, cond_iva y venta, y calcula el importe de cada
+línea (cantidad * precio). El resultado se guarda en formato binario dentro de
+CARPETA_CACHE junto con la huella de cada tabla de origen. Si desde la última
+vez solo se anexaron facturas (las dimensiones no cambiaron y factura_det,
+factura_enc y venta solo crecieron al final), se unen únicamente las líneas
+nuevas o las de facturas afectadas; en cualquier otro caso se reconstruye.
+
+Uso: python vistas.py [carpeta]
+"""
+import argparse
+import os
+
+import pandas as pd
+
+import almacen
+
+# Tablas que pueden crecer por anexado sin obligar a reconstruir la vista
+TABLAS_HECHOS = ["factura_det.csv", "factura_enc.csv", "venta.csv"]
+TABLAS_DIMENSION = ["cliente.csv", "localidad.csv", "provincia.csv", "producto.csv",
+                    "rubro.csv", "proveedor.csv", "cond_iva.csv"]
+
+
+def _ruta_vista(carpeta, nombre):
+    return os.path.join(carpeta, almacen.CARPETA_CACHE, nombre)
+
+
+def cargar_tablas(carpeta, nombres=TABLAS_HECHOS + TABLAS_DIMENSION):
+    """Tablas de la carpeta por nombre de archivo"""
+    return {nombre: almacen.leer_tabla(os.path.join(carpeta, nombre)) for nombre in nombres}
+
+
+def _dimensiones(tablas):
+    #Tablas de dimensión ya unidas entre sí y con nombres de columna sin ambigüedad
+    localidad = (tablas["localidad.csv"].rename(columns={"nombre": "localidad"})
+                 .merge(tablas["provincia.csv"].rename(columns={"nombre": "provincia"}),
+                        on="id_provincia", how="left"))
+    cliente = (tablas["cliente.csv"].rename(columns={"nombre": "cliente"})
+               .merge(localidad, on="id_localidad", how="left"))
+    producto = (tablas["producto.csv"].rename(columns={"descripcion": "producto"})
+                .merge(tablas["rubro.csv"].rename(columns={"descripcion": "rubro"}),
+                       on="id_rubro", how="left")
+                .merge(tablas["proveedor.csv"].rename(columns={"nombre": "proveedor"}),
+                       on="id_proveedor", how="left"))
+    cond_iva = tablas["cond_iva.csv"].rename(columns={"descripcion": "cond_iva"})
+    venta = (tablas["venta.csv"].drop_duplicates("id_factura_enc")
+             .rename(columns={"monto": "monto_factura"}))
+    return cliente, producto, cond_iva, venta
+
+
+def unir_lineas(lineas, tablas, dimensiones=None):
+    """Desnormalizar líneas de factura_det con el resto de las tablas"""
+    cliente, producto, cond_iva, venta = dimensiones or _dimensiones(tablas)
+    vista = (lineas
+             .merge(tablas["factura_enc.csv"], on="id_factura_enc", how="left")
+             .merge(cliente, on="id_cliente", how="left")
+             .merge(producto, on="id_producto", how="left")
+             .merge(cond_iva, on="id_cond_iva", how="left")
+             .merge(venta, on="id_factura_enc", how="left"))
+    vista["fecha"] = pd.to_datetime(vista["fecha"], errors="coerce")
+    vista["importe"] = vista["cantidad"] * vista["precio"]
+    return vista
+
+
+def huellas_origen(carpeta):
+    """Huella de contenido actual de cada tabla de origen de la vista"""
+    return {nombre: almacen.huella_contenido(os.path.join(carpeta, nombre))
+            for nombre in TABLAS_HECHOS + TABLAS_DIMENSION}
+
+
+def _incremental(carpeta, meta):
+    #La vista previa sirve como base si las dimensiones no cambiaron y los hechos solo crecieron
+    for nombre in TABLAS_DIMENSION:
+        if almacen.huella_contenido(os.path.join(carpeta, nombre)) != meta["huellas"].get(nombre):
+            return False
+    return all(nombre in meta["huellas"]
+               and almacen.solo_anexado(os.path.join(carpeta, nombre), meta["huellas"][nombre])
+               for nombre in TABLAS_HECHOS)
+
+
+def actualizar_vista_ventas(carpeta, forzar=False):
+    """Devolver la vista de ventas al día, actualizándola en disco si hizo falta.
+
+    Devuelve (vista, modo) con modo "vigente", "incremental" o "completa".
+    """
+    vista, modo, _, _ = refrescar_vista(carpeta, forzar)
+    return vista, modo
+
+
+def huellas_vista(carpeta):
+    """Huellas de origen con las que se construyó la vista guardada (None si no hay)"""
+    meta = almacen.leer_json(_ruta_vista(carpeta, "ventas.meta.json"))
+    return meta["huellas"] if meta else None
+
+
+def refrescar_vista(carpeta, forzar=False):
+    """Como actualizar_vista_ventas, pero devuelve también las líneas cambiadas.
+
+    Devuelve (vista, modo, quitadas, agregadas): en modo "incremental" son las
+    filas de la vista anterior que se descartaron y las que se unieron de nuevo;
+    en "vigente" ambas están vacías y en "completa" son None.
+    """
+    archivo = _ruta_vista(carpeta, "ventas." + almacen.FORMATO_BINARIO)
+    archivo_meta = _ruta_vista(carpeta, "ventas.meta.json")
+    meta = almacen.leer_json(archivo_meta)
+    huellas = huellas_origen(carpeta)
+
+    if not forzar and meta and os.path.exists(archivo) and meta.get("formato") == almacen.FORMATO_BINARIO:
+        if meta["huellas"] == huellas:
+            vista = almacen.leer_binario(archivo)
+            return vista, "vigente", vista.iloc[:0], vista.iloc[:0]
+        if _incremental(carpeta, meta):
+            previa = almacen.leer_binario(archivo)
+            tablas = cargar_tablas(carpeta)
+            det, enc, venta = (tablas[n] for n in TABLAS_HECHOS)
+            #Solo se anexaron filas: las nuevas son las que siguen a las ya vistas.
+            #Se unen las líneas nuevas y las de facturas cuyo encabezado o venta llegó después
+            filas = meta["filas"]
+            afectadas = pd.concat([enc["id_factura_enc"].iloc[filas["factura_enc.csv"]:],
+                                   venta["id_factura_enc"].iloc[filas["venta.csv"]:]])
+            rehacer = det["id_factura_enc"].isin(afectadas)
+            rehacer.iloc[filas["factura_det.csv"]:] = True
+            descartar = previa["id_factura_det"].isin(det.loc[rehacer, "id_factura_det"])
+            agregadas = unir_lineas(det[rehacer], tablas)
+            vista = pd.concat([previa[~descartar], agregadas], ignore_index=True)
+            _guardar(vista, tablas, huellas, archivo, archivo_meta)
+            return vista, "incremental", previa[descartar], agregadas
+
+    tablas = cargar_tablas(carpeta)
+    vista = unir_lineas(tablas["factura_det.csv"], tablas)
+    _guardar(vista, tablas, huellas, archivo, archivo_meta)
+    return vista, "completa", None, None
+
+
+def _guardar(vista, tablas, huellas, archivo, archivo_meta):
+    almacen.escribir_binario(vista, archivo)
+    almacen.escribir_json_atomico(archivo_meta, {
+        "formato": almacen.FORMATO_BINARIO,
+        "huellas": huellas,
+        "filas": {nombre: len(tablas[nombre]) for nombre in TABLAS_HECHOS},
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Actualizar la vista materializada de ventas")
+    parser.add_argument("carpeta", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--completa", action="store_true", help="Reconstruir desde cero")
+    args = parser.parse_args()
+    vista, modo = actualizar_vista_ventas(args.carpeta, forzar=args.completa)
+    print(f" Vista de ventas ({modo}): {len(vista)} líneas, importe total {vista['importe'].sum():,.2f}")
+
+
+if __name__ == "__main__":
+    main()